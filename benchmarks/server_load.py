@@ -0,0 +1,88 @@
+"""
+Load test of the render server (pydx7.server).
+
+Starts a server in a subprocess, then renders random single-note jobs from
+several client threads at once and reports throughput, latency percentiles
+and the mean batch size the server formed.
+
+    python benchmarks/server_load.py --clients 8 --requests 50 [carts/]
+
+Random patches are used when no cart files are given.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+from pydx7.synth import midi_note
+from pydx7.server import RenderClient
+
+def client_loop(path,n_requests,n_patches,seed,latencies,samples):
+    rng = np.random.default_rng(seed)
+    with RenderClient(path) as client:
+        for _ in range(n_requests):
+            seq = [midi_note(int(rng.integers(36,84)),int(rng.integers(40,127)),
+                             int(rng.integers(50,300)),100)]
+            t0 = time.perf_counter()
+            with client.render(int(rng.integers(n_patches)),seq) as audio:
+                samples.append(len(audio))
+            latencies.append(time.perf_counter() - t0)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('patches',nargs='*',help='cart files or directories of cart files')
+    parser.add_argument('--clients',type=int,default=8)
+    parser.add_argument('--requests',type=int,default=50,help='requests per client')
+    parser.add_argument('--batch-window',type=float,default=0.002)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        patches = args.patches
+        if len(patches) == 0:
+            patches = [os.path.join(tmp,'random.bin')]
+            np.random.default_rng(0).integers(0,128,(32,128),dtype=np.uint8).tofile(patches[0])
+        from pydx7.dataset import read_patch_set
+        n_patches = len(read_patch_set(patches))
+        path = os.path.join(tmp,'pydx7.sock')
+        env = dict(os.environ,PYTHONPATH=os.pathsep.join([ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+        server = subprocess.Popen([sys.executable,'-m','pydx7.server'] + patches +
+                                  ['--socket',path,'--batch-window',str(args.batch_window)],env=env)
+        try:
+            # The server listens once its kernels are warm.
+            while not os.path.exists(path):
+                if server.poll() is not None:
+                    sys.exit('render server failed to start')
+                time.sleep(0.05)
+            latencies, samples = [], []
+            threads = [threading.Thread(target=client_loop,
+                                        args=(path,args.requests,n_patches,i,latencies,samples))
+                       for i in range(args.clients)]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            with RenderClient(path) as client:
+                stats = client.stats()
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = np.array(latencies)*1000
+    print('{} renders in {:.2f} s: {:.1f} renders/s, {:.2f} Msamples/s'.format(
+        len(latencies),elapsed,len(latencies)/elapsed,sum(samples)/elapsed/1e6))
+    print('latency ms: p50 {:.1f} p95 {:.1f} p99 {:.1f}'.format(
+        *np.percentile(latencies,[50,95,99])))
+    print('server: {} batches, mean batch {:.1f}, open blocks {}'.format(
+        stats['batches'],stats['mean_batch'],stats['open_blocks']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measures the start-up latency of fresh processes: importing pydx7 and
+loading a patch, then the first render with a cold and with a warm numba
+cache (a temporary NUMBA_CACHE_DIR, so the package cache is left untouched).
+
+    python benchmarks/startup.py [--repeats 3]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints a json dict of timings in seconds.
+CHILD = r'''
+import sys, time, json
+t0 = time.perf_counter()
+import numpy as np
+from pydx7.dx7tools import load_patch
+specs = load_patch(np.zeros(128,dtype=np.uint8))
+t_load = time.perf_counter()
+numba_loaded = 'numba' in sys.modules
+import pydx7
+pydx7.warmup()
+t_warmup = time.perf_counter()
+from pydx7 import dx7_synth, midi_note
+dx7_synth(specs).render_from_midi_sequence([midi_note(60,100,100,100)])
+t_render = time.perf_counter()
+print(json.dumps({'load_patch':t_load - t0,'numba_loaded':numba_loaded,
+                  'warmup':t_warmup - t_load,'first_render':t_render - t_warmup,
+                  'total':t_render - t0}))
+'''
+
+def run_child(cache_dir):
+    env = dict(os.environ,NUMBA_CACHE_DIR=cache_dir)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.run([sys.executable,'-c',CHILD],env=env,check=True,
+                         capture_output=True,text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats',type=int,default=3,help='n. of warm cache runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = {'cold':run_child(cache_dir)}
+        results['warm'] = [run_child(cache_dir) for _ in range(args.repeats)]
+
+    print('{:<6} {:>10} {:>10} {:>12} {:>10}'.format('cache','load [s]','warmup [s]','render [s]','total [s]'))
+    for name, r in [('cold',results['cold'])] + [('warm',r) for r in results['warm']]:
+        print('{:<6} {:>10.3f} {:>10.3f} {:>12.3f} {:>10.3f}'.format(
+            name,r['load_patch'],r['warmup'],r['first_render'],r['total']))
+    if results['cold']['numba_loaded']:
+        print('warning: loading a patch imported numba')
+
+if __name__ == '__main__':
+    main()
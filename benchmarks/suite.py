@@ -0,0 +1,245 @@
+"""
+Benchmark suite for the hot paths of pydx7.
+
+Every benchmark is timed after a warmup call (so numba compile time is not
+included), reports its throughput in items per second and the peak memory
+traced by tracemalloc during one call. The cold start of a fresh process is
+measured by benchmarks/startup.py.
+
+    python benchmarks/suite.py -o results.json
+    python benchmarks/suite.py --compare baseline.json --threshold 0.1
+
+In comparison mode, benchmarks whose throughput dropped by more than the
+threshold (a fraction of the baseline) are flagged and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+SR = 44100
+BLOCK_SIZE = 64
+
+def _random_packed(n_patches:int,seed:int=0) -> np.array:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0,128,(n_patches,128),dtype=np.uint8)
+
+def bench_render_env():
+    from pydx7.dx7tools import render_env, load_patch
+    specs = load_patch(_random_packed(1)[0])
+    frames = 2000
+    fn = lambda: render_env(specs['eg_rate'][:,0],specs['eg_level'][:,0],
+                            specs['ol'][0],specs['sensitivity'][0],100,frames//2,frames//2)
+    return fn, frames, 'frames'
+
+def bench_render_envelopes():
+    from pydx7.dx7tools import render_envelopes, load_patch
+    specs = load_patch(_random_packed(1)[0])
+    frames = 2000
+    fn = lambda: render_envelopes(specs,100,frames//2,frames//2)
+    return fn, frames, 'frames'
+
+def bench_dx7_numba_render(algorithm:int):
+    from pydx7.dx7tools import get_modmatrix, get_outmatrix
+    from pydx7.synth import dx7_numba_render
+    n = SR//2
+    fr = np.array([1.0,2.0,3.0,1.5,0.5,4.0])
+    pitch = np.full(n,220.0)
+    ol = np.full((n,6),0.5)
+    modmatrix = get_modmatrix(algorithm)
+    outmatrix = get_outmatrix(algorithm)
+    fn = lambda: dx7_numba_render(fr,modmatrix,outmatrix,pitch,ol,SR)
+    return fn, n, 'samples'
+
+def bench_upsample():
+    from pydx7.synth import upsample
+    frames = 2000
+    signal = np.random.default_rng(0).random((frames,6))
+    fn = lambda: upsample(signal,BLOCK_SIZE)
+    return fn, frames*BLOCK_SIZE, 'samples'
+
+def bench_load_patch_from_bulk():
+    from pydx7.dx7tools import load_patch_from_bulk
+    f = tempfile.NamedTemporaryFile(suffix='.bin',delete=False)
+    f.write(_random_packed(32).tobytes())
+    f.close()
+    atexit.register(os.remove,f.name)
+    fn = lambda: [load_patch_from_bulk(f.name,i) for i in range(32)]
+    return fn, 32, 'patches'
+
+def bench_unpack_packed_patch():
+    from pydx7.dx7tools import unpack_packed_patch
+    packed = _random_packed(32)
+    fn = lambda: [unpack_packed_patch(p) for p in packed]
+    return fn, 32, 'patches'
+
+def bench_unpack_packed_patches():
+    from pydx7.dx7tools import unpack_packed_patches
+    packed = _random_packed(4096)
+    fn = lambda: unpack_packed_patches(packed)
+    return fn, 4096, 'patches'
+
+def bench_render_from_midi_sequence(modulation:bool=False,workers:int=1):
+    from pydx7.dx7tools import load_patch
+    from pydx7.synth import dx7_synth, midi_note
+    synth = dx7_synth(load_patch(_random_packed(1)[0]),SR,BLOCK_SIZE,modulation=modulation)
+    seq = [midi_note(48 + i,100,300,100) for i in range(8)]
+    n = synth.sequence_frames(seq)*BLOCK_SIZE
+    fn = lambda: synth.render_from_midi_sequence(seq,workers)
+    return fn, n, 'samples'
+
+def bench_render_staccato():
+    from pydx7.dx7tools import load_patch
+    from pydx7.synth import dx7_synth, midi_note
+    synth = dx7_synth(load_patch(_random_packed(1)[0]),SR,BLOCK_SIZE)
+    seq = []
+    for i in range(8):
+        seq += [midi_note(48 + i,100,10,30),midi_note(silence=120)]
+    n = synth.sequence_frames(seq)*BLOCK_SIZE
+    fn = lambda: synth.render_from_midi_sequence(seq)
+    return fn, n, 'samples'
+
+def bench_render_sustain(tolerance:float=None):
+    from pydx7.dx7tools import load_patch
+    from pydx7.synth import dx7_synth, midi_note
+    # Fast EGs and integer ratios: the note reaches a periodic sustain.
+    packed = _random_packed(1)[0]
+    for op in range(6):
+        packed[op*17:op*17+4] = 90
+        packed[op*17+15] = 2*(op % 3 + 1)
+        packed[op*17+16] = 0
+    packed[117] = 24
+    synth = dx7_synth(load_patch(packed),SR,BLOCK_SIZE,sustain_tolerance=tolerance)
+    seq = [midi_note(57,100,1500,100)]
+    n = synth.sequence_frames(seq)*BLOCK_SIZE
+    fn = lambda: synth.render_from_midi_sequence(seq)
+    return fn, n, 'samples'
+
+def bench_sequence_controls(modulation:bool=False):
+    from pydx7.dx7tools import load_patch
+    from pydx7.synth import dx7_synth, midi_note
+    synth = dx7_synth(load_patch(_random_packed(1)[0]),SR,BLOCK_SIZE,modulation=modulation)
+    seq = [midi_note(48 + i,100,300,100) for i in range(8)]
+    fn = lambda: synth.sequence_controls(seq)
+    return fn, synth.sequence_frames(seq), 'frames'
+
+BENCHMARKS = {
+    'render_env':bench_render_env,
+    'render_envelopes':bench_render_envelopes,
+    'upsample':bench_upsample,
+    'load_patch_from_bulk':bench_load_patch_from_bulk,
+    'unpack_packed_patch':bench_unpack_packed_patch,
+    'unpack_packed_patches':bench_unpack_packed_patches,
+    'render_from_midi_sequence':bench_render_from_midi_sequence,
+    # Same renders with the pitch EG and LFO: the difference is their overhead.
+    'render_from_midi_sequence/modulation':lambda: bench_render_from_midi_sequence(True),
+    # Same renders split in segments across all cores.
+    'render_from_midi_sequence/workers':
+        lambda: bench_render_from_midi_sequence(workers=os.cpu_count()),
+    # Short notes between silences, mostly culled.
+    'render_from_midi_sequence/staccato':bench_render_staccato,
+    # A held note, rendered in full and with its sustain tiled.
+    'render_from_midi_sequence/sustain':bench_render_sustain,
+    'render_from_midi_sequence/sustain_tiled':lambda: bench_render_sustain(1e-3),
+    'sequence_controls':bench_sequence_controls,
+    'sequence_controls/modulation':lambda: bench_sequence_controls(True),
+}
+for _alg in range(32):
+    BENCHMARKS['dx7_numba_render/alg{:02d}'.format(_alg + 1)] = \
+        (lambda a: lambda: bench_dx7_numba_render(a))(_alg)
+
+def measure(setup,min_time:float=0.5,repeats:int=5):
+    '''
+    Runs a benchmark. Returns a dict with the best throughput over 'repeats'
+    runs of at least min_time seconds and the peak traced memory of one call.
+    '''
+    fn, n_items, unit = setup()
+    fn()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        t0 = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time / repeats or calls == 0:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - t0
+        best = max(best,calls*n_items/elapsed)
+    return {'throughput':best,'unit':unit + '/s','peak_memory_bytes':peak}
+
+def compare(results,baseline,threshold:float):
+    '''
+    Returns the names of the benchmarks slower than the baseline by more
+    than 'threshold' (a fraction), printing one line per common benchmark.
+    '''
+    regressions = []
+    for name, r in results['benchmarks'].items():
+        b = baseline['benchmarks'].get(name)
+        if b is None:
+            continue
+        ratio = r['throughput'] / b['throughput']
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print('{:<36} {:>8.3f}x {}'.format(name,ratio,flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o','--output',help='write results as json')
+    parser.add_argument('--compare',help='baseline json to compare against')
+    parser.add_argument('--threshold',type=float,default=0.1,
+                        help='tolerated throughput drop, as a fraction of the baseline')
+    parser.add_argument('-k','--filter',default='',help='only run benchmarks whose name contains this')
+    parser.add_argument('--min-time',type=float,default=0.5,help='seconds per benchmark')
+    parser.add_argument('--cold',action='store_true',help='also measure a cold start (see startup.py)')
+    args = parser.parse_args(argv)
+
+    import numba
+    results = {'machine':{'python':platform.python_version(),'numpy':np.__version__,
+                          'numba':numba.__version__,'platform':platform.platform(),
+                          'cpu_count':os.cpu_count()},
+               'benchmarks':{}}
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        r = measure(setup,args.min_time)
+        results['benchmarks'][name] = r
+        print('{:<36} {:>14.1f} {:<10} {:>8.1f} MB'.format(
+            name,r['throughput'],r['unit'],r['peak_memory_bytes']/2**20))
+    if args.cold:
+        from startup import run_child
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold = run_child(cache_dir)
+            warm = run_child(cache_dir)
+        results['startup'] = {'cold':cold,'warm':warm}
+        print('startup: cold {:.2f} s, warm {:.2f} s'.format(cold['total'],warm['total']))
+
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results,baseline,args.threshold)
+        if len(regressions) > 0:
+            print('{} regression(s) over {:.0%}'.format(len(regressions),args.threshold))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
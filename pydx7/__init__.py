@@ -1,3 +1,29 @@
-from .synth import dx7_synth,midi_note
-from .dx7tools import render_envelopes, load_patch_from_bulk
-__all__ =['dx7_synth','midi_note','render_envelopes','load_patch_from_bulk']
\ No newline at end of file
+import importlib
+
+# Public names and the submodule defining them. Submodules are imported on
+# first access, so e.g. loading patches does not import numba.
+_EXPORTS = {
+    'dx7_synth':'.synth',
+    'midi_note':'.synth',
+    'render_batch':'.synth',
+    'dx7_poly_synth':'.poly',
+    'render_envelopes':'.dx7tools',
+    'load_patch_from_bulk':'.dx7tools',
+    'Cartridge':'.cartridge',
+    'PatchLibrary':'.library',
+    'NoteSequence':'.sequence',
+    'read_midi_file':'.midifile',
+    'RenderStats':'.stats',
+    'warmup':'.jit',
+}
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__,name))
+    value = getattr(importlib.import_module(_EXPORTS[name],__name__),name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
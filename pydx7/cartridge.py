@@ -0,0 +1,152 @@
+import numpy as np
+from pydx7.dx7tools import unpack_packed_patches, get_outmatrix
+
+# Voice data starts after the 6 byte header (F0 43 00 09 20 00) in a 32 voice sysex dump.
+SYSEX_HEADER_SIZE = 6
+PATCH_SIZE = 128
+PATCHES_PER_CART = 32
+
+# Compact structured layout of an unpacked patch.
+# Fields are named as the keys of the 'specs' dict returned by dx7tools.load_patch,
+# so a single record can be passed to dx7_synth and render_envelopes.
+PATCH_DTYPE = np.dtype([
+    ('binary', np.uint8, (PATCH_SIZE,)),
+    ('name', 'S10'),
+    ('fr', np.float64, (6,)),
+    ('ol', np.uint8, (6,)),
+    ('eg_rate', np.uint8, (4,6)),
+    ('eg_level', np.uint8, (4,6)),
+    ('sensitivity', np.uint8, (6,)),
+    ('algorithm', np.uint8),
+    ('has_fixed_freqs', np.bool_),
+    ('feedback', np.uint8),
+    ('pitch_eg_rate', np.uint8, (4,)),
+    ('pitch_eg_level', np.uint8, (4,)),
+    ('lfo_speed', np.uint8),
+    ('lfo_delay', np.uint8),
+    ('lfo_pmd', np.uint8),
+    ('lfo_amd', np.uint8),
+    ('lfo_sync', np.uint8),
+    ('lfo_waveform', np.uint8),
+    ('pitch_mod_sens', np.uint8),
+    ('amp_mod_sens', np.uint8, (6,)),
+])
+
+# Same expression as dx7tools.load_patch, evaluated once per transpose value.
+_TRANSPOSE_FACTOR = np.array([2**((t-24)/12) for t in range(49)])
+
+def unpack_patches(packed : np.array) -> np.array:
+    '''
+    Unpacks a [n_patches,128] byte array into a PATCH_DTYPE structured array.
+    Produces the same values as dx7tools.load_patch, for all patches at once.
+    '''
+    packed = np.asarray(packed,dtype=np.uint8).reshape(-1,PATCH_SIZE)
+    n = packed.shape[0]
+    unpacked = unpack_packed_patches(packed)
+    # First in file is OP6
+    ops = unpacked[:,:126].reshape(n,6,21)[:,::-1,:]
+
+    patches = np.zeros(n,dtype=PATCH_DTYPE)
+    patches['binary'] = packed
+
+    names = packed[:,118:128] * (packed[:,118:128] < 128)
+    patches['name'] = np.ascontiguousarray(names).view('S10')[:,0]
+
+    coarse = ops[:,:,18].astype(float)
+    coarse[coarse == 0] = 0.5
+    fr = coarse + (coarse/100)*ops[:,:,19]
+    patches['fr'] = _TRANSPOSE_FACTOR[unpacked[:,144]][:,None]*fr
+
+    patches['ol'] = ops[:,:,16]
+    patches['eg_rate'] = ops[:,:,0:4].transpose(0,2,1)
+    patches['eg_level'] = ops[:,:,4:8].transpose(0,2,1)
+    patches['sensitivity'] = ops[:,:,15]
+    patches['algorithm'] = unpacked[:,134]
+    patches['has_fixed_freqs'] = ops[:,:,17].any(axis=1)
+    patches['feedback'] = unpacked[:,135]
+    patches['pitch_eg_rate'] = unpacked[:,126:130]
+    patches['pitch_eg_level'] = unpacked[:,130:134]
+    for i, name in enumerate(('lfo_speed','lfo_delay','lfo_pmd','lfo_amd',
+                              'lfo_sync','lfo_waveform','pitch_mod_sens')):
+        patches[name] = unpacked[:,137 + i]
+    patches['amp_mod_sens'] = ops[:,:,14]
+    return patches
+
+
+class Cartridge():
+    '''
+    All the voices of one or more DX7 cart files, unpacked at once.
+    Patches are stored in a PATCH_DTYPE structured array. Indexing a Cartridge
+    with an int returns a zero-copy record that can be used as 'specs'
+    (e.g. dx7_synth(cart[3])), slicing returns a structured array view.
+    '''
+    def __init__(self,patch_file=None,load_from_sysex=False,mmap=False):
+        '''
+        Args:
+            patch_file: Path to dx7 cart file. Leave as None to build an empty cartridge.
+            load_from_sysex: Set it to 'True' when cart file is a sysex dump
+            mmap: Memory-map the file instead of reading it.
+        '''
+        if patch_file is None:
+            self.patches = np.zeros(0,dtype=PATCH_DTYPE)
+            return
+        self.patches = unpack_patches(read_packed_patches(patch_file,load_from_sysex,mmap))
+
+    @classmethod
+    def from_packed(cls,packed : np.array):
+        '''
+        Builds a cartridge from a [n_patches,128] packed byte array.
+        '''
+        cart = cls()
+        cart.patches = unpack_patches(packed)
+        return cart
+
+    @classmethod
+    def from_files(cls,patch_files,load_from_sysex=False,mmap=False):
+        '''
+        Concatenates the voices of several cart files into a single cartridge.
+        '''
+        packed = [read_packed_patches(f,load_from_sysex,mmap) for f in patch_files]
+        if len(packed) == 0:
+            return cls()
+        return cls.from_packed(np.concatenate(packed))
+
+    def __len__(self):
+        return len(self.patches)
+
+    def __getitem__(self,idx):
+        return self.patches[idx]
+
+    def __iter__(self):
+        return iter(self.patches)
+
+    def specs(self,patch_number:int):
+        '''
+        Returns a patch as a 'specs' dict, as dx7tools.load_patch does.
+        Arrays in the dict are views on the cartridge storage.
+        '''
+        patch = self.patches[patch_number]
+        specs = {name:patch[name] for name in PATCH_DTYPE.names}
+        specs['name'] = specs['name'].decode('ascii')
+        specs['outmatrix'] = get_outmatrix(specs['algorithm'])
+        return specs
+
+
+def read_packed_patches(patch_file,load_from_sysex=False,mmap=False) -> np.array:
+    '''
+    Reads the packed voices of a cart file as a [n_patches,128] byte array.
+    Args:
+        patch_file: Path to dx7 cart file
+        load_from_sysex: Set it to 'True' when cart file is a sysex dump
+        mmap: Memory-map the file instead of reading it.
+    '''
+    if mmap:
+        bulk_patches = np.memmap(patch_file,dtype=np.uint8,mode='r')
+    else:
+        bulk_patches = np.fromfile(patch_file,dtype=np.uint8)
+    patch_offset = SYSEX_HEADER_SIZE if load_from_sysex==True else 0
+    n_patches = (len(bulk_patches) - patch_offset)//PATCH_SIZE
+    if load_from_sysex:
+        n_patches = min(n_patches,PATCHES_PER_CART)
+    end = patch_offset + n_patches*PATCH_SIZE
+    return bulk_patches[patch_offset:end].reshape(n_patches,PATCH_SIZE)
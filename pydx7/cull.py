@@ -0,0 +1,35 @@
+from numba import njit
+
+# Culling of inaudible operators in the control-rate FM kernels.
+# Gains are linear and interpolated between frames, so an operator whose
+# gain is within [-level,level] at both ends of a frame stays there for the
+# whole frame.
+
+# Linear gain of an EG at its floor (dx7env clamps levels to 16 << 16).
+EG_FLOOR_GAIN = 2**(10 + (16 << 16) / (1 << 24)) / (1 << 24)
+
+@njit(cache=True)
+def live_ops(edges, outmatrix, feedback, gain, j, k, cull_level, live):
+    '''
+    Marks in 'live' [n_op] the operators that are heard between frames j and k
+    of the gains [frames,n_op]. An operator is heard if its gain exceeds
+    cull_level and it is a carrier, modulates a heard operator, or is the
+    source of the feedback (whose state must stay exact).
+        edges, feedback: operator schedule (see dx7tools.get_schedule), in
+            evaluation order: the modulators of an operator come before it.
+    Returns the number of operators heard.
+    '''
+    n_op = live.shape[0]
+    for op in range(n_op):
+        loud = abs(gain[j, op]) > cull_level or abs(gain[k, op]) > cull_level
+        live[op] = loud and (outmatrix[op] != 0 or (feedback[2] != 0 and op == feedback[0]))
+    # Walk the schedule backwards: a carrier is settled before its modulators.
+    for e in range(edges.shape[0] - 1, -1, -1):
+        mod_op = edges[e, 0]
+        if live[edges[e, 1]] and not live[mod_op]:
+            live[mod_op] = abs(gain[j, mod_op]) > cull_level or abs(gain[k, mod_op]) > cull_level
+    n_live = 0
+    for op in range(n_op):
+        if live[op]:
+            n_live += 1
+    return n_live
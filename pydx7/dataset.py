@@ -0,0 +1,360 @@
+"""
+Offline dataset generator.
+
+Renders one note per item for every (patch, note, velocity, duration)
+combination of a grid, or for randomly drawn ones, across a process pool.
+Items are written in shards of memory-mappable .npy arrays:
+
+    out_dir/manifest.json        generation settings and shard list
+    out_dir/items.npy            ITEM_DTYPE record of every item
+    out_dir/patches.npy          packed patches [n_patches,128]
+    out_dir/shard_00000/audio.npy  [n,n_frames*block_size] float32
+    out_dir/shard_00000/f0.npy     [n,n_frames] float32, in Hz
+    out_dir/shard_00000/ol.npy     [n,n_frames,6] float32 linear oscillator gains
+
+A shard directory only appears once all its arrays are written, so running
+the same command again resumes an interrupted run from the missing shards.
+
+    pydx7-dataset carts/ -o dataset --notes 48 60 72 --velocities 64 100 127
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from pydx7.cartridge import read_packed_patches, unpack_patches, PATCH_SIZE
+from pydx7.library import PatchLibrary, CART_EXTENSIONS
+
+MANIFEST_NAME = 'manifest.json'
+SAMPLER_GRID = 'grid'
+SAMPLER_RANDOM = 'random'
+
+ITEM_DTYPE = np.dtype([
+    ('patch', np.int32),
+    ('note', np.int16),
+    ('velocity', np.int16),
+    ('frames_on', np.int32),
+])
+
+def read_patch_set(paths) -> np.array:
+    '''
+    Reads the packed patches of cart files, or of every cart file found under
+    directories, as a [n_patches,128] byte array. Sysex dumps are detected
+    by their first byte.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root,n) for n in sorted(names)
+                          if n.lower().endswith(CART_EXTENSIONS)]
+        else:
+            files.append(path)
+    packed = [np.zeros((0,PATCH_SIZE),dtype=np.uint8)]
+    for path in sorted(files):
+        with open(path,'rb') as f:
+            load_from_sysex = f.read(1) == b'\xf0'
+        packed.append(read_packed_patches(path,load_from_sysex))
+    return np.concatenate(packed)
+
+def grid_items(n_patches:int,notes,velocities,durations) -> np.array:
+    '''
+    Every combination of patch, note, velocity and note on duration (in frames).
+    '''
+    grid = np.meshgrid(np.arange(n_patches),notes,velocities,durations,indexing='ij')
+    items = np.zeros(grid[0].size,dtype=ITEM_DTYPE)
+    for name, values in zip(ITEM_DTYPE.names,grid):
+        items[name] = values.reshape(-1)
+    return items
+
+def random_items(n_patches:int,notes,velocities,durations,n_items:int,seed:int=0) -> np.array:
+    '''
+    n_items random items. Patches are drawn uniformly, notes, velocities and
+    durations uniformly within the [min,max] range of the given values.
+    '''
+    rng = np.random.default_rng(seed)
+    items = np.zeros(n_items,dtype=ITEM_DTYPE)
+    items['patch'] = rng.integers(0,n_patches,n_items)
+    for name, values in zip(ITEM_DTYPE.names[1:],(notes,velocities,durations)):
+        items[name] = rng.integers(min(values),max(values),n_items,endpoint=True)
+    return items
+
+
+def sample_item(n_patches:int,notes,velocities,durations,seed:int,index:int):
+    '''
+    Item 'index' of the random stream of a seed, drawn with the same
+    distributions as random_items. Each item only depends on (seed,index),
+    so any subset of the stream can be rendered in any order, by any worker.
+    The stream differs from the sequential one of random_items: item i of
+    random_items(..., seed) is not sample_item(..., seed, i).
+    '''
+    rng = np.random.default_rng([seed,index])
+    item = np.zeros((),dtype=ITEM_DTYPE)
+    item['patch'] = rng.integers(0,n_patches)
+    for name, values in zip(ITEM_DTYPE.names[1:],(notes,velocities,durations)):
+        item[name] = rng.integers(min(values),max(values),endpoint=True)
+    return item
+
+def render_item(specs,item,n_frames:int,sr:int=44100,block_size:int=64,feedback:bool=False,
+                modulation:bool=False):
+    '''
+    Renders an item (ITEM_DTYPE) with a patch. Returns float32 audio
+    [n_frames*block_size], f0 [n_frames] and ol [n_frames,6] (linear gains).
+    With modulation, f0 and ol include the pitch EG and LFO (see synth.dx7_synth).
+    '''
+    from pydx7.synth import dx7_synth, midi_note
+    synth = dx7_synth(specs,sr,block_size,feedback=feedback,dtype=np.float32,
+                      modulation=modulation)
+    frames_on = int(item['frames_on'])
+    note = midi_note(int(item['note']),int(item['velocity']),frames_on,n_frames - frames_on)
+    f0, env = synth.sequence_controls([note])
+    audio = synth.render_from_osc_envelopes(f0,env)
+    return audio, f0.astype(np.float32), env
+
+
+# Per worker state, set by _init_worker.
+_worker = {}
+
+def _init_worker(packed,config):
+    _worker['patches'] = unpack_patches(packed)
+    _worker['config'] = config
+
+def _render_worker_item(item):
+    config = _worker['config']
+    return render_item(_worker['patches'][item['patch']],item,config['n_frames'],
+                       config['sr'],config['block_size'],config['feedback'],
+                       config['modulation'])
+
+def _render_shard(args):
+    '''
+    Renders items into out_dir/<shard>. Returns (shard, n. of items).
+    '''
+    shard, items = args
+    config = _worker['config']
+    n_frames = config['n_frames']
+    block_size = config['block_size']
+    final = os.path.join(config['out_dir'],shard)
+    tmp = final + '.tmp'
+    shutil.rmtree(tmp,ignore_errors=True)
+    os.makedirs(tmp)
+    n = len(items)
+    open_memmap = np.lib.format.open_memmap
+    audio = open_memmap(os.path.join(tmp,'audio.npy'),mode='w+',dtype=np.float32,
+                        shape=(n,n_frames*block_size))
+    f0 = open_memmap(os.path.join(tmp,'f0.npy'),mode='w+',dtype=np.float32,
+                     shape=(n,n_frames))
+    ol = open_memmap(os.path.join(tmp,'ol.npy'),mode='w+',dtype=np.float32,
+                     shape=(n,n_frames,6))
+    for i, item in enumerate(items):
+        audio[i], f0[i], ol[i] = _render_worker_item(item)
+    for array in (audio,f0,ol):
+        array.flush()
+    del audio, f0, ol
+    os.replace(tmp,final)
+    return shard, n
+
+def generate(packed,items,out_dir,n_frames:int=250,sr:int=44100,block_size:int=64,
+             shard_size:int=1024,jobs:int=None,feedback:bool=False,modulation:bool=False,
+             log=sys.stderr):
+    '''
+    Renders 'items' (ITEM_DTYPE) of the packed patches [n_patches,128] into out_dir.
+    Shards already present in out_dir are kept, so an interrupted call can be
+    resumed by repeating it with the same arguments.
+    Args:
+        n_frames: n. of envelope frames per item (note on + note off).
+        shard_size: n. of items per shard.
+        jobs: n. of worker processes (defaults to the n. of CPUs).
+        feedback: render with operator feedback (see synth.dx7_synth).
+        modulation: render the pitch EG and LFO of the patches (see synth.dx7_synth).
+        log: stream receiving progress lines, or None.
+    Returns the manifest.
+    '''
+    if np.any(items['frames_on'] > n_frames) or np.any(items['frames_on'] < 0):
+        raise ValueError('note on durations must be within [0,n_frames]')
+    config = {'n_frames':int(n_frames),'sr':int(sr),'block_size':int(block_size),
+              'shard_size':int(shard_size),'feedback':bool(feedback),
+              'modulation':bool(modulation),
+              'n_items':len(items),'n_patches':len(packed)}
+    os.makedirs(out_dir,exist_ok=True)
+    manifest_path = os.path.join(out_dir,MANIFEST_NAME)
+    shards = ['shard_{:05d}'.format(i) for i in range(-(-len(items)//shard_size))]
+    if os.path.exists(manifest_path):
+        manifest = read_manifest(out_dir)
+        if manifest['config'] != config \
+                or not np.array_equal(np.load(os.path.join(out_dir,'items.npy')),items) \
+                or not np.array_equal(np.load(os.path.join(out_dir,'patches.npy')),packed):
+            raise ValueError('{} holds a dataset generated with other settings'.format(out_dir))
+    else:
+        np.save(os.path.join(out_dir,'items.npy'),items)
+        np.save(os.path.join(out_dir,'patches.npy'),np.asarray(packed,dtype=np.uint8))
+        manifest = {'config':config,'shards':shards,'fields':['audio','f0','ol']}
+        _write_json(manifest_path,manifest)
+
+    pending = [(s,items[i*shard_size:(i+1)*shard_size]) for i, s in enumerate(shards)
+               if not os.path.isdir(os.path.join(out_dir,s))]
+    if log is not None and len(pending) < len(shards):
+        print('resuming: {} of {} shards done'.format(len(shards) - len(pending),len(shards)),file=log)
+    worker_config = dict(config,out_dir=out_dir)
+    done = 0
+    total = sum(len(s[1]) for s in pending)
+    t0 = time.perf_counter()
+    with multiprocessing.Pool(jobs,_init_worker,(packed,worker_config)) as pool:
+        for shard, n in pool.imap_unordered(_render_shard,pending):
+            done += n
+            if log is not None:
+                elapsed = time.perf_counter() - t0
+                print('{} done, {}/{} items, {:.1f} renders/s'.format(
+                    shard,done,total,done/elapsed),file=log)
+    return manifest
+
+class RenderDataset():
+    '''
+    Iterable of freshly rendered (audio, f0, ol) examples (see render_item),
+    drawn from a seeded random stream of items (see sample_item).
+    Renders run ahead of the consumer, in a background thread or a process
+    pool, with at most 'prefetch' examples pending. Examples are yielded in
+    stream order, so the output only depends on the seed and the shard.
+    To split the stream between the workers of a data loader, give each
+    one its shard index, e.g. RenderDataset(..., shard=worker_id, n_shards=n_workers).
+    '''
+    def __init__(self,patches,notes=(60,),velocities=(100,),durations=(200,),
+                 n_frames:int=250,n_items:int=None,seed:int=0,shard:int=0,n_shards:int=1,
+                 sr:int=44100,block_size:int=64,feedback:bool=False,modulation:bool=False,
+                 workers:int=0,prefetch:int=8):
+        '''
+        Args:
+            patches: packed patches [n_patches,128], or a PATCH_DTYPE array / Cartridge.
+            notes, velocities, durations: items are drawn within the [min,max]
+                range of each (durations are note on frames).
+            n_frames: n. of envelope frames per example.
+            n_items: length of the stream, None for an endless stream.
+            shard, n_shards: this iterable yields items shard, shard + n_shards, ...
+            workers: n. of render processes, 0 renders in a background thread.
+            prefetch: maximum n. of examples rendered ahead of the consumer.
+        '''
+        if not hasattr(patches,'dtype'):
+            patches = patches.patches
+        if patches.dtype.names is not None:
+            patches = patches['binary']
+        self.packed = np.ascontiguousarray(patches,dtype=np.uint8).reshape(-1,PATCH_SIZE)
+        self.patches = unpack_patches(self.packed)
+        self.notes = notes
+        self.velocities = velocities
+        self.durations = durations
+        if max(durations) > n_frames or min(durations) < 0:
+            raise ValueError('note on durations must be within [0,n_frames]')
+        self.n_items = n_items
+        self.seed = seed
+        self.shard = shard
+        self.n_shards = n_shards
+        self.config = {'n_frames':n_frames,'sr':sr,'block_size':block_size,'feedback':feedback,
+                       'modulation':modulation}
+        self.workers = workers
+        self.prefetch = prefetch
+
+    def __len__(self):
+        if self.n_items is None:
+            raise TypeError('endless RenderDataset has no length')
+        return len(range(self.shard,self.n_items,self.n_shards))
+
+    def item(self,index:int):
+        return sample_item(len(self.packed),self.notes,self.velocities,self.durations,
+                           self.seed,index)
+
+    def render(self,index:int):
+        '''
+        Renders item 'index' of the stream, in the calling thread.
+        '''
+        item = self.item(index)
+        c = self.config
+        return render_item(self.patches[item['patch']],item,c['n_frames'],c['sr'],
+                           c['block_size'],c['feedback'],c['modulation'])
+
+    def __iter__(self):
+        if self.n_items is None:
+            indices = itertools.count(self.shard,self.n_shards)
+        else:
+            indices = range(self.shard,self.n_items,self.n_shards)
+        if self.workers == 0:
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+            submit = lambda i: executor.submit(self.render,i)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers,initializer=_init_worker,initargs=(self.packed,self.config))
+            submit = lambda i: executor.submit(_render_worker_item,self.item(i))
+        pending = collections.deque()
+        try:
+            for i in indices:
+                pending.append(submit(i))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=False,cancel_futures=True)
+
+
+def read_manifest(out_dir):
+    with open(os.path.join(out_dir,MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def load_shard(out_dir,shard):
+    '''
+    Memory-maps the arrays of a shard, as a dict of field name to array.
+    '''
+    return {field:np.load(os.path.join(out_dir,shard,field + '.npy'),mmap_mode='r')
+            for field in read_manifest(out_dir)['fields']}
+
+def _write_json(path,obj):
+    tmp = path + '.tmp'
+    with open(tmp,'w') as f:
+        json.dump(obj,f,indent=1)
+    os.replace(tmp,path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pydx7-dataset',description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('patches',nargs='*',help='cart files or directories of cart files')
+    parser.add_argument('--library',help='PatchLibrary index directory to take patches from')
+    parser.add_argument('-o','--out-dir',required=True)
+    parser.add_argument('--sampler',choices=(SAMPLER_GRID,SAMPLER_RANDOM),default=SAMPLER_GRID)
+    parser.add_argument('--notes',type=int,nargs='+',default=[60],help='MIDI notes (random: range)')
+    parser.add_argument('--velocities',type=int,nargs='+',default=[100],help='MIDI velocities (random: range)')
+    parser.add_argument('--durations',type=int,nargs='+',default=[200],
+                        help='note on durations in frames (random: range)')
+    parser.add_argument('--n-items',type=int,default=1000,help='n. of items of the random sampler')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--n-frames',type=int,default=250,help='frames per item, note on + note off')
+    parser.add_argument('--sr',type=int,default=44100)
+    parser.add_argument('--block-size',type=int,default=64)
+    parser.add_argument('--shard-size',type=int,default=1024)
+    parser.add_argument('--jobs',type=int,default=None,help='worker processes (default: n. of CPUs)')
+    parser.add_argument('--feedback',action='store_true',help='render operator feedback')
+    parser.add_argument('--modulation',action='store_true',help='render the pitch EG and LFO')
+    args = parser.parse_args(argv)
+
+    packed = [read_patch_set(args.patches)]
+    if args.library is not None:
+        packed.append(np.asarray(PatchLibrary(args.library).patches['binary']))
+    packed = np.concatenate(packed)
+    if len(packed) == 0:
+        parser.error('no patches found')
+    if args.sampler == SAMPLER_GRID:
+        items = grid_items(len(packed),args.notes,args.velocities,args.durations)
+    else:
+        items = random_items(len(packed),args.notes,args.velocities,args.durations,
+                             args.n_items,args.seed)
+    try:
+        generate(packed,items,args.out_dir,args.n_frames,args.sr,args.block_size,
+                 args.shard_size,args.jobs,args.feedback,args.modulation)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == '__main__':
+    main()
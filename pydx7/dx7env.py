@@ -1,4 +1,5 @@
 import numpy as np
+from numba import njit
 
 LG_N = 6
 
@@ -15,6 +16,8 @@ def scalevelocity(velocity:int, sensitivity:int):
     scaled_vel = ((sensitivity * vel_value + 7) >> 3) << 4
     return scaled_vel
 
+_LEVELLUT = np.array([ 0, 5, 9, 13, 17, 20, 23, 25, 27, 29, 31, 33, 35, 37, 39, 41, 42, 43, 45, 46])
+
 def scaleoutlevel(outlevel:int):
     levellut = [ 0, 5, 9, 13, 17, 20, 23, 25, 27, 29, 31, 33, 35, 37, 39, 41, 42, 43, 45, 46]
     return 28 + outlevel if outlevel >= 20 else levellut[outlevel]
@@ -108,4 +111,204 @@ class EnvelopeGenerator():
                 if (self.level <= self.targetlevel):
                     self.level = self.targetlevel
                     self.advance(self.ix + 1)
-        return self.level
\ No newline at end of file
+        return self.level
+
+    def seek(self,n:int):
+        '''
+        Jumps ahead by n frames, leaving the generator as n calls to getsample()
+        would, in O(segments) (see eg_seek).
+        '''
+        state = np.array([self.ix,self.level,self.targetlevel,self.inc,
+                          self.rising,self.down],dtype=np.int64)
+        eg_seek(state,np.asarray(self.rates,dtype=np.int64),
+                np.asarray(self.levels,dtype=np.int64),self.outlevel,n)
+        self.ix = int(state[EG_IX])
+        self.level = int(state[EG_LEVEL])
+        self.targetlevel = int(state[EG_TARGET])
+        self.inc = int(state[EG_INC])
+        self.rising = bool(state[EG_RISING])
+        self.down = bool(state[EG_DOWN])
+
+# Compiled EG engine.
+# The state of each operator EG is kept in a row of an int64 array so that
+# many generators can be advanced inside a single numba call.
+EG_IX = 0
+EG_LEVEL = 1
+EG_TARGET = 2
+EG_INC = 3
+EG_RISING = 4
+EG_DOWN = 5
+EG_STATE_SIZE = 6
+
+@njit(cache=True)
+def eg_advance(state, rates, levels, outlevel, newix):
+    '''
+    Same as EnvelopeGenerator.advance() on a state row.
+    '''
+    state[EG_IX] = newix
+    if (newix < 4):
+        newlevel = levels[newix]
+        if (newlevel >= 20):
+            actuallevel = (28 + newlevel) >> 1
+        else:
+            actuallevel = _LEVELLUT[newlevel] >> 1
+        actuallevel = (actuallevel << 6) + outlevel - 4256
+        if (actuallevel < 16):
+            actuallevel = 16
+        state[EG_TARGET] = actuallevel << 16
+        state[EG_RISING] = 1 if state[EG_TARGET] > state[EG_LEVEL] else 0
+        qrate = (rates[newix] * 41) >> 6
+        qrate = min(qrate, 63)
+        state[EG_INC] = (4 + (qrate & 3)) << (2 + LG_N + (qrate >> 2))
+
+@njit(cache=True)
+def eg_init(state, rates, levels, outlevel):
+    '''
+    Same as EnvelopeGenerator.__init__() on a state row.
+    '''
+    state[EG_IX] = 0
+    state[EG_LEVEL] = 0
+    state[EG_TARGET] = 0
+    state[EG_INC] = 0
+    state[EG_RISING] = 0
+    state[EG_DOWN] = 1
+    eg_advance(state, rates, levels, outlevel, 0)
+
+@njit(cache=True)
+def eg_keydown(state, rates, levels, outlevel, d):
+    '''
+    Same as EnvelopeGenerator.keydown() on a state row.
+    '''
+    if (state[EG_DOWN] != d):
+        state[EG_DOWN] = d
+        if (d):
+            eg_advance(state, rates, levels, outlevel, 0)
+        else:
+            eg_advance(state, rates, levels, outlevel, 3)
+
+@njit(cache=True)
+def eg_getsample(state, rates, levels, outlevel):
+    '''
+    Same as EnvelopeGenerator.getsample() on a state row.
+    Returns the level in Q24/doubling log format.
+    '''
+    ix = state[EG_IX]
+    if (ix < 3 or ((ix < 4) and (not state[EG_DOWN]))):
+        if (state[EG_RISING]):
+            jumptarget = 1716
+            if (state[EG_LEVEL] < (jumptarget << 16)):
+                state[EG_LEVEL] = jumptarget << 16
+            state[EG_LEVEL] += (((17 << 24) - state[EG_LEVEL]) >> 24) * state[EG_INC]
+            if (state[EG_LEVEL] >= state[EG_TARGET]):
+                state[EG_LEVEL] = state[EG_TARGET]
+                eg_advance(state, rates, levels, outlevel, ix + 1)
+        else:
+            state[EG_LEVEL] -= state[EG_INC]
+            if (state[EG_LEVEL] <= state[EG_TARGET]):
+                state[EG_LEVEL] = state[EG_TARGET]
+                eg_advance(state, rates, levels, outlevel, ix + 1)
+    return state[EG_LEVEL]
+
+@njit(cache=True)
+def eg_run(state, rates, levels, outlevel, n, out):
+    '''
+    Same as n calls to eg_getsample, writing the returned levels to out[:n]
+    (pass an empty 'out' to only advance the state).
+    Runs in O(segments) rather than O(n): a decay falls by a constant step
+    and a rise adds ((17 << 24) - level) >> 24 times the rate, which only
+    changes when the level crosses a multiple of 1 << 24. Each of these spans
+    is solved in closed form, as are sustain and the end of the release.
+    '''
+    write = out.shape[0] > 0
+    i = 0
+    while i < n:
+        ix = state[EG_IX]
+        level = state[EG_LEVEL]
+        if not (ix < 3 or ((ix < 4) and (not state[EG_DOWN]))):
+            # Sustain, or release done: the level holds.
+            if write:
+                out[i:n] = level
+            return
+        target = state[EG_TARGET]
+        if (state[EG_RISING]):
+            jumptarget = 1716 << 16
+            if (level < jumptarget):
+                level = jumptarget
+            c = ((17 << 24) - level) >> 24
+            step = c * state[EG_INC]
+            # Steps taken while the multiplier is c, and steps to the target.
+            span = n - i
+            if step > 0:
+                span = ((17 - c) << 24) - level
+                span = span // step + 1
+            to_target = 1
+            if target > level:
+                to_target = n - i + 1
+                if step > 0:
+                    to_target = (target - level + step - 1) // step
+        else:
+            step = -state[EG_INC]
+            span = n - i
+            to_target = 1
+            if level > target:
+                to_target = (level - target - step - 1) // (-step)
+        m = min(span, to_target, n - i)
+        if write:
+            for j in range(m):
+                out[i + j] = level + (j + 1) * step
+        i += m
+        if m == to_target:
+            state[EG_LEVEL] = target
+            if write:
+                out[i - 1] = target
+            eg_advance(state, rates, levels, outlevel, ix + 1)
+        else:
+            state[EG_LEVEL] = level + m * step
+
+@njit(cache=True)
+def eg_seek(state, rates, levels, outlevel, n):
+    '''
+    Jumps a state row ahead by n frames, i.e. the state left by n calls to
+    eg_getsample, in O(segments).
+    '''
+    eg_run(state, rates, levels, outlevel, n, np.zeros(0, dtype=np.int64))
+
+@njit(cache=True,nogil=True)
+def eg_render_kernel(rates, levels, outlevels, frames_on, qenvelopes_ratio,
+                     gain, qgain):
+    '''
+    Renders the envelopes of all operators of a note in one call.
+        rates, levels: [4,n_op] EG settings
+        outlevels: [n_op] scaled output levels (see dx7tools.render_env)
+        frames_on: n. frames before NOTE_OFF is sent
+        qenvelopes_ratio: [n_op] multiplier for the envelopes in log format
+        gain, qgain: preallocated [n_op,n_frames] outputs, linear and in
+            doubling log format respectively.
+    The EG levels are bit-exact with EnvelopeGenerator. The log to linear
+    conversion uses numba's pow, which may differ from CPython's in the last ulp.
+    Levels are rendered segment by segment (see eg_run) and the conversion
+    is only computed once for runs of equal levels, such as sustains.
+    '''
+    n_op, n_frames = gain.shape
+    state = np.zeros(EG_STATE_SIZE, dtype=np.int64)
+    out = np.zeros(n_frames, dtype=np.int64)
+    n_on = min(frames_on + 1, n_frames)
+    for op in range(n_op):
+        r = rates[:, op]
+        l = levels[:, op]
+        ol = outlevels[op]
+        eg_init(state, r, l, ol)
+        eg_run(state, r, l, ol, n_on, out[:n_on])
+        if n_on < n_frames:
+            eg_keydown(state, r, l, ol, 0)
+            eg_run(state, r, l, ol, n_frames - n_on, out[n_on:])
+        last = -1
+        g = 0.0
+        for i in range(n_frames):
+            q = out[i] * qenvelopes_ratio[op]
+            qgain[op, i] = q
+            if i == 0 or out[i] != last:
+                # See dx7tools.render_env for the gain expression.
+                g = 2**(10 + q * (1.0 / (1 << 24))) / (1 << 24)
+                last = out[i]
+            gain[op, i] = g
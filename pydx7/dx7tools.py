@@ -1,8 +1,23 @@
+import hashlib
 import numpy as np
-from pydx7.dx7env import scalevelocity, scaleoutlevel, EnvelopeGenerator
+
+# The EG engine (pydx7.dx7env) is compiled with numba. It is imported by the
+# functions that use it, so loading and unpacking patches does not load numba.
+
+def scale_outlevel(ol:int,sens:int,velocity:int):
+    '''
+    Computes the EG output level of an oscillator from its
+    output level, its keyboard sensitivity and the MIDI velocity.
+    '''
+    from pydx7.dx7env import scalevelocity, scaleoutlevel
+    output_level = scaleoutlevel(int(ol))
+    output_level = output_level << 5
+    output_level += scalevelocity(int(velocity), int(sens))
+    output_level = max(0, output_level)
+    return output_level
 
 def render_env(rate,level,ol:int,sens,velocity:int,frames_on:int,
-               frames_off:int,qenvelopes_ratio:float=1.0):
+               frames_off:int,qenvelopes_ratio:float=1.0,stats=None,dtype=np.float64):
     '''
     Renders a single oscillator envelope from a set 
     of Envelope Generator settings. The envelopes are rendered 
@@ -15,67 +30,69 @@ def render_env(rate,level,ol:int,sens,velocity:int,frames_on:int,
         frames_on: n. frames to run the envelope on NOTE_ON
         frames_off: n. frames to run the envelope on NOTE_OFF
         qenvelopes_ratio: a multiplier for the envelopes in log format
+        stats: optional stats.RenderStats, records the 'envelopes' stage
+        dtype: dtype of the returned envelopes (float64 or float32)
     '''
-    output_level = scaleoutlevel(ol)
-    output_level = output_level << 5
-    output_level += scalevelocity(velocity, sens)
-    output_level = max(0, output_level)
-
-    e= EnvelopeGenerator(rate,level,output_level)
-
-    e.keydown(True)
+    from pydx7.dx7env import eg_render_kernel
+    if stats is not None:
+        t0 = stats.clock()
     n_frames = frames_on + frames_off
-    gain = np.zeros(n_frames,dtype=float)
-    qgain = np.zeros(n_frames,dtype=float)
-    for i in range(n_frames):
-        out = e.getsample()
-        qgain[i] = out*qenvelopes_ratio
-        # qgain format is doubling log format, this means:
-        # qgain is an exponent that each time that adds an unit value, duplicates the output
-        # qgain = out, controls the "15 MSbits" of the gain value.
-        # But these 15 bits are controlled with Q28 bits precision.
-        # From GAIN calculation we see that minimum gain value for ddx7 is 2^(10) / (1<<24) = 2^(10-24)
-        # The envelope output is actually Q4.24 (maximum value should be about 15.999... )
-        # But somehow it is clamped to 15 maximum (TODO: Check how is this achieved)
-        # This value within the exponent of gain expression yields 2^(10 + 15)
-        # Now, 2^25 / 2^24 = 2^1 = 2.
-        # gain = 2**(10 + out * ( 1.0/(1<<24) ) )/(1<<24)
-        
-        a = 2**(10 + qgain[i] * ( 1.0/(1<<24) ) )/(1<<24)
-        # simpler expresion (as out max value is 15.00... (in q4.24 fmt), exponent maximum is 1, output max is 2.)
-        b = 2**(qgain[i] /(1<<24) - 14 ) # drifts a bit on very small values
-
-        assert(abs(a-b) < 1e-9) # make sure this is as stated
-
-        gain[i] = a
-
-        if i == (frames_on):
-            e.keydown(False)
-    return [gain,qgain]
+    gain = np.zeros((1,n_frames),dtype=dtype)
+    qgain = np.zeros((1,n_frames),dtype=dtype)
+    # qgain format is doubling log format, this means:
+    # qgain is an exponent that each time that adds an unit value, duplicates the output
+    # qgain = out, controls the "15 MSbits" of the gain value.
+    # But these 15 bits are controlled with Q28 bits precision.
+    # From GAIN calculation we see that minimum gain value for ddx7 is 2^(10) / (1<<24) = 2^(10-24)
+    # The envelope output is actually Q4.24 (maximum value should be about 15.999... )
+    # But somehow it is clamped to 15 maximum (TODO: Check how is this achieved)
+    # This value within the exponent of gain expression yields 2^(10 + 15)
+    # Now, 2^25 / 2^24 = 2^1 = 2.
+    # gain = 2**(10 + out * ( 1.0/(1<<24) ) )/(1<<24)
+    # simpler expresion (as out max value is 15.00... (in q4.24 fmt), exponent maximum is 1, output max is 2.)
+    # gain = 2**(qgain /(1<<24) - 14 ) drifts a bit on very small values
+    eg_render_kernel(np.asarray(rate,dtype=np.int64).reshape(4,1),
+                     np.asarray(level,dtype=np.int64).reshape(4,1),
+                     np.array([scale_outlevel(ol,sens,velocity)],dtype=np.int64),
+                     frames_on,
+                     np.array([qenvelopes_ratio],dtype=float),
+                     gain,qgain)
+    if stats is not None:
+        stats.record('envelopes',t0,frames=n_frames,nbytes=gain.nbytes + qgain.nbytes)
+    return [gain[0],qgain[0]]
 
 def render_envelopes(specs,velocity,frames_on,frames_off,
-    qenvelopes_ratio=[1.0,1.0,1.0,1.0,1.0,1.0]):
+    qenvelopes_ratio=[1.0,1.0,1.0,1.0,1.0,1.0],stats=None,dtype=np.float64):
     '''
     Generates the oscillator envelopes given:
         specs: the patch structure
         velocity: MIDI velocity value
         frames_on: number of frames after a NOTE_ON is sent
         frames_off: number of frames generating after NOTE_OFF is sent
+        stats: optional stats.RenderStats, records the 'envelopes' stage
+        dtype: dtype of the returned envelopes (float64 or float32)
     
+    All six operators are rendered by a single call to the compiled
+    EG engine (see dx7env.eg_render_kernel).
     '''
-    envelopes = np.zeros([6,frames_on + frames_off])
-    qenvelopes = np.zeros([6,frames_on + frames_off])
+    from pydx7.dx7env import eg_render_kernel
+    if stats is not None:
+        t0 = stats.clock()
+    envelopes = np.zeros([6,frames_on + frames_off],dtype=dtype)
+    qenvelopes = np.zeros([6,frames_on + frames_off],dtype=dtype)
+    outlevels = np.zeros(6,dtype=np.int64)
     for i in range(6):
-        #print("Rendering env OP{}".format(i+1))
-        
-        out = render_env(specs['eg_rate'][:,i],
-                                specs['eg_level'][:,i],
-                                specs['ol'][i],
-                                specs['sensitivity'][i],
-                                velocity,frames_on,frames_off,
-                                qenvelopes_ratio[i])
-        envelopes[i,:] = out[0]
-        qenvelopes[i,:] = out[1]
+        outlevels[i] = scale_outlevel(specs['ol'][i],
+                                      specs['sensitivity'][i],
+                                      velocity)
+    eg_render_kernel(np.asarray(specs['eg_rate'],dtype=np.int64),
+                     np.asarray(specs['eg_level'],dtype=np.int64),
+                     outlevels,frames_on,
+                     np.asarray(qenvelopes_ratio,dtype=float),
+                     envelopes,qenvelopes)
+    if stats is not None:
+        stats.record('envelopes',t0,frames=frames_on + frames_off,
+                     nbytes=envelopes.nbytes + qenvelopes.nbytes)
 
     return [envelopes,qenvelopes]
 
@@ -102,6 +119,12 @@ def load_patch_from_bulk(patch_file,patch_number:int = 0,load_from_sysex=False):
 
     return load_patch(patch)
 
+def patch_hash(binary : np.array) -> bytes:
+    '''
+    Content hash of a packed patch (i.e. specs['binary']).
+    '''
+    return hashlib.sha1(np.ascontiguousarray(binary,dtype=np.uint8).tobytes()).hexdigest().encode('ascii')
+
 def load_patch(patch : np.array):
     '''
     Unpacks patch array from cart file and generates a patch structure (called here 'spec')
@@ -110,9 +133,10 @@ def load_patch(patch : np.array):
     # Store binary data from patch.
     specs['binary'] = patch
 
-    patch_name = patch[118:127]
+    # 10 characters, trailing NULs stripped as in cartridge.PATCH_DTYPE.
+    patch_name = np.asarray(patch[118:128],dtype=np.uint8)
     patch_name = patch_name * ( patch_name < 128)
-    specs['name'] = patch_name.tostring().decode('ascii')
+    specs['name'] = patch_name.tobytes().rstrip(b'\x00').decode('ascii')
 
     patch = unpack_packed_patch(patch)
     algorithm = patch[134]
@@ -122,6 +146,7 @@ def load_patch(patch : np.array):
     rates = np.zeros([4,6],dtype=int)
     levels = np.zeros([4,6],dtype=int)
     sensitivity = np.zeros(6,dtype=int)
+    amp_mod_sens = np.zeros(6,dtype=int)
 
     # https://homepages.abdn.ac.uk/d.j.benson/pages/dx7/sysex-format.txt
     # Load OP output level, EG rates and levels
@@ -136,6 +161,7 @@ def load_patch(patch : np.array):
 
         ol[5-op] = patch[off+16]
         sensitivity[5-op] = patch[off+15]
+        amp_mod_sens[5-op] = patch[off+14]
         
         #compute frequency value    
         f_coarse = patch[off+18]
@@ -148,7 +174,7 @@ def load_patch(patch : np.array):
             rates[i,5-op] = patch[off+i]
             levels[i,5-op] = patch[off+4+i]
 
-    transpose = (patch[144]-24)
+    transpose = (int(patch[144])-24)
     factor = 2**(transpose/12)
     fr = factor*fr
     
@@ -160,11 +186,24 @@ def load_patch(patch : np.array):
     specs['algorithm'] = algorithm #0-31
     specs['outmatrix'] = get_outmatrix(algorithm)
     specs['has_fixed_freqs'] = has_fixed_freqs
+    specs['feedback'] = patch[135] #0-7
+    # Pitch EG and LFO (see modulation)
+    specs['pitch_eg_rate'] = np.array(patch[126:130],dtype=int)
+    specs['pitch_eg_level'] = np.array(patch[130:134],dtype=int)
+    specs['lfo_speed'] = patch[137]
+    specs['lfo_delay'] = patch[138]
+    specs['lfo_pmd'] = patch[139]
+    specs['lfo_amd'] = patch[140]
+    specs['lfo_sync'] = patch[141]
+    specs['lfo_waveform'] = patch[142] #0-5
+    specs['pitch_mod_sens'] = patch[143] #0-7
+    specs['amp_mod_sens'] = amp_mod_sens #0-3
     return specs
 
-def get_modmatrix(algorithm: int) -> np.array:
+def _build_modmatrices() -> np.array:
     """
-        Returns the modulation matrix corresponding to the algorithm selected.
+        Builds the [32,6,6] modulation matrices of all algorithms.
+        modmatrix[carrier,modulator] is set when modulator feeds carrier.
     """
     alg = []
     # alg 1       OP1            OP2            OP3            OP4            OP5            OP6
@@ -251,9 +290,12 @@ def get_modmatrix(algorithm: int) -> np.array:
     # alg 32       OP1            OP2            OP3            OP4            OP5            OP6
     alg.append([ [0,0,0,0,0,0], [0,0,0,0,0,0], [0,0,0,0,0,0], [0,0,0,0,0,0], [0,0,0,0,0,0], [0,0,0,0,0,0] ])
 
-    return np.array(alg[algorithm])
+    return np.array(alg)
 
-def get_outmatrix(algorithm):
+def _build_outmatrices() -> np.array:
+    """
+        Builds the [32,6] output matrices (carrier masks) of all algorithms.
+    """
     outmatrix = [
         [1,0,1,0,0,0], #1
         [1,0,1,0,0,0], #2
@@ -291,7 +333,49 @@ def get_outmatrix(algorithm):
         [1,1,1,1,1,0], #31
         [1,1,1,1,1,1], #32
     ]
-    return np.array(outmatrix[algorithm])
+    return np.array(outmatrix)
+
+MODMATRICES = _build_modmatrices()
+OUTMATRICES = _build_outmatrices()
+
+# Operators (0 is OP1) whose output is fed back, and the operator it is fed into.
+# Algorithms 4 and 6 have a feedback loop across operators, the others self feedback.
+FEEDBACK_OPS = np.array([
+    [5,5], [1,1], [5,5], [3,5], [5,5], [4,5], [5,5], [3,3], #1-8
+    [1,1], [2,2], [5,5], [1,1], [5,5], [5,5], [1,1], [5,5], #9-16
+    [1,1], [2,2], [5,5], [2,2], [2,2], [5,5], [5,5], [5,5], #17-24
+    [5,5], [5,5], [2,2], [4,4], [5,5], [4,4], [5,5], [5,5], #25-32
+])
+
+def get_modmatrix(algorithm: int) -> np.array:
+    """
+        Returns the modulation matrix corresponding to the algorithm selected.
+    """
+    return MODMATRICES[algorithm].copy()
+
+def get_outmatrix(algorithm):
+    return OUTMATRICES[algorithm].copy()
+
+def modmatrix_edges(modmatrix : np.array) -> np.array:
+    """
+        Returns the [n_edges,2] (modulator,carrier) pairs of a modulation matrix,
+        in the order the FM kernel applies them: modulators from OP6 down to OP1.
+        As operators only modulate lower numbered ones, this is a topological order.
+    """
+    n_op = modmatrix.shape[0]
+    edges = [(mod_op,carr_op) for mod_op in range(n_op-1,-1,-1)
+             for carr_op in range(n_op) if modmatrix[carr_op,mod_op]]
+    return np.array(edges,dtype=np.int64).reshape(-1,2)
+
+ALGORITHM_EDGES = [modmatrix_edges(m) for m in MODMATRICES]
+
+def get_schedule(algorithm: int):
+    """
+        Returns the precompiled operator schedule of an algorithm: its
+        [n_edges,2] modulation edges (see modmatrix_edges), its output matrix
+        and its feedback (source,destination) operators.
+    """
+    return ALGORITHM_EDGES[algorithm], OUTMATRICES[algorithm], FEEDBACK_OPS[algorithm]
 
 def compute_freq(coarse,fine,detune):
     '''
@@ -303,6 +387,26 @@ def compute_freq(coarse,fine,detune):
     f = f + (f/100)*fine
     return f
 
+# Maximum value of each parameter of an unpacked patch.
+UNPACKED_MAXES = [
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc6
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc5
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc4
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc3
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc2
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc1
+    3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
+    99, 99, 99, 99, 99, 99, 99, 99, # pitch eg rate & level 
+    31, 7, 1, 99, 99, 99, 99, 1, 5, 7, 48, # algorithm etc
+    126, 126, 126, 126, 126, 126, 126, 126, 126, 126, # name
+    127 # operator on/off
+]
+
 # Nice unpacking method adapted from https://github.com/bwhitman/learnfm
 def unpack_packed_patch(p):
     ''' 
@@ -341,25 +445,45 @@ def unpack_packed_patch(p):
     o[155] = 0x3f #Seems that OP ON/OFF they are always on. Ignore.
 
     # Clamp the unpacked patches to a known max. 
-    maxes =  [
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc6
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc5
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc4
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc3
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc2
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, # osc1
-        3, 3, 7, 3, 7, 99, 1, 31, 99, 14,
-        99, 99, 99, 99, 99, 99, 99, 99, # pitch eg rate & level 
-        31, 7, 1, 99, 99, 99, 99, 1, 5, 7, 48, # algorithm etc
-        126, 126, 126, 126, 126, 126, 126, 126, 126, 126, # name
-        127 # operator on/off
-    ]
     for i in range(156):
-        if(o[i] > maxes[i]): o[i] = maxes[i]
+        if(o[i] > UNPACKED_MAXES[i]): o[i] = UNPACKED_MAXES[i]
         if(o[i] < 0): o[i] = 0
     return o
+
+
+def unpack_packed_patches(p : np.array) -> np.array:
+    '''
+    Vectorized version of unpack_packed_patch.
+    p: is a [n_patches,128] byte array extracted from one or more DX7 carts.
+    Returns:
+        a [n_patches,156] uint8 array with the same contents as unpack_packed_patch.
+    '''
+    p = np.asarray(p,dtype=np.uint8).reshape(-1,128)
+    n = p.shape[0]
+    ops = p[:,:102].reshape(n,6,17)
+    o_ops = np.zeros((n,6,21),dtype=np.uint8)
+    o_ops[:,:,0:11] = ops[:,:,0:11]
+    o_ops[:,:,11] = ops[:,:,11] & 3
+    o_ops[:,:,12] = (ops[:,:,11] >> 2) & 3
+    o_ops[:,:,13] = ops[:,:,12] & 7
+    o_ops[:,:,20] = ops[:,:,12] >> 3
+    o_ops[:,:,14] = ops[:,:,13] & 3
+    o_ops[:,:,15] = ops[:,:,13] >> 2
+    o_ops[:,:,16] = ops[:,:,14]
+    o_ops[:,:,17] = ops[:,:,15] & 1
+    o_ops[:,:,18] = ops[:,:,15] >> 1
+    o_ops[:,:,19] = ops[:,:,16]
+
+    o = np.zeros((n,156),dtype=np.uint8)
+    o[:,:126] = o_ops.reshape(n,126)
+    o[:,126:126+9] = p[:,102:102+9]
+    o[:,135] = p[:,111] & 7
+    o[:,136] = p[:,111] >> 3
+    o[:,137:137+4] = p[:,112:112+4]
+    o[:,141] = p[:,116] & 1
+    o[:,142] = (p[:,116] >> 1) & 7
+    o[:,143] = p[:,116] >> 4
+    o[:,144:144+11] = p[:,117:117+11]
+    o[:,155] = 0x3f
+    np.minimum(o,np.array(UNPACKED_MAXES,dtype=np.uint8),out=o)
+    return o
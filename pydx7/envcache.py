@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import numpy as np
+from pydx7.dx7tools import render_envelopes, patch_hash
+
+class EnvelopeCache():
+    '''
+    Memoizes dx7tools.render_envelopes with a byte-size bounded LRU.
+    Entries are keyed by the hash of the patch binary, the velocity, the
+    number of frames on and off, the qenvelopes ratios and the dtype, so the
+    'specs' passed in are expected to match their 'binary' field.
+    Cached arrays are read-only and shared between callers.
+    '''
+    def __init__(self,max_bytes:int=256*1024*1024):
+        '''
+        Args:
+            max_bytes: Maximum size of the cached envelopes, in bytes.
+        '''
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def render_envelopes(self,specs,velocity,frames_on,frames_off,
+        qenvelopes_ratio=[1.0,1.0,1.0,1.0,1.0,1.0],stats=None,dtype=np.float64):
+        '''
+        Same as dx7tools.render_envelopes, returning cached arrays when available.
+        Only misses are recorded in 'stats'.
+        '''
+        key = (patch_hash(specs['binary']),int(velocity),int(frames_on),
+               int(frames_off),tuple(float(q) for q in qenvelopes_ratio),np.dtype(dtype).str)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return list(entry)
+
+        self.misses += 1
+        entry = tuple(render_envelopes(specs,velocity,frames_on,frames_off,qenvelopes_ratio,
+                                       stats,dtype))
+        for env in entry:
+            env.setflags(write=False)
+        size = sum(env.nbytes for env in entry)
+        if size > self.max_bytes:
+            return list(entry)
+        self._entries[key] = entry
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= sum(env.nbytes for env in evicted)
+        return list(entry)
+
+    def clear(self):
+        '''
+        Drops all entries and resets the counters.
+        '''
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,213 @@
+import numpy as np
+from numba import njit
+from .cull import live_ops
+
+# Integer FM engine, after the Dexed / msfa implementation.
+# Phases are Q24 fractions of a cycle held in wrapping accumulators, sine and
+# log to linear conversion are table lookups with linear interpolation.
+
+SIN_LG_N = 10
+SIN_N = 1 << SIN_LG_N
+EXP2_LG_N = 10
+EXP2_N = 1 << EXP2_LG_N
+PHASE_MASK = (1 << 24) - 1
+
+# sin(2*pi*i/SIN_N) in Q24. One extra entry to interpolate the last segment.
+SIN_TABLE = np.round(np.sin(2*np.pi*np.arange(SIN_N + 1)/SIN_N)*(1 << 24)).astype(np.int64)
+# 2^(i/EXP2_N) in Q30.
+EXP2_TABLE = np.round(2**(np.arange(EXP2_N + 1)/EXP2_N)*(1 << 30)).astype(np.int64)
+
+@njit(cache=True)
+def sin_lookup(phase):
+    '''
+    Sine of a Q24 phase (in cycles), in Q24.
+    '''
+    phase = phase & PHASE_MASK
+    idx = phase >> (24 - SIN_LG_N)
+    frac = phase & ((1 << (24 - SIN_LG_N)) - 1)
+    y0 = SIN_TABLE[idx]
+    return y0 + (((SIN_TABLE[idx + 1] - y0) * frac) >> (24 - SIN_LG_N))
+
+@njit(cache=True)
+def exp2_lookup(x):
+    '''
+    2^(x/2^24) in Q24, for a Q24 log2 value x. Returns 0 below 2^-30.
+    '''
+    n = x >> 24
+    if n < -30:
+        return 0
+    frac = x & PHASE_MASK
+    idx = frac >> (24 - EXP2_LG_N)
+    low = frac & ((1 << (24 - EXP2_LG_N)) - 1)
+    y0 = EXP2_TABLE[idx]
+    y = y0 + (((EXP2_TABLE[idx + 1] - y0) * low) >> (24 - EXP2_LG_N))
+    shift = 6 - n
+    if shift >= 0:
+        return y >> shift
+    return y << (-shift)
+
+@njit(cache=True)
+def qgain_to_gain_q24(qgain, gain):
+    '''
+    Converts envelopes in doubling log format (as returned by
+    dx7tools.render_envelopes) to Q24 linear gains, in place on 'gain'.
+    Non finite values (silence) give a null gain.
+    '''
+    flat_q = qgain.reshape(-1)
+    flat_g = gain.reshape(-1)
+    for i in range(flat_q.shape[0]):
+        q = flat_q[i]
+        if np.isfinite(q):
+            flat_g[i] = exp2_lookup(np.int64(q) - (14 << 24))
+        else:
+            flat_g[i] = 0
+    return gain
+
+@njit(cache=True,nogil=True)
+def dx7_fixed_render_control(fr : np.array, edges : np.array, outmatrix : np.array,
+                             feedback : np.array, f0 : np.array, gain : np.array,
+                             n_frames : int, factor : int, start : int, stop : int,
+                             frame_offset : int, sr : int, phases : np.array,
+                             fbstate : np.array, cull_level : int, counts : np.array):
+    """
+    Integer version of synth.dx7_numba_render_control.
+      gain: [frames,n_op] Q24 linear gains
+      phases: [n_op] int64 Q24 phase accumulators, updated in place.
+      fbstate: [2] int64 last two Q24 outputs of the feedback source op.
+      cull_level: Q24 gain at or below which operators are skipped.
+    Samples are returned as floats, with the same scale as the float engine.
+    """
+    n_op = len(fr)
+    out = np.zeros(stop - start)
+    modphases = np.zeros(n_op,dtype=np.int64)
+    gain_s = np.zeros(n_op,dtype=np.int64)
+    live = np.zeros(n_op,dtype=np.bool_)
+    n_live = 0
+    frame = -1
+    inc_scale = (1 << 24) / sr
+    fb_src, fb_dst, fb_level = feedback[0], feedback[1], feedback[2]
+    # avg(y0,y1) * 2^(level-8) cycles
+    fb_shift = 9 - fb_level
+    num = n_frames*factor
+    div = num - 1
+    step = 0.0
+    if div > 0:
+        step = (n_frames - 1) / div
+    last = n_frames - 1 - frame_offset
+    for s in range(start,stop):
+        # Same control grid as the float engine
+        if div <= 0 or step == 0:
+            x = 0.0
+        else:
+            x = s * step
+        if s == num - 1 and num > 1:
+            x = float(n_frames - 1)
+        j = int(x)
+        frac = int((x - j) * (1 << 16))
+        j = min(j - frame_offset,last)
+        if j != frame:
+            frame = j
+            n_live = live_ops(edges, outmatrix, feedback, gain, j, min(j+1,last),
+                              cull_level, live)
+        if j == last:
+            pitch = f0[last]
+        else:
+            pitch = f0[j] + (f0[j+1] - f0[j]) * (frac / (1 << 16))
+        for op in range(n_op):
+            phases[op] = (phases[op] + np.int64(pitch * fr[op] * inc_scale + 0.5)) & PHASE_MASK
+            modphases[op] = phases[op]
+        counts[1] += n_op - n_live
+        if n_live == 0:
+            if fb_level:
+                fbstate[0] = fbstate[1]
+                fbstate[1] = 0
+            counts[0] += 1
+            continue
+        for op in range(n_op):
+            if not live[op]:
+                gain_s[op] = 0
+            elif j == last:
+                gain_s[op] = gain[last,op]
+            else:
+                gain_s[op] = gain[j,op] + (((gain[j+1,op] - gain[j,op]) * frac) >> 16)
+
+        if fb_level:
+            modphases[fb_dst] += (fbstate[0] + fbstate[1]) >> fb_shift
+        last_mod = -1
+        y = 0
+        for e in range(edges.shape[0]):
+            mod_op = edges[e,0]
+            if mod_op != last_mod:
+                y = 0
+                if gain_s[mod_op] != 0:
+                    y = (sin_lookup(modphases[mod_op]) * gain_s[mod_op]) >> 24
+                last_mod = mod_op
+            modphases[edges[e,1]] += y
+        if fb_level:
+            fbstate[0] = fbstate[1]
+            fbstate[1] = 0
+            if gain_s[fb_src] != 0:
+                fbstate[1] = (sin_lookup(modphases[fb_src]) * gain_s[fb_src]) >> 24
+        acc = 0
+        for op in range(n_op):
+            if outmatrix[op] and gain_s[op] != 0:
+                acc += (sin_lookup(modphases[op]) * gain_s[op]) >> 24
+        out[s - start] = acc / (1 << 24)
+    return out
+
+
+@njit(cache=True,nogil=True)
+def dx7_fixed_phase_scan(fr : np.array, f0 : np.array, n_frames : int, factor : int,
+                         sr : int, positions : np.array, phases : np.array,
+                         out : np.array):
+    """
+    Integer version of synth.dx7_numba_phase_scan.
+      phases: [n_op] int64 Q24 phase accumulators, updated in place.
+    """
+    inc_scale = (1 << 24) / sr
+    num = n_frames*factor
+    div = num - 1
+    step = 0.0
+    if div > 0:
+        step = (n_frames - 1) / div
+    last = n_frames - 1
+    i = 0
+    for s in range(num):
+        while i < positions.shape[0] and positions[i] == s:
+            out[i] = phases
+            i += 1
+        if i == positions.shape[0]:
+            break
+        if div <= 0 or step == 0:
+            x = 0.0
+        else:
+            x = s * step
+        if s == num - 1 and num > 1:
+            x = float(n_frames - 1)
+        j = int(x)
+        frac = int((x - j) * (1 << 16))
+        j = min(j,last)
+        if j == last:
+            pitch = f0[last]
+        else:
+            pitch = f0[j] + (f0[j+1] - f0[j]) * (frac / (1 << 16))
+        for op in range(len(fr)):
+            phases[op] = (phases[op] + np.int64(pitch * fr[op] * inc_scale + 0.5)) & PHASE_MASK
+
+
+def compare_engines(specs, midi_sequence, sr:int=44100, block_size:int=64):
+    '''
+    Renders a sequence with the float and the fixed point engines and
+    returns a dict with the max and rms absolute error of the fixed engine
+    and its SNR in dB, taking the float render as reference.
+    '''
+    from .synth import dx7_synth
+    ref = dx7_synth(specs,sr,block_size).render_from_midi_sequence(midi_sequence)
+    fixed = dx7_synth(specs,sr,block_size,engine='fixed').render_from_midi_sequence(midi_sequence)
+    err = fixed - ref
+    rms_err = np.sqrt(np.mean(err**2)) if len(err) > 0 else 0.0
+    rms_ref = np.sqrt(np.mean(ref**2)) if len(ref) > 0 else 0.0
+    snr = 20*np.log10(rms_ref/rms_err) if rms_err > 0 else np.inf
+    return {'max_abs_error':float(np.max(np.abs(err),initial=0.0)),
+            'rms_error':float(rms_err),
+            'snr_db':float(snr)}
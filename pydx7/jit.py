@@ -0,0 +1,46 @@
+import numpy as np
+
+# Every numba kernel of the package is compiled with cache=True, so compiled
+# code is stored next to the sources (or in NUMBA_CACHE_DIR when the package
+# directory is read-only) and reused by later processes.
+
+def warmup(sr:int=44100,block_size:int=64,engines=('float','fixed')):
+    '''
+    Compiles (or loads from the on-disk cache) the kernels used by the
+    package, by rendering a short note through every API with a blank patch.
+    Call it once at process start to move the compile time out of the first render.
+    Args:
+        sr: sample rate in Hz.
+        block_size: n. of samples per envelope frame.
+        engines: dx7_synth engines to compile.
+    '''
+    from pydx7.dx7tools import load_patch
+    from pydx7.synth import dx7_synth, midi_note, render_batch, render_sequences, dx7_numba_render
+    from pydx7.poly import dx7_poly_synth
+
+    specs = load_patch(np.zeros(128,dtype=np.uint8))
+    seq = [midi_note(60,100,2,2)]
+    # float32 synths render their envelopes in float32 unless modulated, and
+    # the server and the dataset generator render float32 audio.
+    for engine in engines:
+        for dtype in (np.float64,np.float32):
+            for modulation in (False,True):
+                synth = dx7_synth(specs,sr,block_size,engine=engine,dtype=dtype,
+                                  modulation=modulation)
+                synth.render_from_midi_sequence(seq)
+                synth.render_from_midi_sequence(seq,workers=2)
+                synth.render_from_osc_envelopes(np.zeros(2),np.zeros((2,6),dtype=dtype))
+    for dtype in (np.float64,np.float32):
+        synth = dx7_synth(specs,sr,block_size,dtype=dtype,sustain_tolerance=1e-3)
+        synth.render_from_midi_sequence(seq)
+        synth.note_on(60,100)
+        synth.process(block_size)
+        out = np.zeros(dx7_synth.sequence_frames(seq)*block_size,dtype=dtype)
+        render_sequences([synth],[seq],out)
+    poly = dx7_poly_synth(specs,n_voices=2,sr=sr,block_size=block_size)
+    poly.note_on(60,100)
+    poly.process(block_size)
+    dx7_numba_render(synth.fr,synth.modmatrix,synth.outmatrix,np.zeros(2),
+                     np.zeros((2,6)),sr)
+    render_batch(np.ones((1,6)),np.zeros(1,dtype=np.int64),np.zeros((1,2)),
+                 np.zeros((1,2,6)),sr)
@@ -0,0 +1,267 @@
+import os
+import json
+import numpy as np
+from pydx7.cartridge import PATCH_DTYPE, unpack_patches, read_packed_patches
+from pydx7.dx7tools import patch_hash
+
+# Library records are cartridge patches plus their content hash and origin.
+LIBRARY_DTYPE = np.dtype(PATCH_DTYPE.descr + [
+    ('hash', 'S40'),
+    ('file_id', np.int32),
+    ('patch_number', np.int32),
+])
+
+# Occurrences of voices skipped as duplicates, to restore them when the
+# indexed copy is removed.
+DUPLICATE_DTYPE = np.dtype([
+    ('hash', 'S40'),
+    ('file_id', np.int32),
+    ('patch_number', np.int32),
+])
+
+CART_EXTENSIONS = ('.syx', '.cart', '.bin')
+MANIFEST_NAME = 'manifest.json'
+DUPLICATES_NAME = 'duplicates.npy'
+
+
+class PatchLibrary():
+    '''
+    On-disk index of unique DX7 voices gathered from directories of cart files.
+    Voices are deduplicated by the hash of their packed binary and stored
+    in columnar .npy shards (one per scan) that are memory-mapped on load.
+    Files already indexed are skipped by subsequent scans unless they changed,
+    in which case their voices are replaced. Skipped duplicates are recorded,
+    so that voices of removed files can be restored from other files.
+    '''
+    def __init__(self,index_dir):
+        '''
+        Args:
+            index_dir: Directory holding the shards and the manifest. Created if missing.
+        '''
+        self.index_dir = index_dir
+        os.makedirs(index_dir,exist_ok=True)
+        manifest_path = os.path.join(index_dir,MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'files':[],'shards':[]}
+        self._patches = None
+        self._hashes = None
+
+    def __len__(self):
+        return len(self.patches)
+
+    def __getitem__(self,idx):
+        return self.patches[idx]
+
+    @property
+    def patches(self) -> np.array:
+        '''
+        Structured array (LIBRARY_DTYPE) with every unique voice of the library.
+        '''
+        if self._patches is None:
+            shards = [np.load(os.path.join(self.index_dir,s),mmap_mode='r')
+                      for s in self.manifest['shards']]
+            if len(shards) == 0:
+                self._patches = np.zeros(0,dtype=LIBRARY_DTYPE)
+            elif len(shards) == 1:
+                self._patches = shards[0]
+            else:
+                self._patches = np.concatenate(shards)
+        return self._patches
+
+    @property
+    def files(self):
+        '''
+        Paths of the indexed cart files, in file_id order.
+        '''
+        return [entry['path'] for entry in self.manifest['files']]
+
+    def scan(self,dirs,extensions=CART_EXTENSIONS) -> int:
+        '''
+        Indexes the cart files found under one or more directories.
+        Voices of files that changed since they were indexed, or that no longer
+        exist, are removed from the library first, and changed files re-read.
+        Returns the number of new unique voices added to the library.
+        '''
+        if isinstance(dirs,(str,os.PathLike)):
+            dirs = [dirs]
+        known = {entry['path']:entry for entry in self.manifest['files']}
+
+        # Files to (re)read, and indexed files whose voices are out of date.
+        to_read = []
+        for d in dirs:
+            for root, _, names in os.walk(d):
+                for name in sorted(names):
+                    if not name.lower().endswith(extensions):
+                        continue
+                    path = os.path.abspath(os.path.join(root,name))
+                    st = os.stat(path)
+                    entry = known.get(path)
+                    if entry is not None and entry['size'] == st.st_size \
+                            and entry['mtime'] == st.st_mtime:
+                        continue
+                    to_read.append((path,st))
+        stale = {known[path]['id'] for path, _ in to_read if path in known}
+        for entry in self.manifest['files']:
+            if entry['size'] is not None and not os.path.exists(entry['path']):
+                stale.add(entry['id'])
+                entry['size'] = entry['mtime'] = None
+                entry['n_patches'] = 0
+        removed = self._purge(stale)
+        duplicates = [self._load_duplicates()]
+        if len(stale) > 0:
+            duplicates[0] = duplicates[0][~np.isin(duplicates[0]['file_id'],list(stale))]
+        if self._hashes is None or len(removed) > 0:
+            self._hashes = set(self.patches['hash'].tolist())
+
+        new_records = []
+        for path, st in to_read:
+            entry = known.get(path)
+            if entry is None:
+                entry = {'path':path}
+                entry['id'] = len(self.manifest['files'])
+                self.manifest['files'].append(entry)
+                known[path] = entry
+            entry['size'] = st.st_size
+            entry['mtime'] = st.st_mtime
+            records, skipped = self._read_cart(path,entry['id'])
+            entry['n_patches'] = len(records)
+            if len(records) > 0:
+                new_records.append(records)
+            duplicates.append(skipped)
+        duplicates = np.concatenate(duplicates)
+        # Removed voices may have duplicates in other files, which were skipped
+        # when they were indexed: restore them from the first occurrence recorded.
+        lost = removed[[h not in self._hashes for h in removed['hash'].tolist()]]
+        if len(lost) > 0 and len(duplicates) > 0:
+            by_hash = {h:i for i, h in enumerate(lost['hash'].tolist())}
+            restored = np.zeros(len(duplicates),dtype=bool)
+            for i in np.flatnonzero(np.isin(duplicates['hash'],lost['hash'])):
+                h = duplicates['hash'][i].item()
+                if h in self._hashes:
+                    continue
+                record = lost[by_hash[h]:by_hash[h] + 1].copy()
+                record['file_id'] = duplicates['file_id'][i]
+                record['patch_number'] = duplicates['patch_number'][i]
+                self.manifest['files'][duplicates['file_id'][i]]['n_patches'] += 1
+                self._hashes.add(h)
+                restored[i] = True
+                new_records.append(record)
+            duplicates = duplicates[~restored]
+        if len(stale) > 0 or len(to_read) > 0:
+            self._save_shard(DUPLICATES_NAME,duplicates)
+
+        if len(new_records) > 0:
+            new_records = np.concatenate(new_records)
+        else:
+            new_records = np.zeros(0,dtype=LIBRARY_DTYPE)
+        if len(new_records) > 0:
+            shard = 'shard_{:05d}.npy'.format(self._next_shard())
+            self._save_shard(shard,new_records)
+            self.manifest['shards'].append(shard)
+            self._patches = None
+        self._write_manifest()
+        return len(new_records)
+
+    def select(self,**conditions) -> np.array:
+        '''
+        Returns the voices whose fields equal the given values, e.g.
+            library.select(algorithm=4, has_fixed_freqs=False)
+        returns all algorithm 5 patches without fixed frequencies (algorithms are 0-31).
+        '''
+        return self.patches[self.mask(**conditions)]
+
+    def mask(self,**conditions) -> np.array:
+        '''
+        Boolean mask over the library for the given field values (see select).
+        '''
+        patches = self.patches
+        mask = np.ones(len(patches),dtype=bool)
+        for field, value in conditions.items():
+            column = patches[field]
+            if column.ndim > 1:
+                mask &= np.all(column.reshape(len(patches),-1) == np.ravel(value),axis=1)
+            else:
+                mask &= (column == value)
+        return mask
+
+    def _purge(self,file_ids) -> set:
+        '''
+        Removes the voices of the given file ids, rewriting the shards holding
+        them (empty shards are deleted). Returns the removed records.
+        '''
+        removed = [np.zeros(0,dtype=LIBRARY_DTYPE)]
+        if len(file_ids) == 0:
+            return removed[0]
+        file_ids = np.array(sorted(file_ids),dtype=np.int32)
+        shards = []
+        for shard in self.manifest['shards']:
+            path = os.path.join(self.index_dir,shard)
+            records = np.load(path,mmap_mode='r')
+            drop = np.isin(records['file_id'],file_ids)
+            if not drop.any():
+                shards.append(shard)
+                continue
+            removed.append(np.array(records[drop]))
+            records = np.array(records[~drop])
+            self._patches = None
+            if len(records) > 0:
+                self._save_shard(shard,records)
+                shards.append(shard)
+            else:
+                os.remove(path)
+        self.manifest['shards'] = shards
+        return np.concatenate(removed)
+
+    def _load_duplicates(self) -> np.array:
+        path = os.path.join(self.index_dir,DUPLICATES_NAME)
+        if not os.path.exists(path):
+            return np.zeros(0,dtype=DUPLICATE_DTYPE)
+        return np.load(path)
+
+    def _next_shard(self) -> int:
+        numbers = [int(s[len('shard_'):-len('.npy')]) for s in self.manifest['shards']]
+        return max(numbers,default=-1) + 1
+
+    def _save_shard(self,shard,records):
+        tmp = os.path.join(self.index_dir,shard + '.tmp')
+        with open(tmp,'wb') as f:
+            np.save(f,records)
+        os.replace(tmp,os.path.join(self.index_dir,shard))
+
+    def _read_cart(self,path,file_id):
+        '''
+        Returns the records of the voices of a cart file that are not in the
+        library yet, and the DUPLICATE_DTYPE entries of the others.
+        '''
+        with open(path,'rb') as f:
+            load_from_sysex = f.read(1) == b'\xf0'
+        packed = read_packed_patches(path,load_from_sysex)
+        records = np.zeros(len(packed),dtype=LIBRARY_DTYPE)
+        if len(packed) == 0:
+            return records, np.zeros(0,dtype=DUPLICATE_DTYPE)
+        patches = unpack_patches(packed)
+        for name in PATCH_DTYPE.names:
+            records[name] = patches[name]
+        records['file_id'] = file_id
+        records['patch_number'] = np.arange(len(packed))
+        keep = np.zeros(len(packed),dtype=bool)
+        for i in range(len(packed)):
+            h = patch_hash(packed[i])
+            records['hash'][i] = h
+            if h not in self._hashes:
+                self._hashes.add(h)
+                keep[i] = True
+        skipped = np.zeros(len(packed) - keep.sum(),dtype=DUPLICATE_DTYPE)
+        for name in DUPLICATE_DTYPE.names:
+            skipped[name] = records[name][~keep]
+        return records[keep], skipped
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.index_dir,MANIFEST_NAME)
+        tmp = manifest_path + '.tmp'
+        with open(tmp,'w') as f:
+            json.dump(self.manifest,f,indent=1)
+        os.replace(tmp,manifest_path)
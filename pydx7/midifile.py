@@ -0,0 +1,181 @@
+import heapq
+from .sequence import NoteSequence
+
+# Standard MIDI File reader. Tracks are parsed lazily and merged in time
+# order, and notes are flattened into a monophonic NoteSequence quantized to
+# envelope frames, as the synth renders one note at a time.
+
+# Tempo in microseconds per quarter note until the first tempo event (120 bpm).
+DEFAULT_TEMPO = 500000
+
+EVENT_NOTE_OFF = 0
+EVENT_NOTE_ON = 1
+EVENT_TEMPO = 2
+EVENT_END = 3
+
+
+def _read_var_len(data, pos: int):
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7f)
+        if b < 0x80:
+            return value, pos
+
+def read_header(f):
+    '''
+    Reads the header chunk of a MIDI file object.
+    Returns (format, n. of tracks, division).
+    '''
+    kind, data = _read_chunk(f)
+    if kind != b'MThd' or len(data) < 6:
+        raise ValueError('not a Standard MIDI File')
+    fmt = int.from_bytes(data[0:2], 'big')
+    n_tracks = int.from_bytes(data[2:4], 'big')
+    division = int.from_bytes(data[4:6], 'big')
+    return fmt, n_tracks, division
+
+def _read_chunk(f):
+    header = f.read(8)
+    if len(header) < 8:
+        return None, None
+    length = int.from_bytes(header[4:8], 'big')
+    data = f.read(length)
+    if len(data) < length:
+        raise ValueError('truncated MIDI chunk')
+    return header[:4], data
+
+def iter_track_events(data):
+    '''
+    Yields the (tick, event, channel, a, b) note and tempo events of the
+    bytes of a track chunk, with absolute ticks:
+        EVENT_NOTE_ON / EVENT_NOTE_OFF: a is the note, b the velocity
+            (a note on with null velocity is a note off).
+        EVENT_TEMPO: a is the tempo, in microseconds per quarter note.
+        EVENT_END: last event of the track.
+    '''
+    pos = 0
+    tick = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = _read_var_len(data, pos)
+        tick += delta
+        b = data[pos]
+        # Meta and sysex events cancel the running status.
+        if b == 0xff:
+            status = 0
+            meta = data[pos + 1]
+            length, pos = _read_var_len(data, pos + 2)
+            if meta == 0x51 and length == 3:
+                yield tick, EVENT_TEMPO, 0, int.from_bytes(data[pos:pos + 3], 'big'), 0
+            elif meta == 0x2f:
+                break
+            pos += length
+            continue
+        if b == 0xf0 or b == 0xf7:
+            status = 0
+            length, pos = _read_var_len(data, pos + 1)
+            pos += length
+            continue
+        if b & 0x80:
+            status = b
+            pos += 1
+        elif status == 0:
+            raise ValueError('MIDI data byte without a status byte')
+        kind = status & 0xf0
+        if kind == 0x90 or kind == 0x80:
+            on = kind == 0x90 and data[pos + 1] > 0
+            yield (tick, EVENT_NOTE_ON if on else EVENT_NOTE_OFF, status & 0x0f,
+                   data[pos], data[pos + 1])
+        pos += 1 if kind == 0xc0 or kind == 0xd0 else 2
+    yield tick, EVENT_END, 0, 0, 0
+
+def iter_midi_events(f):
+    '''
+    Yields the events of all the tracks of a MIDI file object in time order
+    (see iter_track_events), after its header: (format, n. of tracks, division).
+    At equal ticks, events of earlier tracks come first.
+    '''
+    header = read_header(f)
+    tracks = []
+    while True:
+        kind, data = _read_chunk(f)
+        if kind is None:
+            break
+        if kind == b'MTrk':
+            tracks.append(iter_track_events(data))
+    yield header
+    yield from heapq.merge(*tracks, key=lambda event: event[0])
+
+def iter_midi_file(midi_file, sr: int = 44100, block_size: int = 64, channels=None,
+                   release_frames: int = 0, chunk_size: int = 65536):
+    '''
+    Reads a Standard MIDI File as NoteSequence chunks of up to chunk_size entries,
+    with times quantized to envelope frames of block_size samples at sr Hz.
+    The notes are played one at a time: a note is cut when the next one starts,
+    and released until then. Gaps before the first note are silences.
+    Args:
+        midi_file: path or binary file object
+        channels: MIDI channels (0-15) to read, all if None
+        release_frames: frames added to the release of the last note
+    '''
+    if isinstance(midi_file, str):
+        with open(midi_file, 'rb') as f:
+            yield from iter_midi_file(f, sr, block_size, channels, release_frames, chunk_size)
+        return
+    events = iter_midi_events(midi_file)
+    _, _, division = next(events)
+    frame_rate = sr / block_size
+    if division & 0x8000:
+        # SMPTE time: frames per second (negative) and ticks per frame.
+        tick_seconds = 1.0 / ((256 - (division >> 8)) * (division & 0xff))
+    else:
+        tick_seconds = DEFAULT_TEMPO * 1e-6 / division
+    tempo_tick = 0
+    tempo_seconds = 0.0
+    cols = [[] for _ in range(5)]
+    # Current note: [channel, note, velocity, start frame, end frame or -1]
+    cur = None
+    t = 0
+    for tick, event, channel, a, b in events:
+        t = int(round((tempo_seconds + (tick - tempo_tick) * tick_seconds) * frame_rate))
+        if event == EVENT_TEMPO:
+            if not division & 0x8000:
+                tempo_seconds += (tick - tempo_tick) * tick_seconds
+                tempo_tick = tick
+                tick_seconds = a * 1e-6 / division
+            continue
+        if event == EVENT_END or (channels is not None and channel not in channels):
+            continue
+        if event == EVENT_NOTE_OFF:
+            if cur is not None and cur[4] < 0 and cur[0] == channel and cur[1] == a:
+                cur[4] = t
+            continue
+        if cur is None:
+            if t > 0:
+                for col, value in zip(cols, (0, 0, 0, 0, t)):
+                    col.append(value)
+        else:
+            off = t if cur[4] < 0 else min(cur[4], t)
+            if t > cur[3]:
+                for col, value in zip(cols, (cur[1], cur[2], off - cur[3], t - off, 0)):
+                    col.append(value)
+        cur = [channel, a, b, t, -1]
+        if len(cols[0]) >= chunk_size:
+            yield NoteSequence(*cols)
+            cols = [[] for _ in range(5)]
+    if cur is not None and t + release_frames > cur[3]:
+        off = t if cur[4] < 0 else cur[4]
+        for col, value in zip(cols, (cur[1], cur[2], off - cur[3], t - off + release_frames, 0)):
+            col.append(value)
+    if len(cols[0]) > 0:
+        yield NoteSequence(*cols)
+
+def read_midi_file(midi_file, sr: int = 44100, block_size: int = 64, channels=None,
+                   release_frames: int = 0) -> NoteSequence:
+    '''
+    Reads a Standard MIDI File as one NoteSequence (see iter_midi_file).
+    '''
+    return NoteSequence.concatenate(iter_midi_file(midi_file, sr, block_size, channels,
+                                                   release_frames))
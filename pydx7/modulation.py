@@ -0,0 +1,227 @@
+import numpy as np
+from numba import njit
+from .fixedpoint import sin_lookup
+
+# Pitch EG and LFO, after the Dexed / msfa implementation (pitchenv.cc,
+# lfo.cc and the modulation part of dx7note.cc). Both run at control rate:
+# they are stepped once per envelope frame, and their output is folded into
+# the note contour and the log envelopes, which the FM kernels interpolate.
+
+PITCH_RATE_TAB = np.array([
+    1, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13,
+    13, 14, 14, 15, 16, 16, 17, 18, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28,
+    30, 31, 33, 34, 36, 37, 38, 39, 41, 42, 44, 46, 47, 49, 51, 53, 54, 56, 58,
+    60, 62, 64, 66, 68, 70, 72, 74, 76, 79, 82, 85, 88, 91, 94, 98, 102, 106,
+    110, 115, 120, 125, 130, 135, 141, 147, 153, 159, 165, 171, 178, 185, 193,
+    202, 211, 232, 243, 254, 255], dtype=np.int64)
+
+# Pitch EG levels in 1/128 octave steps (level 50 is no shift).
+PITCH_TAB = np.array([
+    -128, -116, -104, -95, -85, -76, -68, -61, -56, -52, -49, -46, -43, -41,
+    -39, -37, -35, -33, -32, -31, -30, -29, -28, -27, -26, -25, -24, -23, -22,
+    -21, -20, -19, -18, -17, -16, -15, -14, -13, -12, -11, -10, -9, -8, -7, -6,
+    -5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34,
+    35, 38, 40, 43, 46, 49, 53, 58, 65, 73, 82, 92, 103, 115, 127], dtype=np.int64)
+
+PITCH_MOD_SENS_TAB = np.array([0, 10, 20, 33, 55, 92, 153, 255], dtype=np.int64)
+AMP_MOD_SENS_TAB = np.array([0, 4342338, 7171437, 16777216], dtype=np.int64)
+
+LFO_TRIANGLE = 0
+LFO_SAW_DOWN = 1
+LFO_SAW_UP = 2
+LFO_SQUARE = 3
+LFO_SINE = 4
+LFO_SAMPLE_HOLD = 5
+
+# Indices of the modulation parameters (see modulation_params).
+MOD_PITCH_UNIT = 0
+MOD_LFO_DELTA = 1
+MOD_LFO_DELAYINC = 2
+MOD_LFO_DELAYINC2 = 3
+MOD_LFO_WAVEFORM = 4
+MOD_LFO_SYNC = 5
+MOD_PMD = 6
+MOD_PMS = 7
+MOD_AMD = 8
+MOD_PARAMS_SIZE = 9
+
+# Indices of an LFO state row. Phase and delay are uint32 accumulators.
+LFO_PHASE = 0
+LFO_DELAY = 1
+LFO_RAND = 2
+LFO_STATE_SIZE = 3
+
+_U32 = (1 << 32) - 1
+
+
+def modulation_params(specs, sr: int, block_size: int) -> np.array:
+    '''
+    Returns the MOD_PARAMS_SIZE int64 parameters of the pitch EG and LFO of
+    a patch, for envelope frames of block_size samples at sr Hz.
+    '''
+    params = np.zeros(MOD_PARAMS_SIZE, dtype=np.int64)
+    params[MOD_PITCH_UNIT] = int(block_size * (1 << 24) / (21.3 * sr) + 0.5)
+    # 1 << 32 / 15.5s / 11
+    unit = int(block_size * 25190424 / sr + 0.5)
+    rate = int(specs['lfo_speed'])
+    step = 1 if rate == 0 else (165 * rate) >> 6
+    step *= 11 if step < 160 else 11 + ((step - 160) >> 4)
+    params[MOD_LFO_DELTA] = (unit * step) & _U32
+    a = 99 - int(specs['lfo_delay'])
+    if a == 99:
+        params[MOD_LFO_DELAYINC] = _U32
+        params[MOD_LFO_DELAYINC2] = _U32
+    else:
+        a = (16 + (a & 15)) << (1 + (a >> 4))
+        params[MOD_LFO_DELAYINC] = (unit * a) & _U32
+        params[MOD_LFO_DELAYINC2] = (unit * max(0x80, a & 0xff80)) & _U32
+    params[MOD_LFO_WAVEFORM] = int(specs['lfo_waveform'])
+    params[MOD_LFO_SYNC] = int(specs['lfo_sync']) != 0
+    params[MOD_PMD] = (int(specs['lfo_pmd']) * 165) >> 6
+    params[MOD_PMS] = PITCH_MOD_SENS_TAB[int(specs['pitch_mod_sens']) & 7]
+    params[MOD_AMD] = (int(specs['lfo_amd']) * 165) >> 6
+    return params
+
+def amp_mod_sens(specs) -> np.array:
+    '''
+    Q24 amplitude modulation sensitivities [6] of the operators of a patch.
+    '''
+    return AMP_MOD_SENS_TAB[np.asarray(specs['amp_mod_sens'], dtype=np.int64) & 3]
+
+
+@njit(cache=True)
+def lfo_keydown(params, state):
+    if params[MOD_LFO_SYNC]:
+        state[LFO_PHASE] = (1 << 31) - 1
+    state[LFO_DELAY] = 0
+
+@njit(cache=True)
+def lfo_getsample(params, state):
+    '''
+    Steps the LFO by one frame. Returns its Q24 value, in [0,1].
+    '''
+    delta = params[MOD_LFO_DELTA]
+    phase = (state[LFO_PHASE] + delta) & _U32
+    state[LFO_PHASE] = phase
+    waveform = params[MOD_LFO_WAVEFORM]
+    if waveform == LFO_TRIANGLE:
+        x = phase >> 7
+        if phase >> 31:
+            x = ~x
+        return x & ((1 << 24) - 1)
+    elif waveform == LFO_SAW_DOWN:
+        return ((~phase & _U32) ^ (1 << 31)) >> 8
+    elif waveform == LFO_SAW_UP:
+        return (phase ^ (1 << 31)) >> 8
+    elif waveform == LFO_SQUARE:
+        return ((~phase & _U32) >> 7) & (1 << 24)
+    elif waveform == LFO_SINE:
+        return (1 << 23) + (sin_lookup(phase >> 8) >> 1)
+    elif waveform == LFO_SAMPLE_HOLD:
+        if phase < delta:
+            state[LFO_RAND] = (state[LFO_RAND] * 179 + 17) & 0xff
+        return ((state[LFO_RAND] ^ 0x80) + 1) << 16
+    return 1 << 23
+
+@njit(cache=True)
+def lfo_getdelay(params, state):
+    '''
+    Steps the LFO delay by one frame. Returns the Q24 depth ramp, in [0,1].
+    '''
+    d = state[LFO_DELAY]
+    d += params[MOD_LFO_DELAYINC] if d < (1 << 31) else params[MOD_LFO_DELAYINC2]
+    if d > _U32:
+        return 1 << 24
+    state[LFO_DELAY] = d
+    if d < (1 << 31):
+        return 0
+    return (d >> 7) & ((1 << 24) - 1)
+
+@njit(cache=True)
+def lfo_skip(params, state, n):
+    '''
+    Runs the LFO for n frames, e.g. over a silence.
+    '''
+    for i in range(n):
+        lfo_getsample(params, state)
+        lfo_getdelay(params, state)
+
+@njit(cache=True)
+def pitch_eg_render(rates, levels, unit, frames_on, out):
+    '''
+    Renders the Q24 pitch EG (in octaves) of a note into 'out' [n_frames],
+    releasing it after frame frames_on as dx7env.eg_render_kernel does.
+    '''
+    level = PITCH_TAB[levels[3]] << 19
+    down = True
+    ix = 0
+    target = PITCH_TAB[levels[0]] << 19
+    rising = target > level
+    inc = PITCH_RATE_TAB[rates[0]] * unit
+    for i in range(out.shape[0]):
+        if ix < 3 or (ix < 4 and not down):
+            if rising:
+                level += inc
+                reached = level >= target
+            else:
+                level -= inc
+                reached = level <= target
+            if reached:
+                level = target
+                ix += 1
+                if ix < 4:
+                    target = PITCH_TAB[levels[ix]] << 19
+                    rising = target > level
+                    inc = PITCH_RATE_TAB[rates[ix]] * unit
+        out[i] = level
+        if i == frames_on and down:
+            down = False
+            ix = 3
+            target = PITCH_TAB[levels[3]] << 19
+            rising = target > level
+            inc = PITCH_RATE_TAB[rates[3]] * unit
+
+@njit(cache=True)
+def modulate_note(params, state, pitch_rates, pitch_levels, ams, frames_on,
+                  qenv, gain, contour):
+    '''
+    Applies the pitch EG and LFO to a note, in place.
+        params: modulation parameters (see modulation_params)
+        state: LFO state row, keyed down at the start of the note
+        pitch_rates, pitch_levels: [4] pitch EG settings
+        ams: [n_op] Q24 amplitude modulation sensitivities (see amp_mod_sens)
+        qenv, gain: [n_op,n_frames] envelopes in doubling log format and
+            linear (see dx7env.eg_render_kernel). Operators with a non null
+            sensitivity are attenuated, and their linear gains recomputed.
+        contour: [n_frames] note contour, in semitones, shifted by the pitch mod.
+    As in Dexed, an operator with a non null sensitivity is attenuated by
+    about 1% of its log level even at null depth.
+    '''
+    n_op, n_frames = qenv.shape
+    pitch = np.zeros(n_frames, dtype=np.int64)
+    pitch_eg_render(pitch_rates, pitch_levels, params[MOD_PITCH_UNIT], frames_on, pitch)
+    lfo_keydown(params, state)
+    for i in range(n_frames):
+        value = lfo_getsample(params, state)
+        delay = lfo_getdelay(params, state)
+        # Pitch: bipolar LFO scaled by the delay ramp, depth and sensitivity.
+        pmd = params[MOD_PMD] * delay
+        senslfo = params[MOD_PMS] * (value - (1 << 23))
+        pmod = abs((pmd * senslfo) >> 39)
+        if senslfo < 0:
+            pmod = -pmod
+        contour[i] += (pitch[i] + pmod) * (12.0 / (1 << 24))
+        # Amplitude: unipolar LFO, attenuates the log level of each operator.
+        amod = (params[MOD_AMD] * delay) >> 8
+        amod = (amod * ((1 << 24) - value)) >> 24
+        for op in range(n_op):
+            if ams[op] == 0:
+                continue
+            sensamp = (amod * ams[op]) >> 24
+            pt = np.int64(np.exp(sensamp / 262144 * 0.07 + 12.2))
+            level = np.int64(qenv[op, i])
+            level -= (level * (pt << 4)) >> 28
+            qenv[op, i] = level
+            # See dx7tools.render_env for the gain expression.
+            gain[op, i] = 2**(10 + level * (1.0 / (1 << 24))) / (1 << 24)
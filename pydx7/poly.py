@@ -0,0 +1,206 @@
+import numpy as np
+from numba import njit
+from .dx7tools import get_modmatrix, get_outmatrix, get_schedule, scale_outlevel
+from .dx7env import EG_STATE_SIZE, EG_IX, EG_DOWN, eg_init, eg_keydown, eg_getsample
+from .synth import _fm_sample, _fb_scale
+
+STEAL_OLDEST = 'oldest'
+STEAL_QUIETEST = 'quietest'
+
+@njit(cache=True)
+def dx7_numba_poly(fr : np.array, edges : np.array, outmatrix : np.array,
+                   feedback : np.array, egstate : np.array, rates : np.array,
+                   levels : np.array, outlevels : np.array, active : np.array,
+                   gains : np.array, f0 : np.array, pos : int, block_size : int,
+                   sr : int, scale : float, phases : np.array, fbstate : np.array,
+                   out : np.array) -> int:
+    """
+    Renders len(out) samples of a pool of voices, updating their state in place.
+      edges, feedback: operator schedule (see dx7tools.get_schedule and synth._fm_sample)
+      egstate: [n_voices,n_op,EG_STATE_SIZE] EG state rows (see dx7env)
+      rates, levels: [4,n_op] EG settings
+      outlevels: [n_voices,n_op] scaled output levels
+      active: [n_voices] voices currently sounding
+      gains: [n_voices,2,n_op] linear gains of the previous and current control frame
+      f0: [n_voices] pitch of each voice
+      phases: [n_voices,n_op] free running phases
+      fbstate: [n_voices,2] feedback state
+      pos: position (in samples) within the current control frame
+    All active voices step their EGs once every block_size samples, as
+    synth.dx7_numba_stream does. A released voice whose EGs all reached
+    their last stage is freed.
+    Returns the new position within the current control frame.
+    """
+    n_voices, n_op = outlevels.shape
+    tstep = 1/sr
+    fb_scale = _fb_scale(feedback)
+    modphases = np.zeros(n_op)
+    ol = np.zeros(n_op)
+    voices = np.zeros(n_voices,dtype=np.int64)
+    n_active = 0
+    for v in range(n_voices):
+        if active[v]:
+            voices[n_active] = v
+            n_active += 1
+
+    for s in range(out.shape[0]):
+        if pos == 0:
+            n_active = 0
+            for v in range(n_voices):
+                if not active[v]:
+                    continue
+                finished = True
+                for op in range(n_op):
+                    gains[v,0,op] = gains[v,1,op]
+                    level = eg_getsample(egstate[v,op], rates[:,op], levels[:,op],
+                                         outlevels[v,op])
+                    gains[v,1,op] = 2**(10 + level * (1.0 / (1 << 24))) / (1 << 24)
+                    if egstate[v,op,EG_DOWN] or egstate[v,op,EG_IX] < 4:
+                        finished = False
+                if finished:
+                    active[v] = False
+                else:
+                    voices[n_active] = v
+                    n_active += 1
+        frac = pos / block_size
+        acc = 0.0
+        for i in range(n_active):
+            v = voices[i]
+            for op in range(n_op):
+                ol[op] = gains[v,0,op] + (gains[v,1,op] - gains[v,0,op]) * frac
+            acc += _fm_sample(fr, edges, outmatrix, feedback, fb_scale, f0[v], ol,
+                              tstep, scale, phases[v], modphases, fbstate[v])
+        out[s] = acc
+        pos += 1
+        if pos == block_size:
+            pos = 0
+    return pos
+
+
+class dx7_poly_synth():
+  """
+  Polyphonic synth with a fixed-capacity voice pool.
+  The state of all voices is kept in flat numpy arrays and every block is
+  rendered by a single compiled loop over the active voices.
+  """
+  def __init__(self,specs,n_voices:int=16,sr:int=44100,block_size:int=64,
+               steal:str=STEAL_OLDEST,feedback:bool=False):
+    """
+    Args:
+      specs: patch structure (see dx7tools.load_patch)
+      n_voices: capacity of the voice pool.
+      sr: sample rate in Hz.
+      block_size: n. of samples per envelope frame.
+      steal: voice to take when the pool is full, 'oldest' or 'quietest'.
+      feedback: apply the operator feedback of the patch (see synth.dx7_synth).
+    """
+    if steal not in (STEAL_OLDEST,STEAL_QUIETEST):
+      raise ValueError("steal must be '{}' or '{}'".format(STEAL_OLDEST,STEAL_QUIETEST))
+    self.specs = specs
+    self.modmatrix = get_modmatrix(specs['algorithm'])
+    self.outmatrix = get_outmatrix(specs['algorithm'])
+    self.edges, _, fb_ops = get_schedule(specs['algorithm'])
+    self.feedback = np.zeros(3,dtype=np.int64)
+    if feedback:
+      self.feedback[:] = (fb_ops[0],fb_ops[1],specs['feedback'])
+    self.fr = np.array(specs['fr'])
+    self.scale = 2*np.pi
+    self.sr = sr
+    self.block_size = block_size
+    self.n_voices = n_voices
+    self.steal = steal
+    self._eg_rate = np.array(specs['eg_rate'],dtype=np.int64)
+    self._eg_level = np.array(specs['eg_level'],dtype=np.int64)
+    self.reset()
+
+  def reset(self):
+    """
+    Silences and frees all voices.
+    """
+    self.phases = np.zeros((self.n_voices,6))
+    self.fbstate = np.zeros((self.n_voices,2))
+    self.egstate = np.zeros((self.n_voices,6,EG_STATE_SIZE),dtype=np.int64)
+    self.outlevels = np.zeros((self.n_voices,6),dtype=np.int64)
+    self.gains = np.zeros((self.n_voices,2,6))
+    self.f0 = np.zeros(self.n_voices)
+    self.active = np.zeros(self.n_voices,dtype=np.bool_)
+    self.notes = np.full(self.n_voices,-1,dtype=np.int64)
+    self.age = np.zeros(self.n_voices,dtype=np.int64)
+    self._pos = 0
+    self._note_count = 0
+
+  @property
+  def n_active(self):
+    return int(np.count_nonzero(self.active))
+
+  def _free_voice(self):
+    free = np.flatnonzero(~self.active)
+    if len(free) > 0:
+      return free[0]
+    if self.steal == STEAL_OLDEST:
+      return int(np.argmin(self.age))
+    return int(np.argmin(self.gains[:,1,:].sum(axis=1)))
+
+  def note_on(self,n:int,v:int):
+    """
+    Starts a note on a free voice, stealing one if the pool is full.
+    Args:
+      n: MIDI note number
+      v: MIDI velocity
+    """
+    voice = self._free_voice()
+    for i in range(6):
+      self.outlevels[voice,i] = scale_outlevel(self.specs['ol'][i],
+                                               self.specs['sensitivity'][i],v)
+      eg_init(self.egstate[voice,i],self._eg_rate[:,i],self._eg_level[:,i],
+              self.outlevels[voice,i])
+    self.f0[voice] = 440*2**((n-69)/12)
+    self.notes[voice] = n
+    self.active[voice] = True
+    self._note_count += 1
+    self.age[voice] = self._note_count
+    return voice
+
+  def note_off(self,n:int):
+    """
+    Releases every held voice playing note n.
+    """
+    for voice in np.flatnonzero(self.active & (self.notes == n)):
+      for i in range(6):
+        eg_keydown(self.egstate[voice,i],self._eg_rate[:,i],self._eg_level[:,i],
+                   self.outlevels[voice,i],0)
+      self.notes[voice] = -1
+
+  def process(self,n_samples:int):
+    """
+    Renders the next n_samples of the mix of all active voices.
+    """
+    out = np.zeros(n_samples)
+    self._pos = dx7_numba_poly(self.fr,self.edges,self.outmatrix,self.feedback,
+                               self.egstate,self._eg_rate,self._eg_level,
+                               self.outlevels,self.active,self.gains,self.f0,
+                               self._pos,self.block_size,self.sr,self.scale,
+                               self.phases,self.fbstate,out)
+    return out / (4*sum(self.outmatrix))
+
+  def render_events(self,events,n_samples:int):
+    """
+    Renders n_samples from a list of (sample, note, velocity) MIDI events,
+    sorted by sample. A velocity of 0 releases the note.
+    """
+    chunks = []
+    t = 0
+    for sample, n, v in events:
+      sample = min(int(sample),n_samples)
+      if sample > t:
+        chunks.append(self.process(sample - t))
+        t = sample
+      if v > 0:
+        self.note_on(n,v)
+      else:
+        self.note_off(n)
+    if n_samples > t:
+      chunks.append(self.process(n_samples - t))
+    if len(chunks) == 0:
+      return np.zeros(0)
+    return np.concatenate(chunks)
@@ -0,0 +1,120 @@
+import numpy as np
+
+# Column dtypes of a NoteSequence.
+NOTE_COLUMNS = {
+    'n':np.int16,
+    'v':np.int16,
+    'ton':np.int32,
+    'toff':np.int32,
+    'silence':np.int32,
+}
+
+
+class NoteSequence():
+    '''
+    Columnar sequence of notes: the fields of synth.midi_note held in
+    parallel numpy arrays (n, v, ton, toff, silence). Entries with a non
+    null 'silence' are silences of that many frames, others are notes of
+    ton + toff frames. A NoteSequence can be passed wherever a list of
+    midi_note objects is expected, e.g. dx7_synth.render_from_midi_sequence.
+    Indexing with an int returns a midi_note, with a slice or an index
+    array returns a NoteSequence (slices are views).
+    '''
+    def __init__(self,n=0,v=0,ton=0,toff=0,silence=0):
+        '''
+        Builds a sequence from one value or array per column. Columns are
+        broadcast against each other, e.g. NoteSequence(notes,100,200,50)
+        plays every note of 'notes' with the same velocity and durations.
+        '''
+        columns = np.broadcast_arrays(*[np.asarray(c) for c in (n,v,ton,toff,silence)])
+        for name, c in zip(NOTE_COLUMNS,columns):
+            setattr(self,name,np.array(c,dtype=NOTE_COLUMNS[name],ndmin=1).reshape(-1))
+
+    @classmethod
+    def _from_columns(cls,columns):
+        seq = cls.__new__(cls)
+        for name, c in zip(NOTE_COLUMNS,columns):
+            setattr(seq,name,c)
+        return seq
+
+    @classmethod
+    def from_notes(cls,midi_sequence):
+        '''
+        Builds a sequence from midi_note objects (or (n,v,ton,toff,silence) tuples).
+        '''
+        rows = [note if isinstance(note,(tuple,list))
+                else (note.n,note.v,note.ton,note.toff,note.silence)
+                for note in midi_sequence]
+        if len(rows) == 0:
+            return cls(np.zeros(0))
+        return cls(*np.array(rows,dtype=np.int64).T)
+
+    @classmethod
+    def silences(cls,frames):
+        '''
+        Sequence of silences of 'frames' frames each.
+        '''
+        return cls(0,0,0,0,frames)
+
+    @classmethod
+    def concatenate(cls,sequences):
+        sequences = list(sequences)
+        if len(sequences) == 0:
+            return cls(np.zeros(0))
+        return cls._from_columns([np.concatenate([getattr(s,name) for s in sequences])
+                                  for name in NOTE_COLUMNS])
+
+    def columns(self):
+        return [getattr(self,name) for name in NOTE_COLUMNS]
+
+    def __len__(self):
+        return len(self.n)
+
+    def __getitem__(self,idx):
+        if isinstance(idx,(int,np.integer)):
+            from .synth import midi_note
+            return midi_note(*[int(c[idx]) for c in self.columns()])
+        return self._from_columns([c[idx] for c in self.columns()])
+
+    def __iter__(self):
+        from .synth import midi_note
+        for row in zip(*[c.tolist() for c in self.columns()]):
+            yield midi_note(*row)
+
+    def __add__(self,other):
+        if not isinstance(other,NoteSequence):
+            other = NoteSequence.from_notes(other)
+        return NoteSequence.concatenate([self,other])
+
+    def __eq__(self,other):
+        if not isinstance(other,NoteSequence):
+            return NotImplemented
+        return all(np.array_equal(a,b) for a, b in zip(self.columns(),other.columns()))
+
+    def __repr__(self):
+        return 'NoteSequence({} entries, {} frames)'.format(len(self),self.n_frames)
+
+    def to_notes(self):
+        '''
+        Returns the sequence as a list of midi_note objects.
+        '''
+        return list(self)
+
+    @property
+    def frames(self) -> np.array:
+        '''
+        N. of envelope frames of each entry.
+        '''
+        return np.where(self.silence == 0,self.ton.astype(np.int64) + self.toff,self.silence)
+
+    @property
+    def n_frames(self) -> int:
+        return int(self.frames.sum())
+
+    def frame_offsets(self) -> np.array:
+        '''
+        [len+1] first frame of each entry, and the total n. of frames.
+        '''
+        offsets = np.zeros(len(self) + 1,dtype=np.int64)
+        np.cumsum(self.frames,out=offsets[1:])
+        return offsets
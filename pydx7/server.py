@@ -0,0 +1,410 @@
+"""
+Local render service.
+
+A RenderServer keeps a patch set and the compiled kernels warm and renders
+(patch id, midi notes) jobs for any number of clients over a Unix socket
+or a localhost TCP port. Jobs arriving within 'batch_window' seconds of each
+other are rendered together by a single parallel kernel call (see
+synth.render_sequences), straight into a shared memory block: clients get
+a zero-copy float32 view of their audio and release it when done.
+
+    python -m pydx7.server carts/ --socket /tmp/pydx7.sock
+
+    from pydx7.server import RenderClient
+    client = RenderClient('/tmp/pydx7.sock')
+    with client.render(3,[midi_note(60,100,200,100)]) as audio:
+        ...
+
+Messages are JSON objects, each prefixed by its length (4 bytes, big endian).
+"""
+import os
+import sys
+import json
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+DEFAULT_SOCKET = '/tmp/pydx7.sock'
+_HEADER = struct.Struct('>I')
+
+
+def _encode(msg) -> bytes:
+    data = json.dumps(msg).encode()
+    return _HEADER.pack(len(data)) + data
+
+async def _read_message(reader):
+    header = await reader.readexactly(_HEADER.size)
+    return json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+class RenderServer():
+    '''
+    Batching render server. Audio equals dx7_synth.render_from_midi_sequence
+    (float engine) cast to float32.
+    '''
+    def __init__(self,patches,sr:int=44100,block_size:int=64,feedback:bool=False,
+                 batch_window:float=0.002,max_batch:int=64,envelope_cache=None):
+        '''
+        Args:
+            patches: patch set, a Cartridge or a PATCH_DTYPE array. Jobs refer to patches
+                by index, and the synth of a patch is created on its first job.
+            batch_window: seconds to wait for more jobs once one has arrived.
+            max_batch: maximum n. of jobs rendered by one kernel call.
+            envelope_cache: optional envcache.EnvelopeCache shared by all renders.
+        '''
+        self.patches = patches
+        self.sr = sr
+        self.block_size = block_size
+        self.feedback = feedback
+        self.envelope_cache = envelope_cache
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._synths = {} # patch index -> dx7_synth, created on first use
+        self.n_jobs = 0
+        self.n_batches = 0
+        self._blocks = {} # shared memory name -> [block, n. of unreleased jobs]
+        self._queue = None
+        # Renders run in one thread: the kernel is parallel, and the event loop stays free.
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def synth(self,patch:int):
+        '''
+        Returns the synth of a patch, created on its first job.
+        '''
+        synth = self._synths.get(patch)
+        if synth is None:
+            from pydx7.synth import dx7_synth
+            synth = dx7_synth(self.patches[patch],self.sr,self.block_size,
+                              envelope_cache=self.envelope_cache,feedback=self.feedback)
+            self._synths[patch] = synth
+        return synth
+
+    def warmup(self):
+        '''
+        Compiles (or loads) the kernels used by the server, by rendering a job
+        as batches are rendered: into a float32 view on shared memory.
+        '''
+        from pydx7.synth import midi_note
+        block, _ = self._render([(0,[midi_note(60,100,2,2)],None)])
+        block.close()
+        block.unlink()
+
+    def stats(self):
+        return {'jobs':self.n_jobs,'batches':self.n_batches,
+                'mean_batch':self.n_jobs/max(self.n_batches,1),
+                'open_blocks':len(self._blocks)}
+
+    async def serve(self,path:str=None,host:str='127.0.0.1',port:int=None):
+        '''
+        Serves forever on a Unix socket at 'path', or on host:port if path is None.
+        '''
+        self._queue = asyncio.Queue()
+        await asyncio.get_running_loop().run_in_executor(self._executor,self.warmup)
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)
+            server = await asyncio.start_unix_server(self._handle,path)
+        else:
+            server = await asyncio.start_server(self._handle,host,port)
+        batcher = asyncio.ensure_future(self._batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.close()
+
+    def close(self):
+        '''
+        Frees all shared memory blocks, released or not.
+        '''
+        for block, _ in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
+
+    async def _handle(self,reader,writer):
+        lock = asyncio.Lock()
+        async def reply(msg):
+            async with lock:
+                writer.write(_encode(msg))
+                await writer.drain()
+        async def job(msg):
+            try:
+                await reply(await self._submit(msg,held))
+            except Exception as e:
+                await reply({'id':msg.get('id'),'error':str(e)})
+        tasks = set()
+        # Blocks handed out on this connection and not released yet: name -> n. of jobs.
+        held = collections.Counter()
+        try:
+            while True:
+                msg = await _read_message(reader)
+                if 'release' in msg:
+                    name = msg['release']
+                    if held[name] > 0:
+                        held[name] -= 1
+                        self._release(name)
+                elif msg.get('stats'):
+                    await reply(dict(self.stats(),id=msg.get('id')))
+                else:
+                    task = asyncio.ensure_future(job(msg))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError,ConnectionResetError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks,return_exceptions=True)
+            # A client that went away without releasing its jobs frees them now.
+            for name, count in held.items():
+                for _ in range(count):
+                    self._release(name)
+            writer.close()
+
+    async def _submit(self,msg,held):
+        '''
+        Queues a job and waits for its render. The block it is in is counted in 'held'.
+        '''
+        from pydx7.synth import midi_note
+        patch = int(msg['patch'])
+        if not 0 <= patch < len(self.patches):
+            raise ValueError('patch {} out of range'.format(patch))
+        notes = [midi_note(*note) for note in msg['notes']]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((patch,notes,future))
+        try:
+            name, offset, n_samples = await future
+        except asyncio.CancelledError:
+            # Cancelled after the render was done: the job still holds its block.
+            if future.done() and not future.cancelled() and future.exception() is None:
+                held[future.result()[0]] += 1
+            raise
+        held[name] += 1
+        return {'id':msg.get('id'),'shm':name,'offset':offset,'n_samples':n_samples}
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(jobs) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self._queue.empty():
+                    break
+                try:
+                    jobs.append(await asyncio.wait_for(self._queue.get(),max(timeout,0)))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                block, offsets = await loop.run_in_executor(self._executor,self._render,jobs)
+            except Exception as e:
+                for _, _, future in jobs:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+            self._blocks[block.name] = [block,len(jobs)]
+            self.n_jobs += len(jobs)
+            self.n_batches += 1
+            for i, (_, _, future) in enumerate(jobs):
+                if future.cancelled():
+                    self._release(block.name)
+                else:
+                    future.set_result((block.name,int(offsets[i]),int(offsets[i+1] - offsets[i])))
+
+    def _render(self,jobs):
+        from pydx7.synth import render_sequences
+        synths = [self.synth(patch) for patch, _, _ in jobs]
+        sequences = [notes for _, notes, _ in jobs]
+        n_samples = sum(synth.sequence_frames(seq) for synth, seq in zip(synths,sequences))
+        n_samples *= synths[0].block_size
+        block = shared_memory.SharedMemory(create=True,size=max(4*n_samples,1))
+        out = np.ndarray(n_samples,dtype=np.float32,buffer=block.buf)
+        try:
+            offsets = render_sequences(synths,sequences,out)[1]
+        except Exception:
+            del out
+            block.close()
+            block.unlink()
+            raise
+        del out
+        return block, offsets
+
+    def _release(self,name):
+        entry = self._blocks.get(name)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._blocks[name]
+            entry[0].close()
+            entry[0].unlink()
+
+
+# Blocks attached by this process: name -> [block, n. of SharedAudio using it].
+# Each block is attached once, as unregistering it twice from the resource
+# tracker (which would otherwise unlink the server's block at exit) fails.
+_attached = {}
+_attached_lock = threading.Lock()
+
+def _attach(name):
+    with _attached_lock:
+        entry = _attached.get(name)
+        if entry is None:
+            if sys.version_info >= (3,13):
+                block = shared_memory.SharedMemory(name=name,track=False)
+            else:
+                block = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(block._name,'shared_memory')
+            entry = _attached[name] = [block,0]
+        entry[1] += 1
+        return entry[0]
+
+def _detach(name):
+    with _attached_lock:
+        entry = _attached[name]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _attached[name]
+            try:
+                entry[0].close()
+            except BufferError:
+                # Views on the block are still alive, it is unmapped when they are freed.
+                pass
+
+
+class SharedAudio():
+    '''
+    Rendered audio held in the server's shared memory. 'array' is a float32
+    view on it, valid until release() (or the end of a with block).
+    '''
+    def __init__(self,client,name,offset,n_samples):
+        self._client = client
+        self.name = name
+        self._block = _attach(name)
+        self.array = np.ndarray(n_samples,dtype=np.float32,buffer=self._block.buf,
+                                offset=4*offset)
+
+    def copy(self):
+        '''
+        Copies the audio out of shared memory and releases it.
+        '''
+        audio = self.array.copy()
+        self.release()
+        return audio
+
+    def release(self):
+        if self._block is None:
+            return
+        self.array = None
+        self._block = None
+        _detach(self.name)
+        self._client._send({'release':self.name})
+
+    def __enter__(self):
+        return self.array
+
+    def __exit__(self,*exc):
+        self.release()
+
+
+class RenderClient():
+    '''
+    Blocking client of a RenderServer. Not thread safe: use one client per thread.
+    '''
+    def __init__(self,path:str=DEFAULT_SOCKET,host:str='127.0.0.1',port:int=None):
+        '''
+        Connects to a Unix socket at 'path', or to host:port if port is given.
+        '''
+        if port is not None:
+            self._sock = socket.create_connection((host,port))
+        else:
+            self._sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            self._sock.connect(path)
+        self._file = self._sock.makefile('rb')
+        self._next_id = 0
+
+    def _send(self,msg):
+        self._sock.sendall(_encode(msg))
+
+    def _request(self,msg):
+        msg['id'] = self._next_id
+        self._next_id += 1
+        self._send(msg)
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ConnectionError('render server closed the connection')
+        reply = json.loads(self._file.read(_HEADER.unpack(header)[0]))
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def render(self,patch:int,midi_sequence) -> SharedAudio:
+        '''
+        Renders a list of midi_note objects (or (n,v,ton,toff,silence) tuples)
+        with a patch of the server's set.
+        '''
+        notes = [note if isinstance(note,(list,tuple))
+                 else (note.n,note.v,note.ton,note.toff,note.silence)
+                 for note in midi_sequence]
+        notes = [[int(x) for x in note] for note in notes]
+        reply = self._request({'patch':int(patch),'notes':notes})
+        return SharedAudio(self,reply['shm'],reply['offset'],reply['n_samples'])
+
+    def stats(self):
+        '''
+        Server counters: jobs and batches rendered, mean batch size, open blocks.
+        '''
+        reply = self._request({'stats':True})
+        del reply['id']
+        return reply
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+def main(argv=None):
+    from pydx7.dataset import read_patch_set
+    from pydx7.cartridge import unpack_patches
+    from pydx7.envcache import EnvelopeCache
+    parser = argparse.ArgumentParser(prog='python -m pydx7.server',description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('patches',nargs='+',help='cart files or directories of cart files')
+    parser.add_argument('--socket',default=DEFAULT_SOCKET,help='Unix socket path')
+    parser.add_argument('--port',type=int,default=None,help='serve on localhost:PORT instead')
+    parser.add_argument('--sr',type=int,default=44100)
+    parser.add_argument('--block-size',type=int,default=64)
+    parser.add_argument('--feedback',action='store_true',help='render operator feedback')
+    parser.add_argument('--batch-window',type=float,default=0.002,help='seconds')
+    parser.add_argument('--max-batch',type=int,default=64)
+    args = parser.parse_args(argv)
+
+    patches = unpack_patches(read_patch_set(args.patches))
+    if len(patches) == 0:
+        parser.error('no patches found')
+    server = RenderServer(patches,args.sr,args.block_size,args.feedback,
+                          args.batch_window,args.max_batch,EnvelopeCache())
+    path = None if args.port is not None else args.socket
+    print('serving {} patches on {}'.format(len(patches),path or 'localhost:{}'.format(args.port)),
+          file=sys.stderr)
+    try:
+        asyncio.run(server.serve(path,port=args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
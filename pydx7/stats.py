@@ -0,0 +1,98 @@
+import time
+
+class StageStats():
+    '''
+    Accumulated counters of one render stage.
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.samples = 0
+        self.frames = 0
+        self.nbytes = 0
+        self.culled_samples = 0
+        self.culled_ops = 0
+        self.tiled_samples = 0
+
+    def add(self,other):
+        '''
+        Adds the counters of another StageStats.
+        '''
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.samples += other.samples
+        self.frames += other.frames
+        self.nbytes += other.nbytes
+        self.culled_samples += other.culled_samples
+        self.culled_ops += other.culled_ops
+        self.tiled_samples += other.tiled_samples
+
+    def as_dict(self):
+        return {'calls':self.calls,'seconds':self.seconds,'samples':self.samples,
+                'frames':self.frames,'nbytes':self.nbytes,
+                'culled_samples':self.culled_samples,'culled_ops':self.culled_ops,
+                'tiled_samples':self.tiled_samples}
+
+    def __repr__(self):
+        return 'StageStats({})'.format(self.as_dict())
+
+
+class RenderStats():
+    '''
+    Per-stage timing and counters, filled by the functions and classes that
+    take a 'stats' argument (e.g. dx7_synth, dx7tools.render_envelopes).
+    Stages:
+        envelopes: envelope generation (frames rendered)
+        fm: FM rendering, including the interpolation of the control signals (samples)
+        stream: streaming blocks of dx7_synth.process, EGs and FM (samples)
+    For each call, 'nbytes' counts the bytes of the arrays allocated for its output.
+    The fm stage also counts the samples left silent and the operator samples
+    skipped by culling (see synth.dx7_synth, cull_level), and the samples
+    copied from a rendered period of a sustain (sustain_tolerance).
+    '''
+    def __init__(self,callback=None):
+        '''
+        Args:
+            callback: optional function called as callback(stage,counters)
+                after each recorded call, e.g. to export them to a metrics system.
+                'counters' is the dict of the counters of the call (see StageStats).
+        '''
+        self.callback = callback
+        self.stages = {}
+
+    @staticmethod
+    def clock():
+        return time.perf_counter()
+
+    def record(self,stage:str,t0:float,samples:int=0,frames:int=0,nbytes:int=0,
+               culled_samples:int=0,culled_ops:int=0,tiled_samples:int=0):
+        '''
+        Records a call of 'stage' started at t0 (as returned by clock) and ending now.
+        '''
+        call = StageStats()
+        call.calls = 1
+        call.seconds = time.perf_counter() - t0
+        call.samples = samples
+        call.frames = frames
+        call.nbytes = nbytes
+        call.culled_samples = culled_samples
+        call.culled_ops = culled_ops
+        call.tiled_samples = tiled_samples
+        s = self.stages.get(stage)
+        if s is None:
+            s = self.stages[stage] = StageStats()
+        s.add(call)
+        if self.callback is not None:
+            self.callback(stage,call.as_dict())
+
+    def __getitem__(self,stage):
+        return self.stages[stage]
+
+    def reset(self):
+        self.stages = {}
+
+    def as_dict(self):
+        '''
+        Counters of all stages, as a dict of dicts.
+        '''
+        return {name:s.as_dict() for name, s in self.stages.items()}
@@ -1,8 +1,17 @@
+import struct
+import concurrent.futures
 import numpy as np
-from numba import njit
-from .dx7tools import get_modmatrix, get_outmatrix
-from .dx7tools import render_envelopes
-from einops import rearrange
+from numba import njit, prange
+from .dx7tools import get_modmatrix, get_outmatrix, get_schedule
+from .dx7tools import render_envelopes, scale_outlevel
+from .dx7env import EG_STATE_SIZE, eg_init, eg_keydown, eg_getsample
+from .fixedpoint import dx7_fixed_render_control, dx7_fixed_phase_scan, qgain_to_gain_q24
+from .modulation import LFO_STATE_SIZE, modulation_params, amp_mod_sens, modulate_note, lfo_skip
+from .cull import live_ops
+from .sequence import NoteSequence
+
+ENGINE_FLOAT = 'float'
+ENGINE_FIXED = 'fixed'
 
 def upsample(signal, factor):
 
@@ -18,47 +27,530 @@ def upsample(signal, factor):
     return interpolated
 
 
-@njit
+def upsample_grid(n : int, factor : int, start : int, stop : int):
+  """
+  Positions (in frames) of samples [start,stop) in the grid used by
+  upsample for a signal of n frames. Matches np.linspace bit for bit,
+  so a signal can be upsampled piece by piece.
+  """
+  num = n*factor
+  div = num - 1
+  grid = np.arange(start,stop,dtype=float)
+  if div <= 0:
+    return grid*0.0
+  step = np.float64(n-1)/div
+  if step == 0:
+    grid /= div
+    grid *= 0.0
+  else:
+    grid *= step
+  if stop == num and num > 1 and stop > start:
+    grid[-1] = n-1
+  return grid
+
+
+def write_wav_header(f, sr : int, n_samples : int):
+  """
+  Writes the header of a mono 32-bit float WAV file holding n_samples.
+  """
+  data_size = 4*n_samples
+  f.write(struct.pack('<4sI4s4sIHHIIHH4sI',b'RIFF',36 + data_size,b'WAVE',
+                      b'fmt ',16,3,1,sr,4*sr,4,32,b'data',data_size))
+
+
+@njit(cache=True)
+def _dense_edges(modmatrix):
+    """
+    Same as dx7tools.modmatrix_edges, for kernels taking a dense modmatrix.
+    """
+    n_op = modmatrix.shape[0]
+    edges = np.zeros((n_op*n_op,2),dtype=np.int64)
+    n_edges = 0
+    for mod_op in range(n_op-1,-1,-1):
+        for carr_op in range(n_op):
+            if(modmatrix[carr_op,mod_op]):
+                edges[n_edges,0] = mod_op
+                edges[n_edges,1] = carr_op
+                n_edges += 1
+    return edges[:n_edges]
+
+
+# Feedback disabled: (source op, destination op, feedback level 0-7)
+NO_FEEDBACK = np.zeros(3,dtype=np.int64)
+
+@njit(cache=True)
+def _advance_phases(fr, pitch, tstep, phases):
+    for mod_op in range(len(fr)-1,-1,-1):
+        phases[mod_op] += tstep * 2 * np.pi * pitch * fr[mod_op]
+        if(phases[mod_op] > 2 * np.pi):
+            phases[mod_op] -= 2*np.pi
+
+
+@njit(cache=True)
+def _fm_sample(fr, edges, outmatrix, feedback, fb_scale, pitch, ol, tstep, scale,
+               phases, modphases, fbstate):
+    """
+    Renders one sample for the output levels 'ol' [n_op], advancing 'phases' in place.
+      edges: [n_edges,2] (modulator,carrier) schedule (see dx7tools.get_schedule)
+      feedback: (source op, destination op, level) and fb_scale = 2^(level-8),
+        or 0 when feedback is off.
+      fbstate: [2] last two outputs of the feedback source op, updated in place.
+    The sine of an operator with a null level is not computed.
+    """
+    n_op = len(fr)
+    # render current phases for each oscillator.
+    _advance_phases(fr, pitch, tstep, phases)
+
+    # Copy free running phase array to instantly modulate 
+    modphases[:] = phases
+    # Feedback: average of the last two outputs of the source op, as in Dexed.
+    if fb_scale != 0.0:
+        modphases[feedback[1]] += (fbstate[0] + fbstate[1]) * 0.5 * fb_scale * scale
+    # Apply modulation of each modulator to its carriers, following the schedule.
+    # Edges of a modulator are consecutive, so its output is computed once.
+    last_mod = -1
+    mod_output_to_carrier = 0.0
+    for e in range(edges.shape[0]):
+        mod_op = edges[e,0]
+        if mod_op != last_mod:
+            last_mod = mod_op
+            if ol[mod_op] == 0.0:
+                mod_output_to_carrier = 0.0
+                continue
+            # Render sine modulator-to-carrier output, apply output level.
+            mod_output_to_carrier = np.sin(modphases[mod_op]) * ol[mod_op] * scale
+        elif mod_output_to_carrier == 0.0:
+            continue
+        # Modulate phase of carrier
+        modphases[edges[e,1]] += mod_output_to_carrier
+    if fb_scale != 0.0:
+        fbstate[0] = fbstate[1]
+        fbstate[1] = 0.0
+        if ol[feedback[0]] != 0.0:
+            fbstate[1] = np.sin(modphases[feedback[0]]) * ol[feedback[0]]
+
+    out = 0.0
+    for op in range(n_op):
+        if outmatrix[op] and ol[op] != 0.0:
+            out += outmatrix[op] * ol[op] * np.sin(modphases[op])
+    return out
+
+
+# Longest period tiled by the sustain mode of dx7_numba_render_control, in samples.
+MAX_TILE_PERIOD = 8192
+
+# Layout of the sustain tiling state of dx7_numba_render_control, a float64
+# array of TILE_STATE_SIZE + 2*n_op + MAX_TILE_PERIOD values: the scalars below,
+# then the levels of the current run, the phases at the start of the period
+# and the rendered period.
+TILE_IN_RUN = 0
+TILE_PERIOD = 1
+TILE_POS = 2
+TILE_READY = 3
+TILE_RUN_F0 = 4
+TILE_STATE_SIZE = 5
+
+@njit(cache=True)
+def tile_state_size(n_op : int) -> int:
+    return TILE_STATE_SIZE + 2*n_op + MAX_TILE_PERIOD
+
+@njit(cache=True)
+def _tile_period(fr, live, pitch, tstep, tolerance, max_period):
+    """
+    Returns a period (in samples) after which the phases of the 'live'
+    operators come back within tolerance/16 radians of where they started,
+    or the closest one if within tolerance/2, or 0 if the frequencies are
+    not commensurate enough for any period up to max_period.
+    """
+    best_period = 0
+    best_err = np.inf
+    for period in range(1,max_period+1):
+        err = 0.0
+        for op in range(len(fr)):
+            if live[op]:
+                x = (period * (tstep * 2 * np.pi * pitch * fr[op])) % (2 * np.pi)
+                err = max(err,min(x,2 * np.pi - x))
+        if err <= tolerance / 16:
+            return period
+        if err < best_err:
+            best_err = err
+            best_period = period
+    if best_err <= tolerance / 2:
+        return best_period
+    return 0
+
+
+@njit(cache=True)
+def _fb_scale(feedback):
+    if feedback[2] == 0:
+        return 0.0
+    return 2.0**(feedback[2] - 8)
+
+
+@njit(cache=True)
+def dx7_numba_render_from(fr : np.array, modmatrix : np.array, outmatrix : np.array,
+                          pitch : np.array , ol : np.array, sr : int, scale : float,
+                          phases : np.array):
+    """
+    Same as dx7_numba_render, starting from (and updating in place) the
+    free running 'phases' [n_op]. Rendering a signal in consecutive pieces
+    while carrying 'phases' gives the same samples as a single call.
+    """
+    n_op = len(fr)
+    out = np.zeros_like(pitch)
+    tstep = 1/sr
+    edges = _dense_edges(modmatrix)
+    modphases = np.zeros(n_op) # The instantly modulated phase (we just generate an instant value of mod phase.)
+    fbstate = np.zeros(2)
+
+    for s in range(out.shape[0]):
+        out[s] = _fm_sample(fr, edges, outmatrix, NO_FEEDBACK, 0.0, pitch[s], ol[s,:],
+                            tstep, scale, phases, modphases, fbstate)
+
+    return out
+
+
+@njit(cache=True,nogil=True)
+def dx7_numba_render_control(fr : np.array, edges : np.array, outmatrix : np.array,
+                             feedback : np.array, f0 : np.array, ol : np.array,
+                             n_frames : int, factor : int, start : int, stop : int,
+                             frame_offset : int, sr : int, scale : float,
+                             phases : np.array, fbstate : np.array,
+                             cull_level : float, sustain_tolerance : float,
+                             tilestate : np.array, counts : np.array):
+    """
+    Renders samples [start,stop) from control-rate f0 [frames] and output levels
+    [frames,n_op], interpolating them linearly while rendering.
+    Gives the same samples as upsampling both signals (see upsample) and calling
+    dx7_numba_render_from, without building the upsampled arrays.
+      edges, feedback: operator schedule (see dx7tools.get_schedule and _fm_sample)
+      n_frames: total n. of frames of the signal that is being upsampled
+      factor: upsampling factor (i.e. block_size)
+      frame_offset: index of the first frame held in f0 and ol
+      phases: [n_op] free running phases, updated in place.
+      fbstate: [2] feedback state, updated in place.
+      cull_level: operators not heard over a frame (see cull.live_ops) are skipped.
+        With 0, only null levels are skipped and the samples are unchanged.
+      sustain_tolerance: if positive (and feedback is off), runs of frames of
+        constant f0 and levels are rendered one period at a time (see
+        _tile_period) and the period is repeated while every phase stays
+        within sustain_tolerance radians of where the period started.
+        Phases keep being advanced sample by sample, so they end up
+        unchanged. 0 renders every sample.
+      tilestate: [tile_state_size(n_op)] sustain tiling state, updated in place,
+        so that a signal rendered in consecutive pieces is tiled as in a single
+        call. An empty array starts from a null state and discards it.
+      counts: [3] incremented by the n. of samples left silent (only their
+        phases are advanced), the n. of operator samples skipped and the
+        n. of samples copied from a rendered period.
+    The output has the dtype of 'ol'. Phases, sines and the interpolated
+    levels are float64 whatever the dtype: with float32 phases, deep
+    modulation chains amplify the rounding of the sines into audible errors.
+    """
+    n_op = len(fr)
+    out = np.zeros(stop - start,dtype=ol.dtype)
+    tstep = 1/sr
+    fb_scale = _fb_scale(feedback)
+    modphases = np.zeros(n_op)
+    ol_s = np.zeros(n_op)
+    live = np.zeros(n_op,dtype=np.bool_)
+    n_live = 0
+    frame = -1
+    # Sustain mode: period being tiled, phases at its start and position in it.
+    tiling = sustain_tolerance > 0 and fb_scale == 0.0
+    if tilestate.shape[0] == 0:
+        tilestate = np.zeros(tile_state_size(n_op) if tiling else TILE_STATE_SIZE + 2*n_op)
+    run_ol = tilestate[TILE_STATE_SIZE:TILE_STATE_SIZE + n_op]
+    anchor = tilestate[TILE_STATE_SIZE + n_op:TILE_STATE_SIZE + 2*n_op]
+    tile = tilestate[TILE_STATE_SIZE + 2*n_op:]
+    run_f0 = tilestate[TILE_RUN_F0]
+    in_run = tilestate[TILE_IN_RUN] != 0
+    period = int(tilestate[TILE_PERIOD])
+    tile_pos = int(tilestate[TILE_POS])
+    tile_ready = tilestate[TILE_READY] != 0
+    num = n_frames*factor
+    div = num - 1
+    step = 0.0
+    if div > 0:
+        step = (n_frames - 1) / div
+    last = n_frames - 1 - frame_offset
+    for s in range(start,stop):
+        # Same grid as np.linspace(0,n_frames-1,num)
+        if div <= 0:
+            x = 0.0
+        elif step == 0:
+            x = s / div * 0.0
+        else:
+            x = s * step
+        if s == num - 1 and num > 1:
+            x = float(n_frames - 1)
+        j = int(x)
+        frac = x - j
+        j = min(j - frame_offset,last)
+        if j != frame:
+            frame = j
+            k = min(j+1,last)
+            n_live = live_ops(edges, outmatrix, feedback, ol, j, k, cull_level, live)
+            if tiling:
+                # A frame of constant controls continues the run if they did not change.
+                constant = f0[k] == f0[j]
+                same = in_run and f0[j] == run_f0
+                for op in range(n_op):
+                    constant = constant and ol[k,op] == ol[j,op]
+                    same = same and ol[j,op] == run_ol[op]
+                in_run = constant
+                if not constant:
+                    period = 0
+                elif not same:
+                    run_f0 = f0[j]
+                    for op in range(n_op):
+                        run_ol[op] = ol[j,op]
+                    period = _tile_period(fr, live, run_f0, tstep, sustain_tolerance,
+                                          MAX_TILE_PERIOD)
+                    tile_pos = 0
+                    tile_ready = False
+        # Same expressions as np.interp between frames j and j+1
+        if j == last:
+            pitch = f0[last]
+        elif frac == 0.0:
+            pitch = f0[j]
+        else:
+            pitch = (f0[j+1] - f0[j]) / 1.0 * frac + f0[j]
+        counts[1] += n_op - n_live
+        if n_live == 0:
+            # Silent: only the phases (and the feedback state) move on.
+            _advance_phases(fr, pitch, tstep, phases)
+            if fb_scale != 0.0:
+                fbstate[0] = fbstate[1]
+                fbstate[1] = 0.0
+            counts[0] += 1
+            continue
+        if period > 0:
+            if tile_pos == 0:
+                if tile_ready:
+                    # Render a new period once the phases drifted too far.
+                    for op in range(n_op):
+                        d = phases[op] - anchor[op]
+                        if d > np.pi:
+                            d -= 2*np.pi
+                        elif d < -np.pi:
+                            d += 2*np.pi
+                        if live[op] and abs(d) > sustain_tolerance:
+                            tile_ready = False
+                if not tile_ready:
+                    anchor[:] = phases
+            if tile_ready:
+                _advance_phases(fr, pitch, tstep, phases)
+                out[s - start] = tile[tile_pos]
+                counts[2] += 1
+                tile_pos += 1
+                if tile_pos == period:
+                    tile_pos = 0
+                continue
+        for op in range(n_op):
+            if not live[op]:
+                ol_s[op] = 0.0
+            elif j == last:
+                ol_s[op] = ol[last,op]
+            elif frac == 0.0:
+                ol_s[op] = ol[j,op]
+            else:
+                ol_s[op] = (ol[j+1,op] - ol[j,op]) / 1.0 * frac + ol[j,op]
+        y = _fm_sample(fr, edges, outmatrix, feedback, fb_scale, pitch,
+                       ol_s, tstep, scale, phases, modphases, fbstate)
+        out[s - start] = y
+        if period > 0:
+            tile[tile_pos] = y
+            tile_pos += 1
+            if tile_pos == period:
+                tile_pos = 0
+                tile_ready = True
+    tilestate[TILE_RUN_F0] = run_f0
+    tilestate[TILE_IN_RUN] = in_run
+    tilestate[TILE_PERIOD] = period
+    tilestate[TILE_POS] = tile_pos
+    tilestate[TILE_READY] = tile_ready
+    return out
+
+
+@njit(cache=True,nogil=True)
+def dx7_numba_phase_scan(fr : np.array, f0 : np.array, n_frames : int, factor : int,
+                         sr : int, positions : np.array, phases : np.array,
+                         out : np.array):
+    """
+    Advances the free running phases [n_op] of dx7_numba_render_control over
+    its samples without rendering them, up to the last of the ascending sample
+    'positions', and stores in out[i] the phases before sample positions[i].
+    Phases are stepped one sample at a time as in the renderer, so rendering
+    from them gives the same samples.
+    """
+    tstep = 1/sr
+    num = n_frames*factor
+    div = num - 1
+    step = 0.0
+    if div > 0:
+        step = (n_frames - 1) / div
+    last = n_frames - 1
+    i = 0
+    for s in range(num):
+        while i < positions.shape[0] and positions[i] == s:
+            out[i] = phases
+            i += 1
+        if i == positions.shape[0]:
+            break
+        if div <= 0:
+            x = 0.0
+        elif step == 0:
+            x = s / div * 0.0
+        else:
+            x = s * step
+        if s == num - 1 and num > 1:
+            x = float(n_frames - 1)
+        j = int(x)
+        frac = x - j
+        j = min(j,last)
+        if j == last:
+            pitch = f0[last]
+        elif frac == 0.0:
+            pitch = f0[j]
+        else:
+            pitch = (f0[j+1] - f0[j]) / 1.0 * frac + f0[j]
+        _advance_phases(fr, pitch, tstep, phases)
+
+
+@njit(cache=True)
 def dx7_numba_render(fr : np.array, modmatrix : np.array, outmatrix : np.array,
                      pitch : np.array , ol : np.array, sr : int, scale : float = 2*np.pi):
     """
     6-operator FM Renderer with numba
     """    
+    phases = np.zeros(len(fr)) # The free runnin phase
+    return dx7_numba_render_from(fr, modmatrix, outmatrix, pitch, ol, sr, scale, phases)
+
+
+@njit(cache=True)
+def dx7_numba_stream(fr : np.array, edges : np.array, outmatrix : np.array,
+                     feedback : np.array, egstate : np.array, rates : np.array,
+                     levels : np.array, outlevels : np.array, active : bool,
+                     gains : np.array, f0 : np.array, pos : int, block_size : int,
+                     sr : int, scale : float, phases : np.array, fbstate : np.array,
+                     out : np.array) -> int:
+    """
+    Renders len(out) samples of a streaming voice, updating its state in place.
+      edges, feedback: operator schedule (see dx7tools.get_schedule and _fm_sample)
+      egstate: [n_op,EG_STATE_SIZE] EG state rows (see dx7env)
+      rates, levels: [4,n_op] EG settings
+      outlevels: [n_op] scaled output levels
+      active: False until the first note is played
+      gains: [2,n_op] linear gains of the previous and current control frame
+      f0: [2] pitch of the previous and current control frame
+      pos: position (in samples) within the current control frame
+    The EGs are stepped once every block_size samples and the gains and pitch
+    are ramped linearly from the previous frame value to the current one.
+    Returns the new position within the current control frame.
+    """
     n_op = len(fr)
-    out = np.zeros_like(pitch)
-    phases = np.zeros(n_op) # The free runnin phase
     tstep = 1/sr
-    modphases = np.zeros(n_op) # The instantly modulated phase (we just generate an instant value of mod phase.)
-    
+    fb_scale = _fb_scale(feedback)
+    modphases = np.zeros(n_op)
+    ol = np.zeros(n_op)
     for s in range(out.shape[0]):
+        if pos == 0:
+            gains[0,:] = gains[1,:]
+            f0[0] = f0[1]
+            for op in range(n_op):
+                level = eg_getsample(egstate[op], rates[:,op], levels[:,op], outlevels[op])
+                if active:
+                    gains[1,op] = 2**(10 + level * (1.0 / (1 << 24))) / (1 << 24)
+        frac = pos / block_size
+        for op in range(n_op):
+            ol[op] = gains[0,op] + (gains[1,op] - gains[0,op]) * frac
+        pitch = f0[0] + (f0[1] - f0[0]) * frac
+        out[s] = _fm_sample(fr, edges, outmatrix, feedback, fb_scale, pitch, ol,
+                            tstep, scale, phases, modphases, fbstate)
+        pos += 1
+        if pos == block_size:
+            pos = 0
+    return pos
 
-        # render current phases for each oscillator.
-        for mod_op in range(n_op-1,-1,-1):
-            phases[mod_op] += tstep * 2 * np.pi * pitch[s] * fr[mod_op]
-            if(phases[mod_op] > 2 * np.pi):
-                phases[mod_op] -= 2*np.pi
-        
-        # Copy free running phase array to instantly modulate 
-        modphases = phases.copy()
-        # Apply modulation of current modulator to target carriers            
-        for mod_op in range(n_op-1,-1,-1):
-
-            for carr_op in range(n_op):
-
-                # Select modulator ops
-                if(modmatrix[carr_op,mod_op]):
-                    #print("Carrier OP{} modulated by OP{}".format(carr_op+1,mod_op+1))
-                    # Render sine modulator-to-carrier output, apply output level.
-                    mod_ol = ol[s,mod_op]
-                    mod_output_to_carrier = np.sin(modphases[mod_op]) * mod_ol * scale
-                    # Modulate phase of carrier
-                    modphases[carr_op] += mod_output_to_carrier
-                    
-        out[s] = np.sum(outmatrix * ol[s,:] * np.sin(modphases))
 
+@njit(parallel=True,cache=True)
+def dx7_numba_render_batch(fr : np.array, modmatrix : np.array, outmatrix : np.array,
+                           pitch : np.array, ol : np.array, sr : int, scale : float = 2*np.pi):
+    """
+    Renders a batch of independent voices in parallel, one per core.
+    Args:
+      fr: Frequency ratios [batch,n_op]
+      modmatrix: Modulation matrices [batch,n_op,n_op]
+      outmatrix: Output matrices [batch,n_op]
+      pitch: Pitch in Hz [batch,samples]
+      ol: Oscillator output levels [batch,samples,n_op]
+    Each item equals dx7_numba_render on the same inputs, sample for sample.
+    """
+    out = np.zeros_like(pitch)
+    for b in prange(pitch.shape[0]):
+        out[b] = dx7_numba_render(fr[b], modmatrix[b], outmatrix[b],
+                                  pitch[b], ol[b], sr, scale)
     return out
 
 
+@njit(parallel=True,cache=True)
+def dx7_numba_render_sequences(fr : np.array, edges : np.array, n_edges : np.array,
+                               outmatrix : np.array, feedback : np.array, f0 : np.array,
+                               ol : np.array, frame_offsets : np.array, block_size : int,
+                               sr : int, scale : float, cull_level : np.array,
+                               sustain_tolerance : np.array, counts : np.array,
+                               out : np.array):
+    """
+    Renders a batch of control-rate signals of different lengths in parallel.
+    Args:
+      fr: Frequency ratios [batch,n_op]
+      edges, n_edges: schedules [batch,max_edges,2], of n_edges[b] edges each
+      outmatrix, feedback: [batch,n_op] and [batch,3] (see dx7tools.get_schedule)
+      f0, ol: control signals of all items, concatenated [frames] and [frames,n_op]
+      frame_offsets: [batch+1] item b holds frames [frame_offsets[b],frame_offsets[b+1])
+      cull_level, sustain_tolerance, counts: [batch], [batch] and [batch,3]
+        (see dx7_numba_render_control)
+      out: [frames*block_size] output, normalized as in dx7_synth.
+    Each item equals dx7_numba_render_control over its whole length.
+    """
+    n_op = fr.shape[1]
+    for b in prange(fr.shape[0]):
+        start = frame_offsets[b]
+        n_frames = frame_offsets[b+1] - start
+        render = dx7_numba_render_control(fr[b], edges[b,:n_edges[b]], outmatrix[b],
+                                          feedback[b], f0[start:start+n_frames],
+                                          ol[start:start+n_frames], n_frames, block_size,
+                                          0, n_frames*block_size, 0, sr, scale,
+                                          np.zeros(n_op), np.zeros(2), cull_level[b],
+                                          sustain_tolerance[b], np.zeros(0), counts[b])
+        norm = 4*np.sum(outmatrix[b])
+        for s in range(render.shape[0]):
+            out[start*block_size + s] = render[s] / norm
+
+
+def render_batch(fr : np.array, algorithms : np.array, pitch : np.array,
+                 ol : np.array, sr : int = 44100, scale : float = 2*np.pi):
+    """
+    Renders a batch of voices with per-item frequency ratios and algorithms.
+    The output is normalized as in dx7_synth.render_from_osc_envelopes.
+    Args:
+      fr: Frequency ratios [batch,6]
+      algorithms: Algorithm number (0-31) of each item [batch]
+      pitch: Pitch in Hz [batch,samples]
+      ol: Oscillator output levels [batch,samples,6]
+      sr: sample rate in Hz.
+    """
+    modmatrix = np.stack([get_modmatrix(a) for a in algorithms])
+    outmatrix = np.stack([get_outmatrix(a) for a in algorithms])
+    render = dx7_numba_render_batch(np.ascontiguousarray(fr,dtype=float),
+                                    modmatrix,outmatrix,
+                                    np.ascontiguousarray(pitch,dtype=float),
+                                    np.ascontiguousarray(ol,dtype=float),
+                                    sr,scale)
+    return render / (4*outmatrix.sum(axis=1,keepdims=True))
+
+
 """
 Simple class to handle a note
 """
@@ -71,57 +563,517 @@ class midi_note():
     self.silence = silence
 
 
+def sequence_rows(midi_sequence,block:int=4096):
+  """
+  Iterates over the (n,v,ton,toff,silence) fields of the entries of a sequence
+  of midi notes. The columns of a NoteSequence are read directly, a block of
+  entries at a time, without building midi_note objects.
+  """
+  if isinstance(midi_sequence,NoteSequence):
+    for start in range(0,len(midi_sequence),block):
+      yield from zip(*[c[start:start+block].tolist() for c in midi_sequence.columns()])
+    return
+  for entry in midi_sequence:
+    yield entry.n, entry.v, entry.ton, entry.toff, entry.silence
+
+
 class dx7_synth():
-  def __init__(self,specs,sr:int=44100,block_size:int=64):
+  def __init__(self,specs,sr:int=44100,block_size:int=64,envelope_cache=None,
+               engine:str=ENGINE_FLOAT,feedback:bool=False,stats=None,dtype=np.float64,
+               modulation:bool=False,cull_level:float=0.0,sustain_tolerance:float=None):
+    """
+    Args:
+      specs: patch structure (see dx7tools.load_patch)
+      sr: sample rate in Hz.
+      block_size: n. of samples per envelope frame.
+      envelope_cache: optional envcache.EnvelopeCache used to reuse note envelopes.
+      engine: 'float' or 'fixed'. The fixed engine (see fixedpoint) renders
+        sequences and envelopes with integer phases and table lookups.
+        Streaming (process) always uses the float engine.
+      feedback: apply the operator feedback of the patch (specs['feedback']).
+        Off by default, which keeps renders identical to previous versions.
+      stats: optional stats.RenderStats recording the time and size of each
+        render stage ('envelopes', 'fm' and 'stream').
+      dtype: np.float64 or np.float32, the dtype of the envelopes and the audio.
+        The FM kernels compute in float64 and only store float32, so a float32
+        render stays within 1e-7 (max abs, over 110 dB SNR) of the float64 one.
+      modulation: apply the pitch EG and LFO of the patch (see modulation) to
+        sequence renders. They are computed once per envelope frame and folded
+        into the f0 and envelopes, so the FM kernels are unchanged. Streaming
+        (process) is not modulated. Off by default, like feedback.
+      cull_level: linear gain at or below which an operator is not rendered
+        by the sequence renders, for a whole envelope frame. Operators that
+        only modulate culled operators are skipped too, and frames with no
+        operator left are zero-filled. The default only culls null gains
+        (e.g. silences) and leaves the samples unchanged; cull.EG_FLOOR_GAIN
+        also culls envelopes resting at the EG floor (about -84 dB).
+        Culled samples and operator samples are counted in 'stats' ('fm' stage).
+      sustain_tolerance: render sustains (runs of frames of constant f0 and
+        envelopes, i.e. no modulation) of the float engine one period at a
+        time and repeat it, re-rendering a period whenever an operator phase
+        drifts by more than sustain_tolerance radians. Sustains whose
+        operator frequencies have no common period of up to MAX_TILE_PERIOD
+        samples, and renders with feedback, are fully rendered. The error is
+        about sustain_tolerance times the modulation index. None (the
+        default) renders every sample. Repeated samples are counted in
+        'stats' ('fm' stage, tiled_samples).
+    """
+    if engine not in (ENGINE_FLOAT,ENGINE_FIXED):
+      raise ValueError("engine must be '{}' or '{}'".format(ENGINE_FLOAT,ENGINE_FIXED))
+    self.dtype = np.dtype(dtype)
+    if self.dtype not in (np.float32,np.float64):
+      raise ValueError('dtype must be float32 or float64')
+    self.engine = engine
+    self._gain_dtype = np.dtype(np.int64) if engine == ENGINE_FIXED else self.dtype
     self.specs = specs
+    self.envelope_cache = envelope_cache
+    self.stats = stats
     self.modmatrix = get_modmatrix(specs['algorithm'])
     self.outmatrix = get_outmatrix(specs['algorithm'])
+    self.edges, _, fb_ops = get_schedule(specs['algorithm'])
+    self.feedback = np.zeros(3,dtype=np.int64)
+    if feedback:
+      self.feedback[:] = (fb_ops[0],fb_ops[1],specs['feedback'])
     self.fr = np.array(specs['fr'])
     self.scale = 2*np.pi
     self.sr = sr
     self.block_size = block_size
+    self.cull_level = cull_level
+    self.sustain_tolerance = sustain_tolerance
+    self.modulation = modulation
+    if modulation:
+      self._mod_params = modulation_params(specs,sr,block_size)
+      self._pitch_eg_rate = np.array(specs['pitch_eg_rate'],dtype=np.int64)
+      self._pitch_eg_level = np.array(specs['pitch_eg_level'],dtype=np.int64)
+      self._ams = amp_mod_sens(specs)
+    self.reset()
+
+  def reset(self):
+    """
+    Resets the state of the streaming voice (see process).
+    """
+    self._egstate = np.zeros((6,EG_STATE_SIZE),dtype=np.int64)
+    self._eg_rate = np.array(self.specs['eg_rate'],dtype=np.int64)
+    self._eg_level = np.array(self.specs['eg_level'],dtype=np.int64)
+    self._outlevels = np.zeros(6,dtype=np.int64)
+    self._active = False
+    self._gains = np.zeros((2,6))
+    self._f0 = np.zeros(2)
+    self._pos = 0
+    self._phases = np.zeros(6)
+    self._fbstate = np.zeros(2)
+
+  def note_on(self,n:int,v:int):
+    """
+    Starts a note on the streaming voice. The envelopes restart from zero,
+    as for every note of render_from_midi_sequence, while phases keep running.
+    Args:
+      n: MIDI note number
+      v: MIDI velocity
+    """
+    for i in range(6):
+      self._outlevels[i] = scale_outlevel(self.specs['ol'][i],
+                                          self.specs['sensitivity'][i],v)
+      eg_init(self._egstate[i],self._eg_rate[:,i],self._eg_level[:,i],
+              self._outlevels[i])
+    self._f0[1] = 440*2**((n-69)/12)
+    self._active = True
+
+  def note_off(self):
+    """
+    Releases the note playing on the streaming voice.
+    """
+    for i in range(6):
+      eg_keydown(self._egstate[i],self._eg_rate[:,i],self._eg_level[:,i],
+                 self._outlevels[i],0)
+
+  def process(self,n_samples:int):
+    """
+    Renders the next n_samples of the streaming voice.
+    Oscillator phases, EG state and the position within the current
+    envelope frame persist across calls, so the output does not depend on
+    how a stream is split into blocks. Envelopes are stepped once per
+    block_size samples and interpolated linearly between frames.
+    The stream is causal, so it does not match render_from_midi_sequence:
+    each block ramps from the previous frame to the current one, while the
+    offline render ramps towards the next frame on a grid spanning the whole
+    sequence. The controls differ by up to one frame, and the relative RMS
+    difference with the offline render of a note is a few % for held notes
+    (median 4% over random patches), up to tens of % for short notes or fast
+    envelopes. A note_off releases the EGs from the next frame, one frame
+    earlier than a note of as many frames_on. iter_render_from_midi_sequence
+    renders in chunks with the same samples as the offline render.
+    Args:
+      n_samples: number of samples to render.
+    """
+    if self.stats is not None:
+      t0 = self.stats.clock()
+    out = np.zeros(n_samples,dtype=self.dtype)
+    self._pos = dx7_numba_stream(self.fr,self.edges,self.outmatrix,self.feedback,
+                                 self._egstate,self._eg_rate,self._eg_level,
+                                 self._outlevels,self._active,self._gains,
+                                 self._f0,self._pos,self.block_size,self.sr,
+                                 self.scale,self._phases,self._fbstate,out)
+    out /= 4*sum(self.outmatrix)
+    if self.stats is not None:
+      self.stats.record('stream',t0,samples=n_samples,nbytes=out.nbytes)
+    return out
   
   def render_from_osc_envelopes(self,f0: np.array,ol: np.array):
     """
-    Renders from a sequence of output levels and f0
+    Renders from a sequence of output levels and f0.
+    Both are interpolated to audio rate inside the FM kernel.
     Args:
       f0: Fudamental frequency vector of size seq_len
       ol: Oscillator output levels format [seq_len,n_osc]
       block_size : int 
       sr: sample rate in Hz.
     """
-    ol_up = upsample(ol,self.block_size)
-    f0_up = upsample(f0,self.block_size)
-    print(f0_up.shape)
-    print(ol_up.shape)
-    render = dx7_numba_render(self.fr,self.modmatrix,self.outmatrix,
-                    f0_up,ol_up,self.sr,self.scale)
-    return render / (4*sum(self.outmatrix))
+    if self.engine == ENGINE_FIXED:
+      ol = np.round(np.asarray(ol)*(1 << 24)).astype(np.int64)
+    return self._render_control(np.ascontiguousarray(f0,dtype=float),ol,len(f0),
+                                0,len(f0)*self.block_size,0,self._new_state())
+
+  def _new_state(self):
+    """
+    Returns zeroed (phases, feedback state, tiling state) for the selected engine.
+    The tiling state is only allocated when sustains are tiled.
+    """
+    if self.engine == ENGINE_FIXED:
+      return np.zeros(6,dtype=np.int64), np.zeros(2,dtype=np.int64), np.zeros(0)
+    if self.sustain_tolerance:
+      return np.zeros(6), np.zeros(2), np.zeros(tile_state_size(6))
+    return np.zeros(6), np.zeros(2), np.zeros(0)
+
+  def _render_control(self,f0,ol,n_frames,start,stop,frame_offset,state):
+    """
+    Renders samples [start,stop) from control-rate f0 and gains with the selected engine.
+    'state' holds the (phases, feedback state, tiling state) arrays, updated in place.
+    """
+    if self.stats is not None:
+      t0 = self.stats.clock()
+    ol = np.ascontiguousarray(ol)
+    counts = np.zeros(3,dtype=np.int64)
+    render = self._run_control(f0,ol,n_frames,start,stop,frame_offset,state,counts)
+    if self.stats is not None:
+      self.stats.record('fm',t0,samples=stop - start,nbytes=render.nbytes,
+                        culled_samples=int(counts[0]),culled_ops=int(counts[1]),
+                        tiled_samples=int(counts[2]))
+    return render
 
-  def render_from_midi_sequence(self,midi_sequence):
+  def _run_control(self,f0,ol,n_frames,start,stop,frame_offset,state,counts):
+    """
+    Kernel call of _render_control, without stats. 'counts' [3] is updated in place.
+    """
+    phases, fbstate, tilestate = state
+    if self.engine == ENGINE_FIXED:
+      render = dx7_fixed_render_control(self.fr,self.edges,self.outmatrix,self.feedback,
+                                        f0,ol,n_frames,self.block_size,start,stop,
+                                        frame_offset,self.sr,phases,fbstate,
+                                        int(self.cull_level*(1 << 24)),counts)
+      render = render.astype(self.dtype,copy=False)
+    else:
+      render = dx7_numba_render_control(self.fr,self.edges,self.outmatrix,self.feedback,
+                                        f0,ol.astype(self.dtype,copy=False),n_frames,
+                                        self.block_size,start,stop,frame_offset,
+                                        self.sr,self.scale,phases,fbstate,
+                                        self.cull_level,self.sustain_tolerance or 0.0,
+                                        tilestate,counts)
+    render /= 4*sum(self.outmatrix)
+    return render
+
+  def _segment_starts(self,f0,ol,n_segments:int):
+    """
+    Returns up to n_segments-1 ascending sample positions splitting the render of
+    f0 [frames] and ol [frames,6] (as passed to the kernels) into segments that
+    give the same samples when rendered on their own from the phases at their
+    start. The rest of the render state must then be the same as at the start
+    of a render:
+      - with feedback, the feedback state is null after two silent samples
+        (see cull.live_ops), so segments start two samples into a silent frame.
+      - with sustain tiling, segments start on a frame whose f0 or levels change,
+        where the tiling starts over.
+      - otherwise, the phases are the only state and the segments are even.
+    """
+    n_frames = len(f0)
+    n_samples = n_frames*self.block_size
+    if n_frames < 2 or n_segments < 2:
+      return np.zeros(0,dtype=np.int64)
+    targets = np.arange(1,n_segments,dtype=np.int64)*n_samples//n_segments
+    feedback = self.feedback[2] != 0
+    tiling = self.engine == ENGINE_FLOAT and bool(self.sustain_tolerance) and not feedback
+    if not feedback and not tiling:
+      return np.unique(targets[targets > 0])
+    k = np.minimum(np.arange(n_frames) + 1,n_frames - 1)
+    if feedback:
+      cull_level = self.cull_level
+      if self.engine == ENGINE_FIXED:
+        cull_level = int(self.cull_level*(1 << 24))
+      heard = self.outmatrix != 0
+      heard[self.feedback[0]] = True
+      loud = (np.abs(ol[:,heard]) > cull_level).any(axis=1)
+      frames = np.flatnonzero(~loud & ~loud[k])
+      offset = 2
+    else:
+      frames = np.flatnonzero((f0[k] != f0) | (ol[k] != ol).any(axis=1))
+      offset = 0
+    # First sample of each frame on the grid of the kernels: int(s*step) >= frame.
+    step = (n_frames - 1)/(n_samples - 1)
+    first = np.ceil(frames/step).astype(np.int64)
+    first -= (first - 1)*step >= frames
+    first += first*step < frames
+    candidates = first + offset
+    following = np.ceil((frames + 1)/step).astype(np.int64)
+    following -= (following - 1)*step >= frames + 1
+    following += following*step < frames + 1
+    candidates = candidates[(candidates <= following) & (candidates > 0) &
+                            (candidates < n_samples - 1)]
+    if len(candidates) == 0:
+      return candidates
+    idx = np.clip(np.searchsorted(candidates,targets),1,max(len(candidates) - 1,1))
+    left = candidates[idx - 1]
+    right = candidates[np.minimum(idx,len(candidates) - 1)]
+    return np.unique(np.where(targets - left <= right - targets,left,right))
+
+  def _render_segments(self,f0,ol,workers:int):
+    """
+    Renders f0 [frames] and ol [frames,6] in segments (see _segment_starts) on
+    'workers' threads. Each segment starts from the phases found by a phase-only
+    pass over the samples before it, and the samples equal those of _render_control.
+    """
+    if self.stats is not None:
+      t0 = self.stats.clock()
+    n_frames = len(f0)
+    n_samples = n_frames*self.block_size
+    if self.engine == ENGINE_FLOAT:
+      ol = ol.astype(self.dtype,copy=False)
+    ol = np.ascontiguousarray(ol)
+    # More segments than workers: silences and tiled sustains make their cost uneven.
+    splits = self._segment_starts(f0,ol,4*workers)
+    bounds = np.concatenate([[0],splits,[n_samples]])
+    phases = self._new_state()[0]
+    starts = np.zeros((len(splits),len(phases)),dtype=phases.dtype)
+    scan = dx7_fixed_phase_scan if self.engine == ENGINE_FIXED else dx7_numba_phase_scan
+    scan(self.fr,f0,n_frames,self.block_size,self.sr,splits,phases,starts)
+    out = np.zeros(n_samples,dtype=self.dtype)
+    counts = np.zeros((len(bounds) - 1,3),dtype=np.int64)
+
+    def render(i):
+      state = self._new_state()
+      if i > 0:
+        state[0][:] = starts[i-1]
+      out[bounds[i]:bounds[i+1]] = self._run_control(f0,ol,n_frames,bounds[i],bounds[i+1],
+                                                      0,state,counts[i])
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+      list(executor.map(render,range(len(bounds) - 1)))
+    if self.stats is not None:
+      counts = counts.sum(axis=0)
+      self.stats.record('fm',t0,samples=n_samples,nbytes=out.nbytes,
+                        culled_samples=int(counts[0]),culled_ops=int(counts[1]),
+                        tiled_samples=int(counts[2]))
+    return out
+
+  def _render_entry(self,n,v,ton,toff,silence,lfostate=None):
+    """
+    Returns the envelopes [frames,6] and the note contour [frames] of a sequence
+    entry, given its fields (see midi_note).
+    Envelopes are linear gains for the float engine and Q24 gains for the fixed one.
+    With modulation, 'lfostate' is the LFO state row, which runs across entries.
+    """
+    # The fixed engine and the modulation work on the log envelopes, which need float64.
+    env_dtype = self.dtype
+    if self.engine == ENGINE_FIXED or self.modulation:
+      env_dtype = np.float64
+    if(silence == 0):
+      if(self.envelope_cache is None):
+        env,qenv = render_envelopes(self.specs,v,ton,toff,stats=self.stats,dtype=env_dtype)
+      else:
+        env,qenv = self.envelope_cache.render_envelopes(self.specs,v,ton,toff,
+                                                        stats=self.stats,dtype=env_dtype)
+      contour = np.full(ton+toff,n,dtype=float)
+      if self.modulation:
+        # Cached envelopes are shared, modulate copies.
+        env, qenv = env.copy(), qenv.copy()
+        modulate_note(self._mod_params,lfostate,self._pitch_eg_rate,self._pitch_eg_level,
+                      self._ams,ton,qenv,env,contour)
+      if self.engine == ENGINE_FIXED:
+        env = qgain_to_gain_q24(qenv.T.copy(),np.zeros((qenv.shape[1],6),dtype=np.int64))
+      else:
+        env = env.T.astype(self.dtype,copy=False)
+      return env, contour
+    if self.modulation:
+      lfo_skip(self._mod_params,lfostate,silence)
+    return np.zeros((silence,6),dtype=self._gain_dtype), np.zeros(silence)
+
+  def _new_lfo_state(self):
+    """
+    Returns a zeroed LFO state row (see modulation).
+    """
+    return np.zeros(LFO_STATE_SIZE,dtype=np.int64)
+
+  @staticmethod
+  def sequence_frames(midi_sequence):
+    """
+    Number of envelope frames of a sequence of midi notes.
+    """
+    if isinstance(midi_sequence,NoteSequence):
+      return midi_sequence.n_frames
+    return sum(entry.ton+entry.toff if entry.silence == 0 else entry.silence
+               for entry in midi_sequence)
+
+  def render_from_midi_sequence(self,midi_sequence,workers:int=1):
     """ 
     Renders audio from a sequence of midi notes
     Args:
-      midi_sequence: List of midi_note objects
+      midi_sequence: List of midi_note objects, or a NoteSequence
+      workers: n. of threads rendering segments of the sequence in parallel.
+        The samples are the same whatever the number.
     """
-    envelopes = np.empty((6,0))
-    note_contour = np.empty(0)
-    
-    # Iterate through sequence and render envelopes
-    for entry in midi_sequence:
-      # Render oscillator envelopes
-      if(entry.silence == 0):
-        env,qenv = render_envelopes(self.specs,entry.v,entry.ton,entry.toff)
-        envelopes = np.append(envelopes,env,axis=1)
-        note_contour = np.append(note_contour,np.ones(entry.ton+entry.toff)*entry.n)
-      else:
-        # Append silence to envelopes
-        envelopes = np.append(envelopes,np.zeros((6,entry.silence)),axis=1)
-        # Append silence on the pitch contour
-        note_contour = np.append(note_contour,np.zeros(entry.silence))
-    
-    f0 = 440*2**((note_contour-69)/12)
-    envelopes = rearrange(envelopes,"oscillators frames -> frames oscillators")
-    audio = self.render_from_osc_envelopes(f0,envelopes)
+    f0, envelopes = self.sequence_controls(midi_sequence)
+    n_frames = len(f0)
+    if workers > 1 and n_frames > 1:
+      return self._render_segments(f0,envelopes,workers)
+    audio = self._render_control(f0,envelopes,n_frames,0,n_frames*self.block_size,
+                                 0,self._new_state())
 
     return audio
+
+  def sequence_controls(self,midi_sequence):
+    """
+    Returns the control-rate f0 [frames] and envelopes [frames,6] that
+    render_from_midi_sequence renders a sequence of midi notes from.
+    """
+    n_frames = self.sequence_frames(midi_sequence)
+    envelopes = np.zeros((n_frames,6),dtype=self._gain_dtype)
+    note_contour = np.zeros(n_frames)
+
+    # Iterate through sequence and render envelopes in place
+    t = 0
+    lfostate = self._new_lfo_state()
+    for row in sequence_rows(midi_sequence):
+      env,contour = self._render_entry(*row,lfostate)
+      envelopes[t:t+len(contour)] = env
+      note_contour[t:t+len(contour)] = contour
+      t += len(contour)
+
+    f0 = 440*2**((note_contour-69)/12)
+    return f0, envelopes
+
+  def iter_render_from_midi_sequence(self,midi_sequence,chunk_size:int=65536):
+    """
+    Renders audio from a sequence of midi notes, chunk by chunk.
+    Yields the same samples as render_from_midi_sequence, while only keeping
+    the envelopes of the notes that overlap the current chunk in memory.
+    Args:
+      midi_sequence: List of midi_note objects, or a NoteSequence
+      chunk_size: n. of samples per yielded chunk.
+    """
+    n_frames = self.sequence_frames(midi_sequence)
+    n_samples = n_frames*self.block_size
+    state = self._new_state()
+    lfostate = self._new_lfo_state()
+    entries = sequence_rows(midi_sequence)
+    env_buf = np.zeros((0,6),dtype=self._gain_dtype)
+    contour_buf = np.zeros(0)
+    buf_start = 0 # frame index of the first buffered frame
+    for start in range(0,n_samples,chunk_size):
+      stop = min(start + chunk_size,n_samples)
+      first = int(upsample_grid(n_frames,self.block_size,start,start + 1)[0])
+      last = int(upsample_grid(n_frames,self.block_size,stop - 1,stop)[0])
+      last = min(last + 1,n_frames - 1)
+      # Drop frames behind the chunk and pull entries until it is covered.
+      env_buf = env_buf[first - buf_start:]
+      contour_buf = contour_buf[first - buf_start:]
+      buf_start = first
+      while buf_start + len(contour_buf) <= last:
+        env,contour = self._render_entry(*next(entries),lfostate)
+        env_buf = np.concatenate([env_buf,env])
+        contour_buf = np.concatenate([contour_buf,contour])
+      f0 = 440*2**((contour_buf-69)/12)
+      yield self._render_control(f0,env_buf,n_frames,start,stop,buf_start,state)
+
+  def render_midi_sequence_to(self,midi_sequence,out,chunk_size:int=65536):
+    """
+    Renders a sequence of midi notes chunk by chunk straight into 'out'.
+    Args:
+      midi_sequence: List of midi_note objects
+      out: a float array of the rendered length, a file object that receives
+        raw float32 samples, or a path. Paths ending in '.wav' are written as
+        32-bit float WAV files, other paths as raw float32.
+      chunk_size: n. of samples rendered at a time.
+    Returns the number of samples written.
+    """
+    if isinstance(out,np.ndarray):
+      t = 0
+      for chunk in self.iter_render_from_midi_sequence(midi_sequence,chunk_size):
+        out[t:t+len(chunk)] = chunk
+        t += len(chunk)
+      return t
+    if isinstance(out,str):
+      with open(out,'wb') as f:
+        if out.lower().endswith('.wav'):
+          n_samples = self.sequence_frames(midi_sequence)*self.block_size
+          write_wav_header(f,self.sr,n_samples)
+        return self.render_midi_sequence_to(midi_sequence,f,chunk_size)
+    t = 0
+    for chunk in self.iter_render_from_midi_sequence(midi_sequence,chunk_size):
+      out.write(chunk.astype(np.float32).tobytes())
+      t += len(chunk)
+    return t
+
+
+def render_sequences(synths, midi_sequences, out=None):
+  """
+  Renders a midi sequence with each synth (float engine) in one parallel kernel call.
+  Args:
+    synths: dx7_synth objects sharing the same sr and block_size
+    midi_sequences: one list of midi_note objects (or NoteSequence) per synth
+    out: optional float array receiving the concatenated renders, e.g. a
+      buffer in shared memory. A float64 array is allocated if None.
+  Returns (out, offsets): item i is out[offsets[i]:offsets[i+1]] and equals
+  synths[i].render_from_midi_sequence(midi_sequences[i]) of a float64 synth,
+  cast to the dtype of 'out'.
+  """
+  if len(synths) == 0:
+    return (np.zeros(0) if out is None else out), np.zeros(1,dtype=np.int64)
+  sr, block_size = synths[0].sr, synths[0].block_size
+  for synth in synths:
+    if synth.engine != ENGINE_FLOAT or synth.sr != sr or synth.block_size != block_size:
+      raise ValueError('synths must use the float engine and share sr and block_size')
+  controls = [synth.sequence_controls(seq) for synth, seq in zip(synths,midi_sequences)]
+  frame_offsets = np.zeros(len(synths) + 1,dtype=np.int64)
+  frame_offsets[1:] = np.cumsum([len(f0) for f0, _ in controls])
+  n_edges = np.array([len(synth.edges) for synth in synths],dtype=np.int64)
+  edges = np.zeros((len(synths),max(n_edges.max(),1),2),dtype=np.int64)
+  for b, synth in enumerate(synths):
+    edges[b,:n_edges[b]] = synth.edges
+  if out is None:
+    out = np.zeros(frame_offsets[-1]*block_size)
+  counts = np.zeros((len(synths),3),dtype=np.int64)
+  all_stats = []
+  for synth in synths:
+    if synth.stats is not None and all(synth.stats is not other for other in all_stats):
+      all_stats.append(synth.stats)
+  if len(all_stats) > 0:
+    t0 = all_stats[0].clock()
+  dx7_numba_render_sequences(np.stack([synth.fr for synth in synths]).astype(float),
+                             edges,n_edges,
+                             np.stack([synth.outmatrix for synth in synths]),
+                             np.stack([synth.feedback for synth in synths]),
+                             np.concatenate([f0 for f0, _ in controls]),
+                             np.concatenate([env for _, env in controls]).astype(float,copy=False),
+                             frame_offsets,block_size,sr,synths[0].scale,
+                             np.array([synth.cull_level for synth in synths],dtype=float),
+                             np.array([synth.sustain_tolerance or 0.0 for synth in synths],
+                                      dtype=float),
+                             counts,out)
+  # The batch time is not split between synths: each stats object records the
+  # batch once, with the counters of its synths.
+  for stats in all_stats:
+    mine = np.array([synth.stats is stats for synth in synths])
+    samples = int((frame_offsets[1:] - frame_offsets[:-1])[mine].sum())*block_size
+    total = counts[mine].sum(axis=0)
+    stats.record('fm',t0,samples=samples,culled_samples=int(total[0]),culled_ops=int(total[1]),
+                 tiled_samples=int(total[2]))
+  return out, frame_offsets*block_size
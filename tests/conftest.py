@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+from pydx7.cartridge import Cartridge
+
+
+@pytest.fixture(scope='session')
+def random_cart():
+    '''
+    32 voices of random packed bytes. Unpacking clamps every field to its
+    range, so they are valid patches.
+    '''
+    rng = np.random.default_rng(0)
+    return Cartridge.from_packed(rng.integers(0, 128, (32, 128), dtype=np.uint8))
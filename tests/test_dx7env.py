@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from pydx7.dx7env import EnvelopeGenerator, eg_render_kernel, scaleoutlevel, scalevelocity
+from pydx7.dx7tools import render_env
+
+# Parity of the compiled EG with the EnvelopeGenerator class it replaced.
+# Levels in doubling log format must be identical, linear gains may differ
+# in the last ulp (numba's pow against CPython's).
+
+N_FRAMES = 256
+
+
+def reference_env(rates, levels, outlevel, frames_on, n_frames, ratio=1.0):
+    '''
+    Renders an envelope with EnvelopeGenerator, as dx7tools.render_env did.
+    '''
+    e = EnvelopeGenerator(list(rates), list(levels), outlevel)
+    e.keydown(True)
+    gain = np.zeros(n_frames)
+    qgain = np.zeros(n_frames)
+    for i in range(n_frames):
+        qgain[i] = e.getsample() * ratio
+        gain[i] = 2**(10 + qgain[i] * (1.0 / (1 << 24))) / (1 << 24)
+        if i == frames_on:
+            e.keydown(False)
+    return gain, qgain
+
+
+def reference_outlevel(ol, sens, velocity):
+    return max(0, (scaleoutlevel(ol) << 5) + scalevelocity(velocity, sens))
+
+
+def grid_case(rate, level):
+    '''
+    EG settings of the grid case (rate, level): every stage sees every value.
+    '''
+    rates = [rate, 99 - rate, (rate + 50) % 100, (rate + 25) % 100]
+    levels = [level, 99 - level, (level + 50) % 100, (level + 25) % 100]
+    outlevel = reference_outlevel((rate + level) % 100, rate % 8, (level * 13) % 128)
+    return rates, levels, outlevel
+
+
+def assert_parity(gain, qgain, ref_gain, ref_qgain):
+    np.testing.assert_array_equal(qgain, ref_qgain)
+    assert np.all(np.abs(gain - ref_gain) <= np.spacing(ref_gain))
+
+
+@pytest.mark.parametrize('rate', range(100))
+def test_eg_render_kernel_grid(rate):
+    # One kernel call renders the 100 levels of a rate as 100 operators.
+    cases = [grid_case(rate, level) for level in range(100)]
+    rates = np.array([c[0] for c in cases], dtype=np.int64).T.copy()
+    levels = np.array([c[1] for c in cases], dtype=np.int64).T.copy()
+    outlevels = np.array([c[2] for c in cases], dtype=np.int64)
+    frames_on = N_FRAMES // 2
+    gain = np.zeros((100, N_FRAMES))
+    qgain = np.zeros((100, N_FRAMES))
+    eg_render_kernel(rates, levels, outlevels, frames_on, np.ones(100), gain, qgain)
+    for level, (r, l, ol) in enumerate(cases):
+        ref_gain, ref_qgain = reference_env(r, l, ol, frames_on, N_FRAMES)
+        assert_parity(gain[level], qgain[level], ref_gain, ref_qgain)
+
+
+@pytest.mark.parametrize('frames_on', [0, 1, 7, N_FRAMES - 2, N_FRAMES - 1, N_FRAMES])
+def test_render_env_release(frames_on):
+    rng = np.random.default_rng(frames_on)
+    for _ in range(50):
+        rates = rng.integers(0, 100, 4)
+        levels = rng.integers(0, 100, 4)
+        ol, sens, velocity = int(rng.integers(0, 100)), int(rng.integers(0, 8)), int(rng.integers(0, 128))
+        ratio = float(rng.choice([1.0, 0.5, 1.25]))
+        gain, qgain = render_env(rates, levels, ol, sens, velocity, frames_on,
+                                 N_FRAMES - frames_on, ratio)
+        ref_gain, ref_qgain = reference_env(rates, levels, reference_outlevel(ol, sens, velocity),
+                                            frames_on, N_FRAMES, ratio)
+        assert_parity(gain, qgain, ref_gain, ref_qgain)
+
+
+def eg_state(e):
+    return (e.ix, e.level, e.targetlevel, e.inc, e.rising, e.down)
+
+
+def stepped_states(rates, levels, outlevel, frames_on, n_frames):
+    '''
+    States of an EnvelopeGenerator after each getsample call, released after
+    frames_on + 1 calls, and the frames at which a segment starts.
+    '''
+    e = EnvelopeGenerator(list(rates), list(levels), outlevel)
+    states = [eg_state(e)]
+    boundaries = []
+    for i in range(n_frames):
+        if i == frames_on + 1:
+            e.keydown(False)
+        ix = e.ix
+        e.getsample()
+        if e.ix != ix:
+            boundaries.append(i + 1)
+        states.append(eg_state(e))
+    return states, boundaries
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_seek_matches_stepping(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        rates = rng.integers(0, 100, 4)
+        levels = rng.integers(0, 100, 4)
+        outlevel = reference_outlevel(int(rng.integers(0, 100)), int(rng.integers(0, 8)),
+                                      int(rng.integers(0, 128)))
+        frames_on = int(rng.integers(0, N_FRAMES))
+        states, boundaries = stepped_states(rates, levels, outlevel, frames_on, 2*N_FRAMES)
+        # Random points, segment boundaries and their neighbours, points around
+        # the release and in the middle of it.
+        points = set(rng.integers(0, 2*N_FRAMES, 10).tolist())
+        for b in boundaries:
+            points.update((b - 1, b, b + 1))
+        points.update((frames_on, frames_on + 1, frames_on + 2, (frames_on + 2*N_FRAMES)//2))
+        for p in sorted(points):
+            if not 0 <= p <= 2*N_FRAMES:
+                continue
+            e = EnvelopeGenerator(list(rates), list(levels), outlevel)
+            if p <= frames_on + 1:
+                e.seek(p)
+            else:
+                # Seek to the release, release, then seek into it.
+                e.seek(frames_on + 1)
+                e.keydown(False)
+                e.seek(p - frames_on - 1)
+            assert eg_state(e) == states[p]
+
+
+def test_seek_zero_and_chained():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        rates = rng.integers(0, 100, 4)
+        levels = rng.integers(0, 100, 4)
+        outlevel = reference_outlevel(int(rng.integers(0, 100)), 0, 100)
+        states, _ = stepped_states(rates, levels, outlevel, N_FRAMES, N_FRAMES)
+        e = EnvelopeGenerator(list(rates), list(levels), outlevel)
+        e.seek(0)
+        assert eg_state(e) == states[0]
+        t = 0
+        for n in rng.integers(0, 40, 8):
+            e.seek(int(n))
+            t += int(n)
+            assert eg_state(e) == states[t]
@@ -0,0 +1,45 @@
+import numpy as np
+from numba.core.registry import CPUDispatcher
+import pydx7.cull
+import pydx7.dx7env
+import pydx7.fixedpoint
+import pydx7.modulation
+import pydx7.poly
+import pydx7.synth
+from pydx7.dataset import render_item, ITEM_DTYPE
+from pydx7.envcache import EnvelopeCache
+from pydx7.jit import warmup
+from pydx7.sequence import NoteSequence
+from pydx7.synth import dx7_synth, midi_note, render_sequences
+
+MODULES = (pydx7.cull, pydx7.dx7env, pydx7.fixedpoint, pydx7.modulation, pydx7.poly, pydx7.synth)
+
+
+def compiled_signatures():
+    return {(module.__name__, name): len(value.signatures)
+            for module in MODULES for name, value in vars(module).items()
+            if isinstance(value, CPUDispatcher)}
+
+
+def test_warmup_covers_entry_points(random_cart):
+    warmup()
+    before = compiled_signatures()
+    seq = [midi_note(60, 100, 20, 10), midi_note(0, 0, 0, 0, 5), midi_note(67, 80, 10, 10)]
+    for dtype in (np.float64, np.float32):
+        for engine in ('float', 'fixed'):
+            synth = dx7_synth(random_cart[1], engine=engine, dtype=dtype, feedback=True,
+                              envelope_cache=EnvelopeCache())
+            synth.render_from_midi_sequence(NoteSequence.from_notes(seq), workers=2)
+            list(synth.iter_render_from_midi_sequence(seq, chunk_size=1000))
+        synth = dx7_synth(random_cart[2], dtype=dtype, sustain_tolerance=1e-3, cull_level=1e-4)
+        synth.render_from_midi_sequence(seq)
+        synth.note_on(60, 100)
+        synth.process(100)
+        synths = [dx7_synth(random_cart[i], dtype=dtype) for i in range(3)]
+        out = np.zeros(3*dx7_synth.sequence_frames(seq)*64, dtype=dtype)
+        render_sequences(synths, [seq]*3, out)
+    item = np.zeros((), dtype=ITEM_DTYPE)
+    item['note'], item['velocity'], item['frames_on'] = 60, 100, 20
+    for modulation in (False, True):
+        render_item(random_cart[3], item, 40, modulation=modulation)
+    assert compiled_signatures() == before
@@ -0,0 +1,114 @@
+import io
+import pytest
+from pydx7.midifile import (read_midi_file, iter_midi_file, iter_track_events, EVENT_NOTE_ON, EVENT_NOTE_OFF,
+                            EVENT_TEMPO, EVENT_END)
+from pydx7.sequence import NoteSequence
+
+# At 96 ticks per quarter note and 120 bpm, a tick lasts 1/192 s: one frame
+# of 64 samples at 12288 Hz.
+DIVISION = 96
+SR = 12288
+BLOCK_SIZE = 64
+
+
+def var_len(n):
+    out = [n & 0x7f]
+    n >>= 7
+    while n:
+        out.append(0x80 | (n & 0x7f))
+        n >>= 7
+    return bytes(reversed(out))
+
+
+def track(*events):
+    '''
+    Track chunk data from (delta ticks, event bytes) pairs, ended by an End of Track.
+    '''
+    data = b''.join(var_len(delta) + bytes(event) for delta, event in events)
+    return data + b'\x00\xff\x2f\x00'
+
+
+def smf(*tracks, division=DIVISION):
+    data = b'MThd' + (6).to_bytes(4, 'big')
+    data += (1).to_bytes(2, 'big') + len(tracks).to_bytes(2, 'big') + division.to_bytes(2, 'big')
+    for t in tracks:
+        data += b'MTrk' + len(t).to_bytes(4, 'big') + t
+    return io.BytesIO(data)
+
+
+def read(*tracks, **kwargs):
+    return read_midi_file(smf(*tracks), SR, BLOCK_SIZE, **kwargs)
+
+
+def notes(*rows):
+    return NoteSequence.from_notes(rows)
+
+
+def test_running_status_and_null_velocity_note_off():
+    data = track((0, [0x90, 60, 100]), (10, [60, 0]), (0, [62, 90]), (10, [0x80, 62, 64]),
+                 (5, [0x91, 64, 80]), (5, [64, 0]))
+    assert list(iter_track_events(data)) == [
+        (0, EVENT_NOTE_ON, 0, 60, 100), (10, EVENT_NOTE_OFF, 0, 60, 0),
+        (10, EVENT_NOTE_ON, 0, 62, 90), (20, EVENT_NOTE_OFF, 0, 62, 64),
+        (25, EVENT_NOTE_ON, 1, 64, 80), (30, EVENT_NOTE_OFF, 1, 64, 0),
+        (30, EVENT_END, 0, 0, 0)]
+    assert read(data) == notes((60, 100, 10, 0, 0), (62, 90, 10, 5, 0), (64, 80, 5, 0, 0))
+
+
+def test_running_status_skips_other_channel_messages():
+    # Program change (1 data byte) and pitch bend (2 data bytes) under running status.
+    data = track((0, [0xc0, 5]), (0, [7]), (0, [0xe0, 0, 64]), (0, [0, 64]),
+                 (0, [0x90, 60, 100]), (4, [60, 0]))
+    assert read(data) == notes((60, 100, 4, 0, 0))
+
+
+@pytest.mark.parametrize('event', [[0xff, 0x01, 2, 0x41, 0x42], [0xf0, 2, 0x7e, 0xf7],
+                                   [0xf7, 1, 0x00]])
+def test_meta_and_sysex_cancel_running_status(event):
+    data = track((0, [0x90, 60, 100]), (0, event), (4, [60, 0]))
+    with pytest.raises(ValueError):
+        list(iter_track_events(data))
+    data = track((0, [0x90, 60, 100]), (0, event), (4, [0x90, 60, 0]))
+    assert read(data) == notes((60, 100, 4, 0, 0))
+
+
+def test_overlapping_notes_are_cut():
+    # 64 starts before 60 ends: 60 is cut, and its late note off is ignored.
+    data = track((2, [0x90, 60, 100]), (5, [0x90, 64, 90]), (5, [0x80, 60, 0]),
+                 (10, [0x80, 64, 0]))
+    assert read(data) == notes((0, 0, 0, 0, 2), (60, 100, 5, 0, 0), (64, 90, 15, 0, 0))
+    assert read(data, release_frames=4) == notes((0, 0, 0, 0, 2), (60, 100, 5, 0, 0),
+                                                 (64, 90, 15, 4, 0))
+
+
+def test_retriggered_note():
+    # A second note on of the same note restarts it, the note off ends the second one.
+    data = track((0, [0x90, 60, 100]), (8, [0x90, 60, 50]), (4, [0x80, 60, 0]),
+                 (8, [0xff, 0x01, 0]))
+    assert read(data) == notes((60, 100, 8, 0, 0), (60, 50, 4, 8, 0))
+
+
+def test_channel_filter():
+    data = track((0, [0x90, 60, 100]), (5, [0x91, 72, 90]), (5, [0x80, 60, 0]),
+                 (5, [0x81, 72, 0]))
+    assert read(data, channels=[1]) == notes((0, 0, 0, 0, 5), (72, 90, 10, 0, 0))
+    assert read(data, channels=[0]) == notes((60, 100, 10, 5, 0))
+    assert read(data) == notes((60, 100, 5, 0, 0), (72, 90, 10, 0, 0))
+    assert len(read(data, channels=[2])) == 0
+
+
+def test_tempo_changes():
+    # Conductor track: 240 bpm (2 ticks per frame) from the start, 120 bpm from tick 40.
+    conductor = track((0, [0xff, 0x51, 3, 0x03, 0xd0, 0x90]), (40, [0xff, 0x51, 3, 0x07, 0xa1, 0x20]))
+    assert list(iter_track_events(conductor)) == [
+        (0, EVENT_TEMPO, 0, 250000, 0), (40, EVENT_TEMPO, 0, 500000, 0), (40, EVENT_END, 0, 0, 0)]
+    melody = track((0, [0x90, 60, 100]), (30, [0x80, 60, 0]), (10, [0x90, 62, 100]),
+                   (20, [0x80, 62, 0]))
+    assert read(conductor, melody) == notes((60, 100, 15, 5, 0), (62, 100, 20, 0, 0))
+
+
+def test_chunks():
+    data = track(*[(1, [0x90, 60 + i % 12, 100]) for i in range(10)], (1, [0x80, 69, 0]))
+    chunks = list(iter_midi_file(smf(data), SR, BLOCK_SIZE, chunk_size=4))
+    assert [len(c) for c in chunks] == [4, 4, 3]
+    assert NoteSequence.concatenate(chunks) == read(data)
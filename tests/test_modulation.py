@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from pydx7.modulation import (modulation_params, lfo_keydown, lfo_getsample, lfo_getdelay,
+                              pitch_eg_render, MOD_PITCH_UNIT, LFO_STATE_SIZE)
+
+# Reference vectors of the LFO and pitch EG at 44.1 kHz with 64 sample frames,
+# from a line by line Python port of Dexed's lfo.cc and pitchenv.cc.
+
+SR = 44100
+BLOCK_SIZE = 64
+FRAMES = [0, 1, 2, 3, 10, 31, 64, 100, 199, 287, 399]
+
+
+def lfo_specs(speed=0, delay=0, sync=0, waveform=0):
+    return dict(lfo_speed=speed, lfo_delay=delay, lfo_pmd=0, lfo_amd=0, lfo_sync=sync,
+                lfo_waveform=waveform, pitch_mod_sens=0, amp_mod_sens=[0]*6)
+
+
+# (waveform, speed, delay, sync, LFO values, delay ramp) at FRAMES.
+LFO_VECTORS = [
+    (0, 35, 0, 1,
+     [16494462, 16211709, 15928956, 15646202, 13666929, 7729111, 1601747, 11780865, 6219008,
+      2453135, 4339199],
+     [16777215, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216,
+      16777216, 16777216, 16777216]),
+    (1, 50, 20, 0,
+     [8187538, 7986469, 7785400, 7584331, 6176848, 1954399, 12096338, 4857854, 1729239,
+      812383, 11847087],
+     [0, 0, 0, 0, 0, 0, 1501784, 10714400, 16777216, 16777216, 16777216]),
+    (2, 71, 0, 1,
+     [313599, 627198, 940797, 1254396, 3449590, 10035170, 3606725, 14896292, 12388170,
+      6430458, 7999125],
+     [16777215, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216,
+      16777216, 16777216, 16777216]),
+    (3, 20, 60, 1,
+     [0, 0, 0, 0, 0, 0, 0, 0, 16777216, 0, 16777216],
+     [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2964104]),
+    (4, 99, 0, 0,
+     [10204535, 11934353, 13496001, 14815445, 14053283, 13788465, 16768268, 7990722, 5579203,
+      8479900, 3094281],
+     [16777215, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216,
+      16777216, 16777216, 16777216]),
+    (5, 60, 0, 1,
+     [8454144, 8454144, 8454144, 8454144, 8454144, 8454144, 9568256, 9568256, 3014656,
+      8978432, 12386304],
+     [16777215, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216, 16777216,
+      16777216, 16777216, 16777216]),
+]
+
+# (rates, levels, frames_on, Q24 pitch EG) at FRAMES, the last one replaced by 299.
+PITCH_EG_VECTORS = [
+    ([99, 99, 99, 99], [99, 0, 99, 50], 5,
+     [291465, 582930, 874395, 1165860, 291465, 0, 0, 0, 0, 0, 0]),
+    ([40, 60, 30, 50], [70, 30, 60, 50], 150,
+     [30861, 61722, 92583, 123444, 339471, 987552, 2005965, 3116961, 2363724, 0, 0]),
+    ([20, 20, 20, 80], [0, 99, 10, 60], 30,
+     [5229164, 5215448, 5201732, 5188016, 5092004, 4949129, 5242880, 5242880, 5242880,
+      5242880, 5242880]),
+    ([75, 50, 90, 35], [50, 50, 50, 50], 10,
+     [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]),
+    ([60, 45, 70, 25], [85, 20, 95, 40], 200,
+     [-5176586, -5110292, -5043998, -4977704, -4513646, -3121472, -933770, 1452814, 8015920,
+      6690040, 6498016]),
+]
+
+
+@pytest.mark.parametrize('waveform,speed,delay,sync,values,ramp', LFO_VECTORS)
+def test_lfo_reference(waveform, speed, delay, sync, values, ramp):
+    params = modulation_params(lfo_specs(speed, delay, sync, waveform), SR, BLOCK_SIZE)
+    state = np.zeros(LFO_STATE_SIZE, dtype=np.int64)
+    lfo_keydown(params, state)
+    out = np.zeros((FRAMES[-1] + 1, 2), dtype=np.int64)
+    for i in range(len(out)):
+        out[i] = lfo_getsample(params, state), lfo_getdelay(params, state)
+    assert out[FRAMES, 0].tolist() == values
+    assert out[FRAMES, 1].tolist() == ramp
+
+
+@pytest.mark.parametrize('rates,levels,frames_on,pitch', PITCH_EG_VECTORS)
+def test_pitch_eg_reference(rates, levels, frames_on, pitch):
+    unit = modulation_params(lfo_specs(), SR, BLOCK_SIZE)[MOD_PITCH_UNIT]
+    out = np.zeros(300, dtype=np.int64)
+    pitch_eg_render(np.array(rates, dtype=np.int64), np.array(levels, dtype=np.int64),
+                    unit, frames_on, out)
+    assert out[FRAMES[:-1] + [299]].tolist() == pitch
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from pydx7.cull import EG_FLOOR_GAIN
+from pydx7.synth import dx7_synth, midi_note
+
+# Renders split in segments on several threads (render_from_midi_sequence
+# with workers > 1) must equal the serial render sample for sample.
+
+CONFIGS = [
+    dict(),
+    dict(feedback=True),
+    dict(engine='fixed'),
+    dict(engine='fixed', feedback=True),
+    dict(dtype=np.float32),
+    dict(dtype=np.float32, feedback=True),
+    dict(sustain_tolerance=1e-3),
+    dict(sustain_tolerance=1e-2, cull_level=EG_FLOOR_GAIN, dtype=np.float32),
+    dict(feedback=True, cull_level=EG_FLOOR_GAIN, modulation=True),
+]
+
+
+def random_sequence(rng, n_notes=30):
+    seq = []
+    for _ in range(n_notes):
+        seq.append(midi_note(int(rng.integers(40, 90)), int(rng.integers(1, 128)),
+                             int(rng.integers(0, 200)), int(rng.integers(0, 100))))
+        if rng.random() < 0.5:
+            seq.append(midi_note(silence=int(rng.integers(1, 40))))
+    return seq
+
+
+def patch_with(random_cart, i, algorithm, feedback):
+    patch = random_cart.patches[i:i+1].copy()
+    patch['algorithm'] = algorithm
+    patch['feedback'] = feedback
+    return patch[0]
+
+
+@pytest.mark.parametrize('algorithm', [0, 3, 5, 15, 31])
+@pytest.mark.parametrize('config', CONFIGS, ids=lambda c: ','.join(c) or 'default')
+def test_segments_match_serial(random_cart, algorithm, config):
+    rng = np.random.default_rng(algorithm)
+    specs = patch_with(random_cart, algorithm % len(random_cart), algorithm, 7)
+    synth = dx7_synth(specs, **config)
+    seq = random_sequence(rng)
+    serial = synth.render_from_midi_sequence(seq)
+    # The sequence is split in at least a few segments.
+    f0, ol = synth.sequence_controls(seq)
+    if synth.engine == 'float':
+        ol = ol.astype(synth.dtype)
+    assert len(synth._segment_starts(f0, ol, 12)) >= 3
+    for workers in (2, 3):
+        parallel = synth.render_from_midi_sequence(seq, workers=workers)
+        assert parallel.dtype == serial.dtype
+        np.testing.assert_array_equal(parallel, serial)
@@ -0,0 +1,31 @@
+import numpy as np
+from numba.core.registry import CPUDispatcher
+import pydx7.dx7env
+import pydx7.synth
+from pydx7.server import RenderServer
+from pydx7.synth import dx7_synth, midi_note
+
+
+def compiled_signatures():
+    return {(module.__name__, name): len(value.signatures)
+            for module in (pydx7.dx7env, pydx7.synth) for name, value in vars(module).items()
+            if isinstance(value, CPUDispatcher)}
+
+
+def test_job_after_warmup_does_not_compile(random_cart):
+    server = RenderServer(random_cart)
+    server.warmup()
+    assert len(server._blocks) == 0
+    before = compiled_signatures()
+    jobs = [(1, [midi_note(60, 100, 30, 10)], None),
+            (2, [midi_note(0, 0, 0, 0, 4), midi_note(72, 90, 20, 20)], None)]
+    block, offsets = server._render(jobs)
+    try:
+        audio = np.ndarray(offsets[-1], dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+    assert compiled_signatures() == before
+    for i, (patch, notes, _) in enumerate(jobs):
+        ref = dx7_synth(random_cart[patch]).render_from_midi_sequence(notes)
+        np.testing.assert_array_equal(audio[offsets[i]:offsets[i+1]], ref.astype(np.float32))
@@ -0,0 +1,47 @@
+import numpy as np
+from pydx7.stats import RenderStats
+from pydx7.synth import dx7_synth, midi_note, render_sequences
+
+SEQ = [midi_note(60, 100, 40, 20), midi_note(0, 0, 0, 0, 30), midi_note(64, 90, 20, 10)]
+
+
+def test_callback_counters(random_cart):
+    calls = []
+    stats = RenderStats(callback=lambda stage, counters: calls.append((stage, counters)))
+    synth = dx7_synth(random_cart[0], stats=stats, sustain_tolerance=1e-3)
+    synth.render_from_midi_sequence(SEQ)
+    fm = [counters for stage, counters in calls if stage == 'fm']
+    assert len(fm) == 1
+    assert fm[0] == dict(stats['fm'].as_dict())
+    assert fm[0]['culled_samples'] > 0
+    # Every counter of the stages is forwarded.
+    totals = {}
+    for stage, counters in calls:
+        assert set(counters) == set(stats[stage].as_dict())
+        for name, value in counters.items():
+            totals.setdefault(stage, {}).setdefault(name, 0)
+            totals[stage][name] += value
+    for stage, counters in totals.items():
+        for name, value in counters.items():
+            assert np.isclose(value, getattr(stats[stage], name))
+
+
+def test_render_sequences_records_batch(random_cart):
+    shared = RenderStats()
+    own = RenderStats()
+    synths = [dx7_synth(random_cart[i], stats=shared) for i in range(3)]
+    synths.append(dx7_synth(random_cart[3], stats=own))
+    t0 = shared.clock()
+    out, offsets = render_sequences(synths, [SEQ]*4)
+    elapsed = shared.clock() - t0
+    assert shared['fm'].calls == 1 and own['fm'].calls == 1
+    assert shared['fm'].samples == offsets[3] and own['fm'].samples == offsets[4] - offsets[3]
+    single = RenderStats()
+    for synth in synths[:3]:
+        synth.stats = single
+        synth.render_from_midi_sequence(SEQ)
+    assert shared['fm'].culled_samples == single['fm'].culled_samples
+    assert shared['fm'].culled_ops == single['fm'].culled_ops
+    # The kernel time is recorded, not only the time of the record call.
+    assert 0 < shared['fm'].seconds <= elapsed
+    assert shared['fm'].seconds > 1e-3 * elapsed
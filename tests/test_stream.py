@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from pydx7.synth import dx7_synth, midi_note, dx7_numba_render_from, upsample
+
+# The streaming voice (dx7_synth.process) against the offline render of the
+# same note. The stream ramps each block from the previous envelope frame to
+# the current one, so it is compared exactly with a render of the offline
+# controls delayed by one frame, and within bounds with the offline render.
+
+SR = 44100
+BLOCK_SIZE = 64
+
+
+def stream_note(synth, n, v, ton, toff):
+    '''
+    Streams a note of ton + toff frames, released as render_from_midi_sequence
+    releases it (after ton + 1 frames), in uneven blocks.
+    '''
+    synth.reset()
+    synth.note_on(n, v)
+    on = (ton + 1)*BLOCK_SIZE
+    off = (toff - 1)*BLOCK_SIZE
+    out = [synth.process(k) for k in np.diff(np.r_[0:on:1000, on])]
+    synth.note_off()
+    out += [synth.process(k) for k in np.diff(np.r_[0:off:333, off])]
+    return np.concatenate(out)
+
+
+def delayed_controls(env, n_samples):
+    '''
+    Per-sample gains of the stream: frame k is ramped from envelope frame k-1
+    (null before the note) to frame k.
+    '''
+    g = np.concatenate([np.zeros((1, env.shape[1])), env])
+    k = np.arange(n_samples)//BLOCK_SIZE
+    frac = (np.arange(n_samples) % BLOCK_SIZE / BLOCK_SIZE)[:, None]
+    return g[k] + (g[k + 1] - g[k])*frac
+
+
+@pytest.mark.parametrize('patch', range(0, 32, 4))
+def test_process_split_invariance(random_cart, patch):
+    synth = dx7_synth(random_cart[patch], SR, BLOCK_SIZE)
+    synth.note_on(60, 100)
+    whole = synth.process(20*BLOCK_SIZE)
+    synth.reset()
+    synth.note_on(60, 100)
+    parts = np.concatenate([synth.process(k) for k in (1, 63, 64, 500, 652)])
+    np.testing.assert_array_equal(parts, whole)
+
+
+@pytest.mark.parametrize('ton,toff', [(8, 8), (40, 30), (200, 50)])
+def test_process_delayed_controls(random_cart, ton, toff):
+    for i in range(len(random_cart)):
+        synth = dx7_synth(random_cart[i], SR, BLOCK_SIZE)
+        out = stream_note(synth, 60, 100, ton, toff)
+        f0, env = synth.sequence_controls([midi_note(60, 100, ton, toff)])
+        ref = dx7_numba_render_from(synth.fr, synth.modmatrix, synth.outmatrix,
+                                    np.full(len(out), f0[0]), delayed_controls(env, len(out)),
+                                    SR, synth.scale, np.zeros(6))
+        ref /= 4*sum(synth.outmatrix)
+        np.testing.assert_allclose(out, ref, rtol=0, atol=1e-12)
+
+
+def test_process_offline_deviation(random_cart):
+    # The controls are at most one frame apart.
+    ton, toff = 200, 50
+    errors = []
+    for i in range(len(random_cart)):
+        synth = dx7_synth(random_cart[i], SR, BLOCK_SIZE)
+        seq = [midi_note(60, 100, ton, toff)]
+        _, env = synth.sequence_controls(seq)
+        n_samples = len(env)*BLOCK_SIZE
+        stream_gains = delayed_controls(env, n_samples)
+        offline_gains = upsample(env, BLOCK_SIZE)
+        padded = np.concatenate([np.zeros((1, 6)), env, env[-1:]])
+        k = np.arange(n_samples)//BLOCK_SIZE
+        lo = np.minimum(np.minimum(padded[k], padded[k + 1]), padded[k + 2])
+        hi = np.maximum(np.maximum(padded[k], padded[k + 1]), padded[k + 2])
+        for gains in (stream_gains, offline_gains):
+            assert np.all((gains >= lo - 1e-12) & (gains <= hi + 1e-12))
+
+        out = stream_note(synth, 60, 100, ton, toff)
+        offline = synth.render_from_midi_sequence(seq)
+        errors.append(np.sqrt(np.mean((out - offline)**2)/max(np.mean(offline**2), 1e-24)))
+    # Relative RMS differences, as documented in dx7_synth.process.
+    assert np.median(errors) < 0.1
+    assert np.max(errors) < 0.75